@@ -0,0 +1,106 @@
+import os
+import pickle
+import random
+import shutil
+import numpy as np
+
+SIMULATOR_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROGRESS_TO_CSV = {"score": "Current_Score", "wickets": "Wickets",
+                   "overs": "Overs", "balls": "Balls",
+                   "striker": "Striker", "striker_runs": "Striker_Runs",
+                   "striker_balls": "Striker_Balls",
+                   "non_striker": "Non_Striker",
+                   "non_striker_runs": "Non_Striker_Runs",
+                   "non_striker_balls": "Non_Striker_Balls",
+                   "bowler": "Bowler", "bowler_runs": "Bowler_Runs",
+                   "bowler_overs": "Bowler_Overs",
+                   "bowler_balls": "Bowler_Balls",
+                   "bowler_wickets": "Bowler_Wickets",
+                   "free_hit": "Free_Hit", "result": "Result"}
+
+
+def vocabularies(cols):
+    from Utils.helper import NUMERIC_COLS
+
+    def names(prefix):
+        return sorted(c[len(prefix):] for c in cols if c.startswith(prefix)
+                      and c not in NUMERIC_COLS)
+    return names("Bowler_"), names("Toss_"), names("Venue_")
+
+
+def random_model(n_inp, hidden=(64,), seed=0):
+    # Tiny random-weight dense network with the real input width. The output
+    # bias follows the rough shape of real ball outcomes so that innings last
+    # a realistic number of balls.
+    from Utils.inference import NumpyModel
+    rng = np.random.default_rng(seed)
+    sizes = [n_inp] + list(hidden) + [57]
+    layers = []
+    for i in range(len(sizes) - 1):
+        W = rng.normal(0, 0.3 / np.sqrt(sizes[i]), (sizes[i], sizes[i+1]))
+        layers.append({"W": W.astype(np.float32),
+                       "b": np.zeros(sizes[i+1], dtype=np.float32),
+                       "activation": "relu" if i < len(sizes) - 2
+                       else "softmax"})
+    prior = np.full(57, 0.002)
+    prior[[1, 2, 3, 5, 7, 8, 9, 10, 36, 50]] = [0.38, 0.33, 0.07, 0.11, 0.045,
+                                                0.01, 0.03, 0.006, 0.015, 0.03]
+    layers[-1]["b"] = np.log(prior / prior.sum()).astype(np.float32)
+    return NumpyModel(layers)
+
+
+def prepare_workspace(root):
+    # The Utils modules read their pickles relative to the working directory,
+    # so the workspace mirrors GitData/ and fills Data/ with vocabularies
+    # derived from the real column layouts. root has to be the working
+    # directory, as Utils.helper loads GitData/ when it is imported.
+    os.makedirs(os.path.join(root, "GitData"), exist_ok=True)
+    os.makedirs(os.path.join(root, "Data"), exist_ok=True)
+    for name in ["BF_Cols.pkl", "BS_Cols.pkl"]:
+        src = os.path.join(SIMULATOR_DIR, "GitData", name)
+        shutil.copy(src, os.path.join(root, "GitData", name))
+        shutil.copy(src, os.path.join(root, "Data", name))
+    with open(os.path.join(root, "Data", "BS_Cols.pkl"), "rb") as fp:
+        cols = pickle.load(fp)
+    players, teams, venue = vocabularies(cols)
+    for name, values in [["Players", players], ["Teams", teams],
+                         ["Venue", venue]]:
+        with open(os.path.join(root, "Data", name+".pkl"), "wb") as fp:
+            pickle.dump(values, fp)
+
+
+def generate_ball_by_ball(root, model_inn_1, model_inn_2, n_matches=20,
+                          seed=0):
+    # Writes Data/Batting_First.csv and Data/Chasing.csv in the layout of the
+    # real data by simulating matches between the sample squads
+    import pandas as pd
+    from Utils.helper import Innings, BF_Cols, BS_Cols
+    from Utils.sample_squads import (
+        CSK_Squad, CSK_Pitch, RCB_Squad, RCB_Pitch, MI_Squad, MI_Pitch,
+        KKR_Squad, KKR_Pitch)
+    teams = [[CSK_Squad, CSK_Pitch], [RCB_Squad, RCB_Pitch],
+             [MI_Squad, MI_Pitch], [KKR_Squad, KKR_Pitch]]
+    random.seed(seed)
+    frames = [[], []]
+    for _ in range(n_matches):
+        (a, venue), (b, _) = random.sample(teams, 2)
+        toss = random.choice([a, b])[0][0]
+        inn1 = Innings(a[0], b[1], toss, venue, 1,
+                       pd.DataFrame(columns=BF_Cols))
+        target = inn1.simulate_inning(model_inn_1)
+        inn2 = Innings(b[0], a[1], toss, venue, 2,
+                       pd.DataFrame(columns=BS_Cols), target)
+        inn2.simulate_inning(model_inn_2)
+        for inn, frame in [[inn1, frames[0]], [inn2, frames[1]]]:
+            df = inn.inn_progress_df.rename(columns=PROGRESS_TO_CSV)
+            df.insert(0, "Toss", inn.Toss)
+            df.insert(1, "Venue", inn.Venue)
+            df.insert(2, "Batting_Team", inn.Batting_Team)
+            df.insert(3, "Bowling_Team", inn.Bowling_Team)
+            if inn.innings == 2:
+                df["Target"] = inn.Target
+            frame.append(df)
+    for name, frame in [["Batting_First.csv", frames[0]],
+                        ["Chasing.csv", frames[1]]]:
+        pd.concat(frame, ignore_index=True).to_csv(
+            os.path.join(root, "Data", name), index=False)
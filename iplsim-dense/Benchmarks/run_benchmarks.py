@@ -0,0 +1,239 @@
+import argparse
+import contextlib
+import gc
+import io
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+sys.path.insert(0, BENCHMARK_DIR)
+
+from fixtures import (prepare_workspace, random_model,  # noqa: E402
+                      generate_ball_by_ball)
+
+SIZES = {"quick": {"innings": 10, "matches": 4, "batch": 64, "csv": 10,
+                   "onehot": 2000, "scorecards": 20},
+         "full": {"innings": 50, "matches": 20, "batch": 512, "csv": 60,
+                  "onehot": 20000, "scorecards": 112}}
+
+
+def peak_rss_mb():
+    # High-water mark of the whole process, so measure() is run in a fresh
+    # process per benchmark (see run_one) for it to belong to one benchmark
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def measure(name, unit, setup, run, seed=0):
+    # run(state) returns the number of units it processed. Each benchmark is
+    # timed once without tracing, then run again under tracemalloc for the
+    # allocation figures since tracing slows the run down.
+    state = setup()
+    gc.collect()
+    random.seed(seed)
+    gen0 = gc.get_stats()[0]["collections"]
+    start = time.perf_counter()
+    units = run(state)
+    seconds = time.perf_counter() - start
+    gen0 = gc.get_stats()[0]["collections"] - gen0
+
+    state = setup()
+    gc.collect()
+    random.seed(seed)
+    tracemalloc.start()
+    blocks = sys.getallocatedblocks()
+    run(state)
+    blocks = sys.getallocatedblocks() - blocks
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"name": name, "unit": unit, "units": units, "seconds": seconds,
+            unit+"_per_sec": units / seconds if seconds else 0,
+            "peak_rss_mb": peak_rss_mb(),
+            "traced_peak_mb": traced_peak / 2**20,
+            "live_blocks_delta": blocks, "gc_gen0_collections": gen0}
+
+
+def bench_models(seed):
+    from Utils.helper import BF_Cols, BS_Cols
+    return [random_model(len(BF_Cols), seed=seed),
+            random_model(len(BS_Cols), seed=seed + 1)]
+
+
+def run_one(task):
+    # Runs in a spawned process with the workspace as working directory;
+    # its peak RSS covers the interpreter, the models and this benchmark
+    name, size, seed = task
+    for bench_name, unit, setup, run in benchmarks(SIZES[size],
+                                                   bench_models(seed)):
+        if bench_name == name:
+            return measure(name, unit, setup, run, seed)
+
+
+def benchmarks(sizes, models):
+    import pandas as pd
+    from Utils.helper import Innings, Match, BF_Cols, display_batting_table
+    from Utils.batch_simulation import simulate_innings_batch
+    from Utils.scorecard import render_innings_batch
+    from Utils.evaluation import EvaluationMetrics, ActualStats
+    from Utils.data_generator import get_onehot
+    from Utils.sample_squads import (RCB_Squad, CSK_Squad, CSK_Pitch)
+    model_inn_1, model_inn_2 = models
+
+    def new_innings(n):
+        inn1_df = pd.DataFrame(columns=BF_Cols)
+        return [Innings(RCB_Squad[0], CSK_Squad[1], CSK_Squad[0][0],
+                        CSK_Pitch, 1, inn1_df) for _ in range(n)]
+
+    # Both engines count every delivery, wides and no balls included
+    def run_simulate_inning(inns):
+        for inn in inns:
+            inn.simulate_inning(model_inn_1)
+        return sum(len(inn.Results) for inn in inns)
+
+    def run_batch(inns):
+        simulate_innings_batch(inns, model_inn_1)
+        return sum(len(inn.Results) for inn in inns)
+
+    def run_match(n):
+        with contextlib.redirect_stdout(io.StringIO()):
+            for _ in range(n):
+                Match(RCB_Squad, CSK_Squad, CSK_Pitch, model_inn_1,
+                      model_inn_2, Result=0)
+        return n
+
+    def run_evaluation(evaluator):
+        for _ in range(sizes["matches"]):
+            evaluator.simulate_match()
+        return sizes["matches"]
+
+    def run_actual_stats(actual):
+        actual.run_df(1)
+        actual.run_df(2)
+        return actual.BF_df.shape[0] + actual.BS_df.shape[0]
+
+    def run_onehot(df):
+        get_onehot(df)
+        return df.shape[0]
+
+    def scorecard_innings():
+        inns = new_innings(sizes["scorecards"])
+        simulate_innings_batch(inns, model_inn_1)
+        return inns
+
+    def run_display(inns):
+        with contextlib.redirect_stdout(io.StringIO()):
+            for inn in inns:
+                display_batting_table(inn)
+        return len(inns)
+
+    def run_render(inns):
+        render_innings_batch(inns, "text")
+        render_innings_batch(inns, "json")
+        return len(inns)
+
+    def onehot_rows():
+        df = pd.read_csv("Data/Batting_First.csv")
+        reps = sizes["onehot"] // df.shape[0] + 1
+        return pd.concat([df] * reps, ignore_index=True)[:sizes["onehot"]]
+
+    return [
+        ["Innings.simulate_inning", "balls",
+         lambda: new_innings(sizes["innings"]), run_simulate_inning],
+        ["simulate_innings_batch", "balls",
+         lambda: new_innings(sizes["batch"]), run_batch],
+        ["Match", "matches", lambda: sizes["matches"], run_match],
+        ["EvaluationMetrics.simulate_match", "matches",
+         lambda: EvaluationMetrics(model_inn_1, model_inn_2),
+         run_evaluation],
+        ["ActualStats.run_df", "rows", ActualStats, run_actual_stats],
+        ["get_onehot", "rows", onehot_rows, run_onehot],
+        ["display_batting_table", "innings", scorecard_innings, run_display],
+        ["render_innings_batch", "innings", scorecard_innings, run_render],
+    ]
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    old = {x["name"]: x for x in baseline["results"]}
+    for res in results:
+        if res["name"] not in old:
+            continue
+        key = res["unit"] + "_per_sec"
+        ratio = res[key] / old[res["name"]][key]
+        flag = ""
+        if ratio < 1 - threshold:
+            flag = "  REGRESSION"
+            regressions.append(res["name"])
+        print(f"{res['name']:<36} {ratio:6.2f}x baseline{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmarks for the simulation, ingestion and "
+        "training-data hot paths on synthetic fixtures")
+    parser.add_argument("--size", choices=list(SIZES), default="quick")
+    parser.add_argument("--only", nargs="*", default=None,
+                        help="names of the benchmarks to run")
+    parser.add_argument("--save", default=None,
+                        help="write the results as a JSON baseline")
+    parser.add_argument("--compare", default=None,
+                        help="JSON baseline to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="allowed slowdown before flagging a regression")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    sizes = SIZES[args.size]
+    save = os.path.abspath(args.save) if args.save else None
+    baseline_path = os.path.abspath(args.compare) if args.compare else None
+
+    workspace = tempfile.mkdtemp(prefix="iplsim-bench-")
+    os.chdir(workspace)
+    prepare_workspace(workspace)
+    models = bench_models(args.seed)
+    generate_ball_by_ball(workspace, *models, n_matches=sizes["csv"],
+                          seed=args.seed)
+
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for name, unit, _, _ in benchmarks(sizes, models):
+        if args.only and name not in args.only:
+            continue
+        pool = context.Pool(1)
+        res = pool.apply(run_one, ([name, args.size, args.seed],))
+        pool.close()
+        pool.join()
+        results.append(res)
+        print(f"{name:<36} {res[unit+'_per_sec']:12.1f} {unit}/sec  "
+              f"peak RSS {res['peak_rss_mb']:.0f} MB  "
+              f"traced peak {res['traced_peak_mb']:.1f} MB")
+
+    output = {"note": "Timings are specific to the machine that wrote "
+              "this file; save a baseline on the machine that compares "
+              "against it.",
+              "size": args.size, "seed": args.seed,
+              "python": platform.python_version(),
+              "machine": platform.machine(), "created": time.time(),
+              "results": results}
+    if save:
+        with open(save, "w") as fp:
+            json.dump(output, fp, indent=1)
+    if baseline_path:
+        with open(baseline_path) as fp:
+            baseline = json.load(fp)
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
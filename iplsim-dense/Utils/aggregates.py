@@ -0,0 +1,196 @@
+import itertools
+import pickle
+import numpy as np
+import pandas as pd
+
+ALL = "*"
+ROLES = {"striker": "Striker", "non_striker": "Non_Striker",
+         "bowler": "Bowler"}
+PHASES = [["powerplay", 1, 6], ["middle", 7, 15], ["death", 16, 20]]
+OVER_TO_PHASE = {over: name for name, start, end in PHASES
+                 for over in range(start, end + 1)}
+# Dimensions that are rolled up, and the order in which prior() backs off
+BACKOFF = ["venue", "phase", "innings", "player"]
+code_effects_cache = {}
+
+
+def code_effects():
+    # Per result code effects on the striker and the bowler, measured by
+    # playing every code through a fresh Innings so that they always agree
+    # with Innings.ball_prediction
+    if code_effects_cache:
+        return code_effects_cache
+    from Utils.equivalence import new_innings
+    from Utils.sample_squads import RCB_Squad, CSK_Squad, CSK_Pitch
+    fixture = [RCB_Squad[0], CSK_Squad[1], CSK_Squad[0][0], CSK_Pitch, 0]
+    effects = {name: np.zeros(57) for name in [
+        "batsman_runs", "balls_faced", "bowler_runs", "bowler_balls",
+        "bowler_wickets", "team_runs", "wickets"]}
+    for code in range(57):
+        inn = new_innings(fixture, 1)
+        inn.Forced_Draws = itertools.repeat(0)
+        striker, bowler = inn.Striker, inn.Bowler
+        inn.ball_prediction(code)
+        effects["batsman_runs"][code] = striker.Runs
+        effects["balls_faced"][code] = striker.Balls
+        effects["bowler_runs"][code] = bowler.Runs_Conceded
+        effects["bowler_balls"][code] = (6 * bowler.Overs_Bowled
+                                         + bowler.Balls_Bowled)
+        effects["bowler_wickets"][code] = len(bowler.Wickets_Taken)
+        effects["team_runs"][code] = inn.Runs
+        effects["wickets"][code] = inn.Wickets
+    code_effects_cache.update(effects)
+    return code_effects_cache
+
+
+class AggregateIndex():
+    # Counts of the 57 result codes for every (player, role, venue, phase,
+    # innings) key, together with every rollup where some of player, venue,
+    # phase and innings are ALL, so that any combination is a single dict
+    # lookup. New seasons are added with update().
+    def __init__(self, load_path=None):
+        self.index = {}
+        self.counts = np.zeros((0, 57), dtype=np.int64)
+        self.sources = []
+        if load_path is not None:
+            self.load_object(load_path)
+
+    def __len__(self):
+        return len(self.index)
+
+    def add(self, keys, counts):
+        new = [key for key in dict.fromkeys(keys) if key not in self.index]
+        if new:
+            for key in new:
+                self.index[key] = len(self.index)
+            self.counts = np.concatenate(
+                [self.counts, np.zeros((len(new), 57), dtype=np.int64)])
+        rows = [self.index[key] for key in keys]
+        np.add.at(self.counts, rows, counts)
+
+    def update(self, df, innings, source=None):
+        # df: ball by ball rows in the layout of Data/Batting_First.csv or
+        # Data/Chasing.csv. source names the season or file so that the same
+        # data is not counted twice.
+        if source is not None:
+            assert source not in self.sources, \
+                f"{source} is already in the index"
+            self.sources.append(source)
+        balls = pd.DataFrame({
+            "venue": df["Venue"].values,
+            "phase": df["Overs"].map(OVER_TO_PHASE).values,
+            "result": df["Result"].values.astype(np.int64)})
+        for role, col in ROLES.items():
+            balls["player"] = df[col].values
+            for rolled in itertools.product([False, True], repeat=3):
+                dims = [dim for dim, skip in zip(["player", "venue", "phase"],
+                                                 rolled) if not skip]
+                if dims:
+                    grouped = balls.groupby(dims + ["result"]).size()
+                    table = grouped.unstack("result", fill_value=0)
+                else:
+                    table = balls.groupby("result").size().to_frame().T
+                table = table.reindex(columns=range(57), fill_value=0)
+                values = table.values
+                prefixes = table.index.tolist()
+                if len(dims) == 1:
+                    prefixes = [(x,) for x in prefixes]
+                elif not dims:
+                    prefixes = [()]
+                for inn in [innings, ALL]:
+                    keys = []
+                    for prefix in prefixes:
+                        named = dict(zip(dims, prefix))
+                        keys.append((named.get("player", ALL), role,
+                                     named.get("venue", ALL),
+                                     named.get("phase", ALL), inn))
+                    self.add(keys, values)
+
+    def update_innings(self, innings_list, source=None):
+        # Simulated innings, so that the evaluation can compare them with the
+        # actual data on the same keys. source names the run so that the
+        # same innings are not counted twice.
+        from Utils.replay import ball_states
+        if source is not None:
+            assert source not in self.sources, \
+                f"{source} is already in the index"
+        for innings in [1, 2]:
+            rows = []
+            for inn in innings_list:
+                if inn.innings != innings:
+                    continue
+                states, codes = ball_states(inn)
+                rows += [[inn.Venue, x["overs"], x["striker"],
+                          x["non_striker"], x["bowler"], code]
+                         for x, code in zip(states, codes)]
+            if rows:
+                df = pd.DataFrame(rows, columns=[
+                    "Venue", "Overs", "Striker", "Non_Striker", "Bowler",
+                    "Result"])
+                self.update(df, innings)
+        if source is not None:
+            self.sources.append(source)
+
+    def get(self, player=ALL, role="striker", venue=ALL, phase=ALL,
+            innings=ALL):
+        row = self.index.get((player, role, venue, phase, innings))
+        if row is None:
+            return np.zeros(57, dtype=np.int64)
+        return self.counts[row]
+
+    def stats(self, player=ALL, role="striker", venue=ALL, phase=ALL,
+              innings=ALL):
+        counts = self.get(player, role, venue, phase, innings)
+        effects = code_effects()
+        ret = {"deliveries": int(counts.sum())}
+        if role == "bowler":
+            runs = counts @ effects["bowler_runs"]
+            balls = counts @ effects["bowler_balls"]
+            wickets = counts @ effects["bowler_wickets"]
+            ret.update({"runs": int(runs), "balls": int(balls),
+                        "wickets": int(wickets),
+                        "economy": 6 * runs / balls if balls else None,
+                        "strike_rate": balls / wickets if wickets else None})
+        else:
+            runs = counts @ effects["batsman_runs"]
+            balls = counts @ effects["balls_faced"]
+            ret.update({"runs": int(runs), "balls": int(balls),
+                        "strike_rate": 100 * runs / balls if balls else None,
+                        "boundaries": int(counts[[5, 7, 44, 45]].sum())})
+        return ret
+
+    def prior(self, player=ALL, role="striker", venue=ALL, phase=ALL,
+              innings=ALL, min_deliveries=120, smoothing=0.5):
+        # Outcome probabilities for the most specific key with enough
+        # deliveries, dropping venue, then phase, innings and player
+        key = {"player": player, "venue": venue, "phase": phase,
+               "innings": innings}
+        counts = self.get(role=role, **key)
+        for dim in BACKOFF:
+            if counts.sum() >= min_deliveries:
+                break
+            key[dim] = ALL
+            counts = self.get(role=role, **key)
+        q = counts + smoothing
+        return q / q.sum()
+
+    def phase_table(self, players, role="striker", venue=ALL, innings=ALL):
+        rows = []
+        for player in players:
+            for phase in [name for name, _, _ in PHASES] + [ALL]:
+                stats = self.stats(player, role, venue, phase, innings)
+                rows.append(dict({"player": player, "phase": phase}, **stats))
+        return pd.DataFrame(rows)
+
+    def load_object(self, load_path):
+        with open(load_path, "rb") as fp:
+            saved_index = pickle.load(fp)
+        self.index = {key: i for i, key in enumerate(saved_index["keys"])}
+        self.counts = saved_index["counts"]
+        self.sources = saved_index["sources"]
+
+    def save_object(self, save_path):
+        save_index = {"keys": list(self.index), "counts": self.counts,
+                      "sources": self.sources}
+        with open(save_path, "wb") as fp:
+            pickle.dump(save_index, fp, protocol=pickle.HIGHEST_PROTOCOL)
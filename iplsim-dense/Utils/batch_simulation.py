@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+from Utils.helper import Innings, BF_Cols, BS_Cols
+from Utils.profiling import NULL_PROFILER
+
+
+def simulate_innings_batch(innings_list, model, profiler=None, sampler=None):
+    # Advances every innings in lockstep so that each ball of every live
+    # innings is predicted with a single model call. sampler(live, q), when
+    # given, replaces Innings.sample_result for the whole batch.
+    if profiler is None:
+        profiler = NULL_PROFILER
+    profiler.begin("batch")
+    live = [inn for inn in innings_list if not inn.innings_over()]
+    # Models with predict_ids (EmbeddingModel) are fed ids directly
+    use_ids = hasattr(model, "predict_ids")
+    while live:
+        with profiler.stage("encode"):
+            if use_ids:
+                numeric, ids = zip(*[inn.get_model_ids(model.layout)
+                                     for inn in live])
+            else:
+                model_inp = np.array([inn.get_model_input()
+                                      for inn in live])
+        with profiler.stage("predict"):
+            if use_ids:
+                q = model.predict_ids(np.array(numeric), np.array(ids))
+            else:
+                q = model.predict(model_inp, verbose=0)
+        with profiler.stage("sample"):
+            if sampler is None:
+                results = [inn.sample_result(probs)
+                           for inn, probs in zip(live, q)]
+            else:
+                results = sampler(live, q)
+        with profiler.stage("update"):
+            for inn, res in zip(live, results):
+                inn.ball_prediction(res)
+        with profiler.stage("bookkeeping"):
+            profiler.count("balls", len(live))
+            profiler.count("model_calls")
+            profiler.count("model_rows", len(live))
+            live = [inn for inn in live if not inn.innings_over()]
+    profiler.end("batch", innings=len(innings_list))
+    return [inn.get_result() for inn in innings_list]
+
+
+def simulate_matches_batch(fixtures, model_inn_1, model_inn_2,
+                           profiler=None):
+    # fixtures: list of (batting first squad, chasing squad, toss team, venue)
+    # where a squad is [Batting, Bowling] as in Utils.sample_squads
+    inn1_df = pd.DataFrame(columns=BF_Cols)
+    inn2_df = pd.DataFrame(columns=BS_Cols)
+    first_innings = [Innings(bat_first[0], chasing[1], toss, venue, 1, inn1_df)
+                     for bat_first, chasing, toss, venue in fixtures]
+    targets = simulate_innings_batch(first_innings, model_inn_1, profiler)
+    second_innings = [Innings(chasing[0], bat_first[1], toss, venue, 2,
+                              inn2_df, int(target))
+                      for (bat_first, chasing, toss, venue), target
+                      in zip(fixtures, targets)]
+    results = simulate_innings_batch(second_innings, model_inn_2, profiler)
+    return [[inn1, inn2, result] for inn1, inn2, result
+            in zip(first_innings, second_innings, results)]
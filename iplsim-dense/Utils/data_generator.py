@@ -10,7 +10,7 @@ with open('Data/Teams.pkl', 'rb') as fp:
     teams = pickle.load(fp)
 
 
-def get_onehot(df_inp):
+def get_onehot(df_inp, columns=None):
     inp_cols_set = set(df_inp.columns)
     df = df_inp.copy().reset_index(drop=True)
     if "Toss" in inp_cols_set:
@@ -85,6 +85,10 @@ def get_onehot(df_inp):
         df_one_hot = df_one_hot.drop(columns=[
             "Venue", "Batting_Team", "Bowling_Team",
             "Striker", "Non_Striker", "Bowler", "Result"])
+    if columns is not None:
+        # Fixed layout (e.g. BF_Cols) so that rows from a new season line up
+        # with the columns the model was trained on
+        return df_one_hot.reindex(columns=columns, fill_value=0), df_result
     return df_one_hot.reindex(sorted(df_one_hot.columns), axis=1), df_result
 
 
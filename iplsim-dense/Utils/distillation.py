@@ -0,0 +1,177 @@
+import os
+import time
+import numpy as np
+import pandas as pd
+from Utils.batch_simulation import simulate_innings_batch
+from Utils.equivalence import new_innings
+from Utils.inference import NumpyModel, activate
+from Utils.ingestion import INNINGS_FILES, encode_rows, dense_rows
+
+
+class RecordingModel():
+    # Passes predict through to model and keeps every input row, to collect
+    # the states the simulator actually visits
+    def __init__(self, model):
+        self.model = model
+        self.rows = []
+
+    def reset_states(self):
+        pass
+
+    def predict(self, x, verbose=0, batch_size=None):
+        self.rows.append(np.array(x, dtype=np.float32))
+        return self.model.predict(x, verbose=0)
+
+
+def real_states(innings, cols, data_dir="Data", limit=None):
+    # Model inputs of the ball by ball data, in the layout of cols
+    df = pd.read_csv(os.path.join(data_dir, INNINGS_FILES[innings][0]),
+                     nrows=limit)
+    return dense_rows(encode_rows(df, cols, innings), len(cols))
+
+
+def simulated_states(teacher, fixtures, innings, n_sims=200):
+    # fixtures: (Batting, Bowling, toss team, venue, target) as in
+    # Utils.equivalence
+    recorder = RecordingModel(teacher)
+    for fixture in fixtures:
+        simulate_innings_batch([new_innings(fixture, innings)
+                                for _ in range(n_sims)], recorder)
+    return np.concatenate(recorder.rows)
+
+
+def soft_labels(teacher, x, batch_size=4096):
+    # The teacher's own distribution: the student is sampled from at
+    # inference like the teacher, so its targets are not softened
+    q = np.concatenate([teacher.predict(x[i:i + batch_size], verbose=0)
+                        for i in range(0, len(x), batch_size)])
+    return q.astype(np.float32)
+
+
+def build_student(n_inp, hidden=(128, 64)):
+    import tensorflow as tf
+    layers = [tf.keras.layers.InputLayer(input_shape=(n_inp,))]
+    for units in hidden:
+        layers.append(tf.keras.layers.Dense(units, activation="relu"))
+    layers.append(tf.keras.layers.Dense(57, activation="softmax"))
+    return tf.keras.Sequential(layers)
+
+
+def train_student(student, x, q, epochs=10, learning_rate=0.001,
+                  validation_split=0.1, callbacks=None):
+    # Cross entropy against the teacher's distribution rather than the
+    # sampled result; the student is returned as a NumpyModel
+    import tensorflow as tf
+    student.compile(loss=tf.keras.losses.CategoricalCrossentropy(),
+                    optimizer=tf.keras.optimizers.Adam(
+                        learning_rate=learning_rate))
+    student.fit(x, q, epochs=epochs, validation_split=validation_split,
+                callbacks=callbacks)
+    return NumpyModel.from_keras(student)
+
+
+def train_numpy_student(x, q, hidden=(128, 64), epochs=10,
+                        learning_rate=0.001, batch_size=256, seed=0,
+                        verbose=0):
+    # The same student trained with Adam in NumPy, for machines without
+    # TensorFlow
+    rng = np.random.default_rng(seed)
+    sizes = [x.shape[1]] + list(hidden) + [57]
+    params = []
+    for i in range(len(sizes) - 1):
+        params.append(rng.normal(0, np.sqrt(2 / sizes[i]),
+                                 (sizes[i], sizes[i + 1])).astype(np.float32))
+        params.append(np.zeros(sizes[i + 1], dtype=np.float32))
+    # output bias starts at the mean teacher distribution
+    params[-1] = np.log(np.maximum(q.mean(axis=0), 1e-8)).astype(np.float32)
+    m = [np.zeros_like(p) for p in params]
+    v = [np.zeros_like(p) for p in params]
+    step = 0
+    for epoch in range(epochs):
+        order = rng.permutation(len(x))
+        loss = 0.0
+        for start in range(0, len(x), batch_size):
+            batch = order[start:start + batch_size]
+            acts = [x[batch]]
+            for i in range(0, len(params), 2):
+                z = acts[-1] @ params[i] + params[i + 1]
+                last = i == len(params) - 2
+                acts.append(activate(z, "softmax" if last else "relu"))
+            out = acts[-1]
+            loss -= (q[batch] * np.log(np.maximum(out, 1e-12))).sum()
+            delta = (out - q[batch]) / len(batch)
+            grads = [None] * len(params)
+            for i in range(len(params) - 2, -1, -2):
+                grads[i] = acts[i // 2].T @ delta
+                grads[i + 1] = delta.sum(axis=0)
+                if i:
+                    delta = (delta @ params[i].T) * (acts[i // 2] > 0)
+            step += 1
+            for j, g in enumerate(grads):
+                m[j] = 0.9 * m[j] + 0.1 * g
+                v[j] = 0.999 * v[j] + 0.001 * g * g
+                m_hat = m[j] / (1 - 0.9 ** step)
+                v_hat = v[j] / (1 - 0.999 ** step)
+                params[j] -= learning_rate * m_hat / (np.sqrt(v_hat) + 1e-7)
+        if verbose:
+            print(f"epoch {epoch + 1}: loss {loss / len(x):.4f}")
+    layers = []
+    for i in range(0, len(params), 2):
+        layers.append({"W": params[i], "b": params[i + 1],
+                       "activation": ("softmax" if i == len(params) - 2
+                                      else "relu")})
+    return NumpyModel(layers)
+
+
+def kl_divergence(teacher, student, x, batch_size=4096):
+    # Mean KL(teacher || student) over the rows of x
+    p = soft_labels(teacher, x, batch_size=batch_size)
+    q = soft_labels(student, x, batch_size=batch_size)
+    return float((p * (np.log(np.maximum(p, 1e-12))
+                       - np.log(np.maximum(q, 1e-12)))).sum(axis=1).mean())
+
+
+def speed(model, rows, repeats=20):
+    model.predict(rows, verbose=0)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        model.predict(rows, verbose=0)
+    return (time.perf_counter() - start) / repeats
+
+
+def acceptance_report(teacher, student, fixtures, innings, rows, n_sims=500,
+                      seed=0, alpha=0.01):
+    # The Evaluate.ipynb comparisons (KS tests on totals, wickets, extras
+    # and phase runs of Utils.equivalence) with the teacher as reference,
+    # each model simulated from its own seed. The student is accepted only
+    # when every test passes.
+    from Utils.equivalence import distribution_test, innings_engine
+    report = distribution_test(teacher, fixtures, innings, innings_engine(),
+                               n_sims=n_sims, seed=seed, alpha=alpha,
+                               candidate_model=student)
+    report["kl_divergence"] = kl_divergence(teacher, student, rows)
+    report["teacher_seconds_per_call"] = speed(teacher, rows)
+    report["student_seconds_per_call"] = speed(student, rows)
+    report["speedup"] = (report["teacher_seconds_per_call"]
+                         / report["student_seconds_per_call"])
+    report["accepted"] = report["passed"]
+    return report
+
+
+def distill(teacher, innings, cols, fixtures, data_dir="Data",
+            hidden=(128, 64), epochs=10, n_sims=200, use_tensorflow=True,
+            limit=None):
+    # Soft labels over the real and the simulated states of one innings,
+    # a student trained on them and its acceptance report
+    x = np.concatenate([real_states(innings, cols, data_dir, limit),
+                        simulated_states(teacher, fixtures, innings, n_sims)])
+    q = soft_labels(teacher, x)
+    if use_tensorflow:
+        student = train_student(build_student(len(cols), hidden), x, q,
+                                epochs)
+    else:
+        student = train_numpy_student(x, q, hidden, epochs)
+    rows = x[np.random.default_rng(0).choice(len(x), min(len(x), 512),
+                                             replace=False)]
+    return student, acceptance_report(teacher, student, fixtures, innings,
+                                      rows)
@@ -0,0 +1,223 @@
+import time
+import numpy as np
+from Utils.inference import NumpyModel
+from Utils.model_surgery import column_family
+
+# Id slots in the order they are fed to the model, with the embedding table
+# each one looks up. Striker, non-striker and bowler share the player table.
+SLOTS = [["Toss_", "teams"], ["Venue_", "venues"],
+         ["Batting_Team_", "teams"], ["Bowling_Team_", "teams"],
+         ["Striker_", "players"], ["Non_Striker_", "players"],
+         ["Bowler_", "players"]]
+
+
+class EmbeddingLayout():
+    # Maps a one hot column layout such as BF_Cols onto integer ids per slot
+    # plus the numeric columns. Id 0 of every table is kept for names the
+    # model has not seen.
+    def __init__(self, cols):
+        self.cols = list(cols)
+        self.vocab = {"players": [], "teams": [], "venues": []}
+        self.numeric_cols = []
+        families = dict(SLOTS)
+        for col in self.cols:
+            prefix = column_family(col)
+            if prefix is None:
+                self.numeric_cols.append(col)
+            elif col[len(prefix):] not in self.vocab[families[prefix]]:
+                self.vocab[families[prefix]].append(col[len(prefix):])
+        self.ids = {table: {name: i for i, name in enumerate(names, 1)}
+                    for table, names in self.vocab.items()}
+        col_index = {col: i for i, col in enumerate(self.cols)}
+        self.numeric_index = np.array([col_index[col]
+                                       for col in self.numeric_cols])
+        self.col_slot = np.full(len(self.cols), -1)
+        self.col_id = np.zeros(len(self.cols), dtype=np.int32)
+        for slot, (prefix, table) in enumerate(SLOTS):
+            for name, i in self.ids[table].items():
+                if prefix + name in col_index:
+                    self.col_slot[col_index[prefix + name]] = slot
+                    self.col_id[col_index[prefix + name]] = i
+        self.onehot_index = np.nonzero(self.col_slot >= 0)[0]
+
+    def table_sizes(self):
+        return {table: len(names) + 1 for table, names in self.vocab.items()}
+
+    def split(self, x):
+        # Dense model input rows (e.g. from get_onehot) into numeric values
+        # and ids. Innings and the batched engine skip the dense rows
+        # through Innings.get_model_ids; this is for every other caller.
+        x = np.asarray(x, dtype=np.float32)
+        ids = np.zeros((x.shape[0], len(SLOTS)), dtype=np.int32)
+        rows, cols = np.nonzero(x[:, self.onehot_index])
+        cols = self.onehot_index[cols]
+        ids[rows, self.col_slot[cols]] = self.col_id[cols]
+        return x[:, self.numeric_index], ids
+
+    def split_chunk(self, chunk):
+        # Rows cached by Utils.ingestion, which already hold the column index
+        # of every active one hot column. Columns beyond this layout (names
+        # added after the model was trained) get the unknown id.
+        numeric = np.zeros((chunk["onehot"].shape[0], len(self.numeric_cols)),
+                           dtype=np.float32)
+        position = {i: j for j, i in enumerate(self.numeric_index)}
+        for k, i in enumerate(chunk["numeric_ids"]):
+            if i in position:
+                numeric[:, position[i]] = chunk["numeric"][:, k]
+        onehot = chunk["onehot"]
+        known = onehot < len(self.cols)
+        onehot = np.where(known, onehot, 0)
+        ids = np.zeros((onehot.shape[0], len(SLOTS)), dtype=np.int32)
+        for slot in range(len(SLOTS)):
+            hit = known & (self.col_slot[onehot] == slot)
+            rows, j = np.nonzero(hit)
+            ids[rows, slot] = self.col_id[onehot[rows, j]]
+        return numeric, ids
+
+
+def build_embedding_model(layout, player_dim=32, team_dim=8, venue_dim=8,
+                          hidden=(256, 256, 128), dropout=0.2):
+    import tensorflow as tf
+    sizes = layout.table_sizes()
+    ids = tf.keras.Input(shape=(len(SLOTS),), dtype="int32", name="ids")
+    numeric = tf.keras.Input(shape=(len(layout.numeric_cols),),
+                             name="numeric")
+    tables = {
+        "players": tf.keras.layers.Embedding(sizes["players"], player_dim,
+                                             name="players"),
+        "teams": tf.keras.layers.Embedding(sizes["teams"], team_dim,
+                                           name="teams"),
+        "venues": tf.keras.layers.Embedding(sizes["venues"], venue_dim,
+                                            name="venues"),
+    }
+    parts = [tables[table](ids[:, slot])
+             for slot, (_, table) in enumerate(SLOTS)]
+    x = tf.keras.layers.Concatenate()(parts + [numeric])
+    for units in hidden:
+        x = tf.keras.layers.Dense(units, activation="relu")(x)
+        x = tf.keras.layers.Dropout(dropout)(x)
+    out = tf.keras.layers.Dense(57, activation="softmax")(x)
+    return tf.keras.Model([numeric, ids], out)
+
+
+def train_embedding_model(model, numeric, ids, y, epochs=20,
+                          learning_rate=0.001, validation_split=0.2,
+                          callbacks=None):
+    import tensorflow as tf
+    model.compile(loss=tf.keras.losses.SparseCategoricalCrossentropy(),
+                  metrics=['accuracy'],
+                  optimizer=tf.keras.optimizers.Adam(
+                      learning_rate=learning_rate))
+    return model.fit([numeric, ids], y, epochs=epochs,
+                     validation_split=validation_split, callbacks=callbacks)
+
+
+class EmbeddingModel():
+    # NumPy inference for the embedding architecture with the predict and
+    # reset_states of a keras model, so that Innings, Match, the batched
+    # engine and EvaluationMetrics can use it unchanged. Innings and the
+    # batched engine call predict_ids with the ids of
+    # Innings.get_model_ids; predict takes the usual dense rows and turns
+    # them into ids for any other caller.
+    #
+    # combine="concat" is the trained architecture. combine="sum" is the
+    # exact rewrite of a one hot model whose first Dense layer is linear (as
+    # in the HeavyDense models): that layer only adds up the kernel rows of
+    # the active columns, so those rows become per slot tables.
+    def __init__(self, layout, tables, layers, combine="concat",
+                 numeric_W=None, first_bias=None):
+        self.layout = layout
+        self.tables = tables
+        self.head = NumpyModel(layers) if layers else None
+        self.combine = combine
+        self.numeric_W = numeric_W
+        self.first_bias = first_bias
+
+    @classmethod
+    def from_keras(cls, model, layout):
+        tables = {name: model.get_layer(name).get_weights()[0]
+                  .astype(np.float32) for name in ("players", "teams",
+                                                   "venues")}
+        layers = []
+        for layer in model.layers:
+            if layer.__class__.__name__ == "Dense":
+                W, b = layer.get_weights()
+                layers.append({"W": W.astype(np.float32),
+                               "b": b.astype(np.float32),
+                               "activation": layer.get_config()["activation"]})
+        return cls(layout, [tables[table] for _, table in SLOTS], layers)
+
+    @classmethod
+    def from_onehot_model(cls, model, cols):
+        # model: NumpyModel over the one hot layout cols
+        layout = EmbeddingLayout(cols)
+        first = model.layers[0]
+        assert first["activation"] == "linear" and "w_scale" not in first, \
+            "Only a linear float first layer can be rewritten exactly"
+        W = first["W"].astype(np.float32)
+        tables = []
+        for slot, (prefix, table) in enumerate(SLOTS):
+            rows = np.zeros((len(layout.vocab[table]) + 1, W.shape[1]),
+                            dtype=np.float32)
+            cols_of_slot = np.nonzero(layout.col_slot == slot)[0]
+            rows[layout.col_id[cols_of_slot]] = W[cols_of_slot]
+            tables.append(rows)
+        head = [dict(x) for x in model.layers[1:]]
+        return cls(layout, tables, head, "sum", W[layout.numeric_index],
+                   first["b"].astype(np.float32))
+
+    def reset_states(self):
+        pass
+
+    def predict_ids(self, numeric, ids):
+        numeric = np.asarray(numeric, dtype=np.float32)
+        parts = [table[ids[:, slot]] for slot, table in enumerate(self.tables)]
+        if self.combine == "sum":
+            x = numeric @ self.numeric_W + self.first_bias
+            for part in parts:
+                x += part
+        else:
+            x = np.concatenate(parts + [numeric], axis=1)
+        if self.head is None:
+            return x
+        return self.head.forward(x)
+
+    def predict(self, x, verbose=0, batch_size=None):
+        return self.predict_ids(*self.layout.split(x))
+
+    def num_params(self):
+        total = sum(table.size for table in self.tables)
+        if self.combine == "concat":
+            # The player and team tables are shared between slots
+            total = sum({id(table): table.size
+                         for table in self.tables}.values())
+        if self.numeric_W is not None:
+            total += self.numeric_W.size + self.first_bias.size
+        return total + (self.head.num_params() if self.head else 0)
+
+
+def model_cost(model, rows, repeats=20):
+    # Parameters and time per predict call on a batch of dense rows
+    model.predict(rows)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        model.predict(rows)
+    seconds = (time.perf_counter() - start) / repeats
+    params = model.num_params() if hasattr(model, "num_params") \
+        else model.count_params()
+    return {"params": int(params), "seconds_per_call": seconds,
+            "rows_per_sec": rows.shape[0] / seconds}
+
+
+def validation_report(reference, candidate, fixtures, innings, rows,
+                      n_sims=500, seed=0, alpha=0.01):
+    # Distribution tests of Utils.equivalence (totals, wickets, extras and
+    # phase runs, as compared in Evaluate.ipynb) with the embedding model
+    # simulated through the batched engine, plus the size and speed of both
+    from Utils.equivalence import distribution_test, innings_engine
+    report = distribution_test(reference, fixtures, innings, innings_engine(),
+                               n_sims=n_sims, seed=seed, alpha=alpha,
+                               candidate_model=candidate)
+    report["reference_cost"] = model_cost(reference, rows)
+    report["candidate_cost"] = model_cost(candidate, rows)
+    return report
@@ -0,0 +1,217 @@
+import numpy as np
+import pandas as pd
+import random
+from Utils.aggregates import PHASES
+from Utils.batch_simulation import simulate_innings_batch
+from Utils.helper import Innings, BF_Cols, BS_Cols
+from Utils.stats import ks_2samp
+
+STATE_FIELDS = ["score", "wickets", "overs", "balls", "free_hit", "extras",
+                "striker", "striker_runs", "striker_balls", "non_striker",
+                "non_striker_runs", "non_striker_balls", "bowler",
+                "bowler_runs", "bowler_overs", "bowler_balls",
+                "bowler_wickets", "overs_completed", "innings_over"]
+SUMMARY_FIELDS = ["runs", "wickets", "extras", "balls"] + \
+    [name+"_runs" for name, _, _ in PHASES]
+
+
+def innings_state(inn):
+    # Same fields as Innings.get_progress_row plus the totals, tolerating the
+    # missing batsman once the innings is all out
+    def batsman(x):
+        if x is None:
+            return [None, None, None]
+        return [x.Name, x.Runs, x.Balls]
+    striker = batsman(inn.Striker)
+    non_striker = batsman(inn.Non_Striker)
+    return {
+        "score": inn.Runs, "wickets": inn.Wickets, "overs": inn.Overs,
+        "balls": inn.Balls, "free_hit": inn.Free_Hit, "extras": inn.Extras,
+        "striker": striker[0], "striker_runs": striker[1],
+        "striker_balls": striker[2], "non_striker": non_striker[0],
+        "non_striker_runs": non_striker[1],
+        "non_striker_balls": non_striker[2], "bowler": inn.Bowler.Name,
+        "bowler_runs": inn.Bowler.Runs_Conceded,
+        "bowler_overs": inn.Bowler.Overs_Bowled,
+        "bowler_balls": inn.Bowler.Balls_Bowled,
+        "bowler_wickets": len(inn.Bowler.Wickets_Taken),
+        "overs_completed": len(inn.Overs_Summary),
+        "innings_over": inn.innings_over(),
+    }
+
+
+innings_df_cache = {}
+
+
+def new_innings(fixture, innings, cls=Innings):
+    # fixture: (Batting, Bowling, toss team, venue, target) as in
+    # Utils.quantization. Innings only reads the columns of df, so a single
+    # empty frame per innings is shared instead of building one every time.
+    batting, bowling, toss, venue, target = fixture
+    if innings not in innings_df_cache:
+        innings_df_cache[innings] = pd.DataFrame(
+            columns=BF_Cols if innings == 1 else BS_Cols)
+    return cls(batting, bowling, toss, venue, innings,
+               innings_df_cache[innings], target)
+
+
+def innings_replayer(cls=Innings):
+    # Wraps any class with the Innings constructor and ball_prediction into
+    # a replay engine: engine(fixture, innings, codes) -> state after each ball
+    def replay(fixture, innings, codes):
+        inn = new_innings(fixture, innings, cls)
+        states = []
+        for code in codes:
+            inn.ball_prediction(code)
+            states.append(innings_state(inn))
+        return states
+    return replay
+
+
+reference_replay = innings_replayer()
+
+
+def recorded_codes(inn):
+    return [int(x) for x in inn.inn_progress_df["result"]]
+
+
+def random_codes(fixture, innings, seed=0, weights=None):
+    # A legal code sequence for fuzzing, drawn with the reference engine. By
+    # default every code is equally likely so that the rare branches of
+    # ball_prediction are exercised too.
+    rng = random.Random(seed)
+    if weights is None:
+        weights = np.ones(57)
+    inn = new_innings(fixture, innings)
+    codes = []
+    state = random.getstate()
+    while not inn.innings_over():
+        q = np.array(weights, dtype=np.float64)
+        if inn.Free_Hit == 1:
+            q[[8, 9, 10, 12]] = 0
+        code = rng.choices(range(0, 57), weights=q, k=1)[0]
+        inn.ball_prediction(code)
+        codes.append(code)
+    random.setstate(state)
+    return codes
+
+
+def replay_diff(candidate, fixture, innings, codes, seed=0,
+                reference=reference_replay, fields=None):
+    # Both engines replay the same codes from the same random state, so the
+    # batsman swaps after run outs and catches must also line up
+    fields = fields or STATE_FIELDS
+    state = random.getstate()
+    random.seed(seed)
+    ref = reference(fixture, innings, codes)
+    random.seed(seed)
+    cand = candidate(fixture, innings, codes)
+    random.setstate(state)
+    diffs = []
+    if len(ref) != len(cand):
+        diffs.append({"ball": None, "field": "length", "reference": len(ref),
+                      "candidate": len(cand)})
+    for ball, (a, b) in enumerate(zip(ref, cand)):
+        for field in fields:
+            if a[field] != b.get(field):
+                diffs.append({"ball": ball, "code": codes[ball],
+                              "field": field, "reference": a[field],
+                              "candidate": b.get(field)})
+    return diffs
+
+
+def replay_suite(candidate, fixtures, innings, n_sequences=20, seed=0,
+                 sequences=None, reference=reference_replay):
+    # Replays the given code sequences, or random ones, through both engines
+    # for every fixture and collects every mismatch
+    report = {"sequences": 0, "balls": 0, "mismatched_sequences": 0,
+              "diffs": []}
+    for i, fixture in enumerate(fixtures):
+        if sequences is None:
+            codes_list = [random_codes(fixture, innings, seed+i*n_sequences+k)
+                          for k in range(n_sequences)]
+        else:
+            codes_list = sequences
+        for k, codes in enumerate(codes_list):
+            diffs = replay_diff(candidate, fixture, innings, codes, seed+k,
+                                reference)
+            report["sequences"] += 1
+            report["balls"] += len(codes)
+            if diffs:
+                report["mismatched_sequences"] += 1
+                for diff in diffs:
+                    diff["fixture"] = i
+                    diff["sequence"] = k
+                report["diffs"] += diffs
+    report["passed"] = report["mismatched_sequences"] == 0
+    return report
+
+
+def innings_summary(inn):
+    summary = {"runs": inn.Runs, "wickets": inn.Wickets,
+               "extras": inn.Extras,
+               "balls": 6 * (inn.Overs - 1) + inn.Balls - 1}
+    over_runs = [x[0] for x in inn.Overs_Summary]
+    if inn.Overs <= 20:
+        # Runs in the unfinished over
+        over_runs.append(inn.Runs - sum(over_runs))
+    for name, start, end in PHASES:
+        summary[name+"_runs"] = sum(over_runs[start-1:end])
+    return summary
+
+
+def sequential_engine(inns, model):
+    for inn in inns:
+        inn.simulate_inning(model)
+
+
+def innings_engine(run=simulate_innings_batch, cls=Innings):
+    # Turns run(innings_list, model) into an engine returning the summary of
+    # every simulated innings
+    def engine(model, fixtures, innings, n_sims):
+        inns = [new_innings(fixture, innings, cls) for fixture in fixtures
+                for _ in range(n_sims)]
+        run(inns, model)
+        return [innings_summary(inn) for inn in inns]
+    return engine
+
+
+def compare_distributions(reference, candidate, fields=None, alpha=0.01):
+    fields = fields or SUMMARY_FIELDS
+    report = {}
+    for field in fields:
+        a = [x[field] for x in reference]
+        b = [x[field] for x in candidate]
+        d, p = ks_2samp(a, b)
+        report[field] = {"reference_mean": float(np.mean(a)),
+                         "candidate_mean": float(np.mean(b)),
+                         "reference_std": float(np.std(a)),
+                         "candidate_std": float(np.std(b)),
+                         "ks_statistic": d, "ks_p": p, "passed": p >= alpha}
+    report["passed"] = all(report[field]["passed"] for field in fields)
+    return report
+
+
+def distribution_test(model, fixtures, innings, candidate,
+                      reference=innings_engine(sequential_engine),
+                      n_sims=500, seed=0, alpha=0.01, candidate_model=None):
+    # Large sample comparison of the innings outcomes of two engines under
+    # fixed seeds. candidate_model lets the candidate run a different model
+    # (e.g. a quantized or distilled one) against the same reference; it is
+    # then run from another seed, since samples sharing their random draws
+    # are correlated and would pass the KS tests far too easily.
+    state = random.getstate()
+    np_state = np.random.get_state()
+    random.seed(seed)
+    np.random.seed(seed)
+    ref = reference(model, fixtures, innings, n_sims)
+    if candidate_model is not None:
+        seed += 1000003
+    random.seed(seed)
+    np.random.seed(seed)
+    cand = candidate(candidate_model or model, fixtures, innings, n_sims)
+    random.setstate(state)
+    np.random.set_state(np_state)
+    report = compare_distributions(ref, cand, alpha=alpha)
+    report["n"] = len(ref)
+    return report
@@ -2,8 +2,10 @@ import pandas as pd
 import pickle
 from tqdm import tqdm
 from Utils.helper import Innings, display_batting_table
+from Utils.profiling import NULL_PROFILER
 import itertools
 import random
+import warnings
 from IPython.display import display
 from Utils.sample_squads import (
     CSK_Squad, CSK_Pitch, RCB_Squad,
@@ -21,7 +23,11 @@ with open('Data/BS_Cols.pkl', 'rb') as fp:
 
 
 class EvaluationMetrics():
-    def __init__(self, model_inn1, model_inn2, load_path=None, step=5):
+    def __init__(self, model_inn1, model_inn2, load_path=None, step=5,
+                 profiler=None):
+        self.profiler = profiler if profiler is not None else NULL_PROFILER
+        # whether this evaluator has a tournament scope open on the profiler
+        self.tournament_open = False
         self.bowler_stat = {}
         self.batsmen_stat = {}
         self.step = step
@@ -32,6 +38,7 @@ class EvaluationMetrics():
         }
         self.total_stat = []
         self.innings_obj_list = []
+        self.match_tournament = []
 
         self.teams = [[CSK_Squad, CSK_Pitch],
                       [RCB_Squad, RCB_Pitch],
@@ -75,6 +82,11 @@ class EvaluationMetrics():
             self.old_season_tables = saved_evaluator["old_season_tables"]
         self.matches = saved_evaluator["matches"]
         self.match_count = saved_evaluator["match_count"]
+        if "match_tournament" in saved_evaluator:
+            self.match_tournament = saved_evaluator["match_tournament"]
+        else:
+            self.match_tournament = [i // len(self.matches) for i in
+                                     range(len(self.innings_obj_list))]
 
     def save_object(self, save_path):
         save_evaluator = {}
@@ -88,9 +100,47 @@ class EvaluationMetrics():
         save_evaluator["old_season_tables"] = self.old_season_tables
         save_evaluator["matches"] = self.matches
         save_evaluator["match_count"] = self.match_count
+        save_evaluator["match_tournament"] = self.match_tournament
         with open(save_path, "wb") as fp:
             pickle.dump(save_evaluator, fp)
 
+    def aggregate_index(self, index=None, source=None):
+        # Result code counts of the simulated innings keyed like the actual
+        # data in ActualStats.aggregate_index
+        from Utils.aggregates import AggregateIndex
+        if index is None:
+            index = AggregateIndex()
+        index.update_innings([inn for match in self.innings_obj_list
+                              for inn in match], source)
+        return index
+
+    def export_tables(self, root, fmt="parquet", tables=None):
+        # Columnar matches, innings, batting, bowling, overs and balls tables
+        # partitioned by tournament, see Utils.export
+        from Utils.export import export_evaluation
+        export_evaluation(self, root, fmt, tables)
+
+    def export_archive(self, save_path=None):
+        # Compact copy of innings_obj_list that can be replayed into the
+        # Innings objects and scorecards with Utils.replay. Matches saved
+        # before the result codes were recorded are left out.
+        from Utils.replay import MatchArchive, has_results
+        archive = MatchArchive()
+        skipped = 0
+        for match in self.innings_obj_list:
+            if len(match) != 2:
+                continue
+            if all(has_results(inn) for inn in match):
+                archive.add_match(*match)
+            else:
+                skipped += 1
+        if skipped:
+            warnings.warn(f"{skipped} matches have no recorded result codes "
+                          "and are not archived")
+        if save_path is not None:
+            archive.save_object(save_path)
+        return archive
+
     def simulate_innings(self, batting_lineup, bowling_lineup,
                          toss_team, venue, innings=1, target=0, verbose=0):
         if innings == 1:
@@ -101,7 +151,13 @@ class EvaluationMetrics():
             assert False, "innings should be '1' or '2'"
         inn = Innings(batting_lineup, bowling_lineup, toss_team,
                       venue, innings, inn_df, target)
-        simulation_ret = inn.simulate_inning(self.models[innings - 1])
+        inn.simulate_inning(self.models[innings - 1], self.profiler)
+        return self.record_innings(inn, verbose)
+
+    def record_innings(self, inn, verbose=0, tournament=None):
+        # Adds a finished innings to the player, progression and total stats.
+        # Innings simulated elsewhere (e.g. by Utils.scheduler) go through
+        # here as well, the first innings of a match before its chase.
         btl = inn.Batting_lineup
         bwl = inn.Bowling_lineup
 
@@ -143,15 +199,18 @@ class EvaluationMetrics():
                 self.progression_stat["wickets"][ind].append(
                     progression_wicket_lis[ind])
             count += 1
-        if innings == 1:
+        if inn.innings == 1:
             self.total_stat.append(inn.Runs)
             self.innings_obj_list.append([inn])
-        elif innings == 2:
+            self.match_tournament.append(
+                len(self.old_season_tables) if tournament is None
+                else tournament)
+        elif inn.innings == 2:
             self.innings_obj_list[-1].append(inn)
         if verbose:
             display_batting_table(inn, display_level=verbose-1)
-        return (inn.Runs, self.get_balls(inn), simulation_ret
-                if innings == 2 else None)
+        return (inn.Runs, self.get_balls(inn), inn.get_result()
+                if inn.innings == 2 else None)
 
     def form_matches(self):
         self.match_count = 0
@@ -188,6 +247,9 @@ class EvaluationMetrics():
         display(points_table_df)
 
     def reinitialize_tournament(self):
+        if self.tournament_open:
+            self.profiler.end("tournament", complete=False)
+            self.tournament_open = False
         self.old_season_tables.append(self.season_table)
         table_keys = ["Played", "Wins", "Losses", "Points",
                       "ByRuns", "ByBalls", "AgRuns", "AgBalls"]
@@ -208,7 +270,13 @@ class EvaluationMetrics():
             print("All Matches in the series are over")
             return
         match = self.matches[self.match_count]
+        # A season resumed through load_path opens its scope on the first
+        # match played here
+        if not self.tournament_open:
+            self.profiler.begin("tournament")
+            self.tournament_open = True
         self.match_count += 1
+        self.profiler.begin("match")
         toss = random.choice([0, 1])
         inn1_score, inn1_balls, _ = self.simulate_innings(
             match[0][0][0], match[0][1][1],
@@ -219,33 +287,50 @@ class EvaluationMetrics():
             match[0][1][0], match[0][0][1],
             match[0][toss][0][0], match[1], 2,
             inn1_score+1, verbose=verbose)
-        self.season_table[match[0][0][0][0]]["ByRuns"] += inn1_score
-        self.season_table[match[0][0][0][0]]["ByBalls"] += inn1_balls
-        self.season_table[match[0][1][0][0]]["AgRuns"] += inn1_score
-        self.season_table[match[0][1][0][0]]["AgBalls"] += inn1_balls
-        self.season_table[match[0][1][0][0]]["ByRuns"] += inn2_score
-        self.season_table[match[0][1][0][0]]["ByBalls"] += inn2_balls
-        self.season_table[match[0][0][0][0]]["AgRuns"] += inn2_score
-        self.season_table[match[0][0][0][0]]["AgBalls"] += inn2_balls
-        self.season_table[match[0][0][0][0]]["Played"] += 1
-        self.season_table[match[0][1][0][0]]["Played"] += 1
+        self.record_result(match, inn1_score, inn1_balls, inn2_score,
+                           inn2_balls, inn2_ret)
+        self.profiler.end("match", winner=inn2_ret)
+        if self.match_count == len(self.matches):
+            self.profiler.end("tournament")
+            self.tournament_open = False
+        if verbose:
+            print(ret_str)
+
+    def record_result(self, match, inn1_score, inn1_balls, inn2_score,
+                      inn2_balls, inn2_ret, season_table=None):
+        if season_table is None:
+            season_table = self.season_table
+        season_table[match[0][0][0][0]]["ByRuns"] += inn1_score
+        season_table[match[0][0][0][0]]["ByBalls"] += inn1_balls
+        season_table[match[0][1][0][0]]["AgRuns"] += inn1_score
+        season_table[match[0][1][0][0]]["AgBalls"] += inn1_balls
+        season_table[match[0][1][0][0]]["ByRuns"] += inn2_score
+        season_table[match[0][1][0][0]]["ByBalls"] += inn2_balls
+        season_table[match[0][0][0][0]]["AgRuns"] += inn2_score
+        season_table[match[0][0][0][0]]["AgBalls"] += inn2_balls
+        season_table[match[0][0][0][0]]["Played"] += 1
+        season_table[match[0][1][0][0]]["Played"] += 1
         if inn2_ret == 1:
-            self.season_table[match[0][1][0][0]]["Points"] += 2
-            self.season_table[match[0][1][0][0]]["Wins"] += 1
-            self.season_table[match[0][0][0][0]]["Losses"] += 1
+            season_table[match[0][1][0][0]]["Points"] += 2
+            season_table[match[0][1][0][0]]["Wins"] += 1
+            season_table[match[0][0][0][0]]["Losses"] += 1
         elif inn2_ret == 0:
-            self.season_table[match[0][0][0][0]]["Points"] += 2
-            self.season_table[match[0][0][0][0]]["Wins"] += 1
-            self.season_table[match[0][1][0][0]]["Losses"] += 1
+            season_table[match[0][0][0][0]]["Points"] += 2
+            season_table[match[0][0][0][0]]["Wins"] += 1
+            season_table[match[0][1][0][0]]["Losses"] += 1
         elif inn2_ret == -1:
-            self.season_table[match[0][0][0][0]]["Points"] += 1
-            self.season_table[match[0][1][0][0]]["Points"] += 1
-        if verbose:
-            print(ret_str)
+            season_table[match[0][0][0][0]]["Points"] += 1
+            season_table[match[0][1][0][0]]["Points"] += 1
 
     def evaluate(self):
         pass
 
+    def throughput_summary(self):
+        assert self.profiler is not NULL_PROFILER, \
+            "EvaluationMetrics was created without a profiler"
+        self.profiler.print_summary()
+        return self.profiler.summary()
+
     def get_balls(self, inn):
         o = inn.Overs - 1
         b = inn.Balls
@@ -258,9 +343,16 @@ class EvaluationMetrics():
 
 
 class ActualStats():
-    def __init__(self, load_path=None, step=5, intervals=None):
-        self.BF_df = pd.read_csv("Data/Batting_First.csv")
-        self.BS_df = pd.read_csv("Data/Chasing.csv")
+    def __init__(self, load_path=None, step=5, intervals=None, BF_df=None,
+                 BS_df=None):
+        # BF_df and BS_df replace the csv files, e.g. with only the rows of a
+        # new season
+        if BF_df is None:
+            BF_df = pd.read_csv("Data/Batting_First.csv")
+        if BS_df is None:
+            BS_df = pd.read_csv("Data/Chasing.csv")
+        self.BF_df = BF_df
+        self.BS_df = BS_df
         self.bowler_stat = {}
         self.batsmen_stat = {}
         self.step = step
@@ -313,6 +405,30 @@ class ActualStats():
         with open(save_path, "wb") as fp:
             pickle.dump(save_evaluator, fp)
 
+    def merge(self, other):
+        # Appends the stats of another ActualStats, such as one run over the
+        # rows of a new season only
+        for name, cards in other.batsmen_stat.items():
+            self.batsmen_stat.setdefault(name, []).extend(cards)
+        for name, cards in other.bowler_stat.items():
+            self.bowler_stat.setdefault(name, []).extend(cards)
+        for key in self.progression_stat:
+            for ind, values in enumerate(other.progression_stat[key]):
+                self.progression_stat[key][ind].extend(values)
+            for interval, values in other.new_progression_stat[key].items():
+                self.new_progression_stat[key].setdefault(
+                    interval, []).extend(values)
+        self.total_stat.extend(other.total_stat)
+        self.chasing_stat.extend(other.chasing_stat)
+
+    def aggregate_index(self, index=None):
+        from Utils.aggregates import AggregateIndex
+        if index is None:
+            index = AggregateIndex()
+        index.update(self.BF_df, 1)
+        index.update(self.BS_df, 2)
+        return index
+
     def new_match(self, innings):
         if innings == 1 and self.curr_score is not None:
             self.total_stat.append(self.curr_score)
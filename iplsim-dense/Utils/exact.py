@@ -0,0 +1,352 @@
+import time
+import warnings
+import numpy as np
+from Utils.equivalence import new_innings
+from Utils.importance import FREE_HIT_CODES
+from Utils.transitions import POSITIONS, code_transitions
+
+OUTCOME_FIELDS = ["code", "probability", "runs", "wickets", "legal",
+                  "free_hit", "striker", "non_striker", "striker_runs",
+                  "striker_balls", "non_striker_runs", "non_striker_balls",
+                  "bowler_runs", "bowler_wickets"]
+
+
+def outcome_arrays():
+    # code_transitions as one row per (code, branch) for each free hit value
+    arrays = {}
+    for free_hit, table in code_transitions().items():
+        rows = []
+        for code, outcomes in enumerate(table):
+            for outcome in outcomes:
+                effect = outcome["effect"]
+                rows.append([code, outcome["probability"], effect["runs"],
+                             effect["wickets"], effect["legal"],
+                             effect["free_hit"],
+                             POSITIONS.index(effect["striker"]),
+                             POSITIONS.index(effect["non_striker"]),
+                             effect["striker_runs"], effect["striker_balls"],
+                             effect["non_striker_runs"],
+                             effect["non_striker_balls"],
+                             effect["bowler_runs"], effect["bowler_wickets"]])
+        rows = np.array(rows, dtype=np.float64)
+        arrays[free_hit] = {name: rows[:, i]
+                            for i, name in enumerate(OUTCOME_FIELDS)}
+        for name in ["code", "runs", "wickets", "legal", "free_hit",
+                     "striker", "non_striker"]:
+            arrays[free_hit][name] = arrays[free_hit][name].astype(np.int64)
+    return arrays
+
+
+def encode_keys(runs, wickets, striker, non_striker, free_hit):
+    return (((runs * 11 + wickets) * 11 + striker) * 11
+            + non_striker) * 2 + free_hit
+
+
+def decode_keys(keys):
+    free_hit = keys % 2
+    keys = keys // 2
+    non_striker = keys % 11
+    keys = keys // 11
+    striker = keys % 11
+    keys = keys // 11
+    return keys // 11, keys % 11, striker, non_striker, free_hit
+
+
+class ExactInnings():
+    # Propagates the probability of every innings state (score, wickets,
+    # striker and non-striker batting positions, free hit) ball by ball
+    # through the 120 legal deliveries, with the transitions of
+    # ball_prediction (Utils.transitions) and one batched model call per
+    # round of states. Wides and no balls keep their mass on the same legal
+    # ball for another round. score_bucket > 1 shares one model row between
+    # states whose scores differ only within the bucket.
+    # The player figures the model also reads are carried as their expected
+    # value within each state (batsmen) or over the states live at the
+    # start of each legal ball (bowlers), so the model is fed expected
+    # figures and the distributions are an approximation of the simulator's
+    # even with nothing pruned.
+    # States below min_mass and transitions below transition_cut * min_mass
+    # are pruned. Every figure is conditional on the mass that is left and
+    # is reported with the pruned mass; run() warns when that is above
+    # max_pruned. With the benchmark model the defaults prune about 8% of
+    # the mass in about 570k model rows per innings, about as many as 4500
+    # sampled innings; min_mass=1e-6 prunes 47% and 1e-8 takes several
+    # times as long.
+    def __init__(self, fixture, innings, model, min_mass=1e-7,
+                 score_bucket=5, transition_cut=0.01, batch_size=8192,
+                 max_pruned=0.01):
+        self.fixture = fixture
+        self.max_pruned = max_pruned
+        self.score_bucket = score_bucket
+        self.transition_cut = transition_cut
+        self.innings = innings
+        self.model = model
+        self.min_mass = min_mass
+        self.batch_size = batch_size
+        self.inn = new_innings(fixture, innings)
+        self.target = self.inn.Target
+        lineup = self.inn.Batting_lineup
+        self.striker_cols = np.array([b.Striker_Col for b in lineup])
+        self.non_striker_cols = np.array([b.Non_Striker_Col for b in lineup])
+        plan = self.inn.Bowling_lineup
+        self.plan = [plan[over % len(plan)] for over in range(20)]
+        names = sorted({bowler.Name for bowler in plan})
+        self.bowler_ids = [names.index(bowler.Name) for bowler in self.plan]
+        self.bowler_cols = [bowler.Bowler_Col for bowler in self.plan]
+        self.bowler_runs = np.zeros(len(names))
+        self.bowler_wickets = np.zeros(len(names))
+        self.outcomes = outcome_arrays()
+        self.final_runs = np.zeros(0)
+        self.final_wickets = np.zeros(11)
+        self.result = {"win": 0.0, "tie": 0.0, "loss": 0.0}
+        self.pruned = 0.0
+        self.conceded = 0.0
+        self.fed = 0.0
+        self.model_rows = 0
+        self.model_calls = 0
+
+    def model_inputs(self, legal, runs, wickets, striker, non_striker,
+                     free_hit, stats):
+        over = legal // 6
+        bowler = self.bowler_ids[over]
+        n = len(runs)
+        rows = np.tile(self.inn.Static_Row, (n, 1))
+        rows[:, self.inn.Numeric_Cols] = np.column_stack([
+            runs, wickets, np.full(n, over + 1), np.full(n, legal % 6 + 1),
+            free_hit, stats[:, 0], stats[:, 1], stats[:, 2], stats[:, 3],
+            np.full(n, self.bowler_runs[bowler]),
+            np.full(n, self.bowler_ids[:over].count(bowler)),
+            np.full(n, legal % 6),
+            np.full(n, self.bowler_wickets[bowler])])
+        rows[np.arange(n), self.striker_cols[striker]] = 1
+        rows[np.arange(n), self.non_striker_cols[non_striker]] = 1
+        rows[:, self.bowler_cols[over]] = 1
+        if self.inn.Required_Runs_Col is not None:
+            rows[:, self.inn.Required_Runs_Col] = self.target - runs
+        return rows
+
+    def predict(self, rows):
+        self.model_calls += -(-len(rows) // self.batch_size)
+        self.model_rows += len(rows)
+        return np.concatenate([self.model.predict(rows[i:i + self.batch_size],
+                                                  verbose=0)
+                               for i in range(0, len(rows), self.batch_size)])
+
+    def state_probs(self, legal, mass, runs, wickets, striker, non_striker,
+                    free_hit, stats):
+        # States whose score falls in the same score_bucket share one model
+        # row with their mass weighted mean score and figures
+        if self.score_bucket == 1:
+            q = self.predict(self.model_inputs(legal, runs, wickets, striker,
+                                               non_striker, free_hit, stats))
+            return np.array(q, dtype=np.float64)
+        groups, first, inverse = np.unique(
+            encode_keys(runs // self.score_bucket, wickets, striker,
+                        non_striker, free_hit),
+            return_index=True, return_inverse=True)
+        total = np.bincount(inverse, mass, len(groups))
+        mean_runs = np.bincount(inverse, mass * runs, len(groups)) / total
+        mean_stats = np.column_stack([
+            np.bincount(inverse, mass * stats[:, i], len(groups))
+            for i in range(4)]) / total[:, np.newaxis]
+        q = self.predict(self.model_inputs(
+            legal, mean_runs, wickets[first], striker[first],
+            non_striker[first], free_hit[first], mean_stats))
+        return np.array(q, dtype=np.float64)[inverse]
+
+    def finish(self, runs, wickets, mass):
+        size = int(runs.max()) + 1 if len(runs) else 0
+        if size > len(self.final_runs):
+            self.final_runs = np.concatenate(
+                [self.final_runs, np.zeros(size - len(self.final_runs))])
+        self.final_runs[:size] += np.bincount(runs, mass, size)
+        self.final_wickets += np.bincount(wickets, mass, 11)
+        if self.innings == 2:
+            self.result["win"] += mass[runs >= self.target].sum()
+            self.result["tie"] += mass[runs == self.target - 1].sum()
+            self.result["loss"] += mass[runs < self.target - 1].sum()
+
+    def step(self, legal, keys, mass, stats, ball_mass):
+        # One round on the states of a legal ball. Returns the states of the
+        # next legal ball and those that stay on this one. ball_mass is the
+        # live mass at the start of the legal ball: the bowler's figures are
+        # expected over it, however many rounds of extras the ball takes.
+        runs, wickets, striker, non_striker, free_hit = decode_keys(keys)
+        q = self.state_probs(legal, mass, runs, wickets, striker,
+                             non_striker, free_hit, stats)
+        q[np.ix_(free_hit == 1, FREE_HIT_CODES)] = 0
+        q /= q.sum(axis=1, keepdims=True)
+        over = legal // 6
+        bowler = self.bowler_ids[over]
+        parts = []
+        for fh in [0, 1]:
+            rows = free_hit == fh
+            if not rows.any():
+                continue
+            out = self.outcomes[fh]
+            p = (mass[rows, np.newaxis] * q[rows][:, out["code"]]
+                 * out["probability"])
+            # transitions far below min_mass are dropped before expansion
+            small = p < self.min_mass * self.transition_cut
+            self.pruned += p[small].sum()
+            i, j = np.nonzero(~small & (p > 0))
+            p = p[i, j]
+            conceded = (p * out["bowler_runs"][j]).sum()
+            self.conceded += conceded
+            self.bowler_runs[bowler] += conceded / ball_mass
+            self.bowler_wickets[bowler] += \
+                (p * out["bowler_wickets"][j]).sum() / ball_mass
+            s, n = striker[rows][i], non_striker[rows][i]
+            st = stats[rows][i]
+            new_wickets = wickets[rows][i] + out["wickets"][j]
+            new_slot = np.minimum(new_wickets + 1, 10)
+            slots = np.column_stack([s, n, new_slot])
+            figures = np.stack([
+                np.column_stack([st[:, 0] + out["striker_runs"][j],
+                                 st[:, 1] + out["striker_balls"][j]]),
+                np.column_stack([st[:, 2] + out["non_striker_runs"][j],
+                                 st[:, 3] + out["non_striker_balls"][j]]),
+                np.zeros((len(p), 2))], axis=1)
+            k = np.arange(len(p))
+            from_s, from_n = out["striker"][j], out["non_striker"][j]
+            new_s, new_n = slots[k, from_s], slots[k, from_n]
+            new_stats = np.column_stack([figures[k, from_s],
+                                         figures[k, from_n]])
+            is_legal = out["legal"][j] == 1
+            # strike changes at the end of every over
+            swap = is_legal & ((legal + 1) % 6 == 0)
+            new_s, new_n = (np.where(swap, new_n, new_s),
+                            np.where(swap, new_s, new_n))
+            new_stats[swap] = new_stats[swap][:, [2, 3, 0, 1]]
+            parts.append([runs[rows][i] + out["runs"][j], new_wickets, new_s,
+                          new_n, out["free_hit"][j], is_legal, p, new_stats])
+        fields = [np.concatenate(x) for x in zip(*parts)]
+        new_runs, new_wickets, new_s, new_n, new_fh, is_legal, p, st = fields
+        over_ = (new_wickets >= 10) | (is_legal & (legal + 1 == 120))
+        if self.innings == 2:
+            over_ |= new_runs >= self.target
+        self.finish(new_runs[over_], new_wickets[over_], p[over_])
+        live = ~over_
+        new_keys = encode_keys(new_runs, new_wickets, new_s, new_n, new_fh)
+        return [self.merge(new_keys[live & is_legal], p[live & is_legal],
+                           st[live & is_legal]),
+                self.merge(new_keys[live & ~is_legal], p[live & ~is_legal],
+                           st[live & ~is_legal])]
+
+    def merge(self, keys, mass, stats):
+        # Adds up the mass of equal states, averages their figures and
+        # prunes the states left below min_mass
+        keys, inverse = np.unique(keys, return_inverse=True)
+        total = np.bincount(inverse, mass, len(keys))
+        merged = np.column_stack([np.bincount(inverse, mass * stats[:, i],
+                                              len(keys))
+                                  for i in range(4)]) / total[:, np.newaxis]
+        keep = total >= self.min_mass
+        self.pruned += total[~keep].sum()
+        return keys[keep], total[keep], merged[keep]
+
+    def run(self):
+        start = time.perf_counter()
+        state = (encode_keys(np.array([0]), np.array([0]), np.array([0]),
+                             np.array([1]), np.array([0])),
+                 np.array([1.0]), np.zeros((1, 4)))
+        for legal in range(120):
+            pending = [state]
+            ball_mass = state[1].sum()
+            fed = self.bowler_runs.sum()
+            state = None
+            while pending:
+                keys, mass, stats = pending.pop()
+                if not len(keys):
+                    continue
+                next_ball, same_ball = self.step(legal, keys, mass, stats,
+                                                 ball_mass)
+                state = next_ball if state is None else self.merge(
+                    *[np.concatenate(x) for x in zip(state, next_ball)])
+                if same_ball[1].sum() >= self.min_mass:
+                    pending.append(same_ball)
+                else:
+                    self.pruned += same_ball[1].sum()
+            # the bowler runs fed to the model, weighted back by the live
+            # mass, add up to the expected runs conceded by the bowlers
+            self.fed += (self.bowler_runs.sum() - fed) * ball_mass
+            if state is None or not len(state[0]):
+                break
+        self.seconds = time.perf_counter() - start
+        assert np.isclose(self.fed, self.conceded), \
+            f"Bowler runs {self.fed} do not match {self.conceded} conceded"
+        if self.pruned > self.max_pruned:
+            warnings.warn(f"{self.pruned:.3f} of the probability mass was "
+                          f"pruned (max_pruned={self.max_pruned}); a lower "
+                          "min_mass prunes less for more model rows")
+        return self.report()
+
+    def report(self):
+        total = self.final_runs.sum()
+        runs = np.arange(len(self.final_runs))
+        ret = {"runs": self.final_runs, "wickets": self.final_wickets,
+               "mean_runs": (runs * self.final_runs).sum() / total,
+               "bowler_runs": self.bowler_runs.sum(),
+               "conceded": self.conceded,
+               "pruned": self.pruned, "retained": total,
+               "model_rows": self.model_rows,
+               "model_calls": self.model_calls, "seconds": self.seconds}
+        # results are conditional on the mass that was not pruned
+        if self.innings == 2:
+            ret.update({k: v / total for k, v in self.result.items()})
+        return ret
+
+
+def first_innings_distribution(fixture, model, **options):
+    # fixture: (Batting, Bowling, toss team, venue, target) as in
+    # Utils.equivalence; options are those of ExactInnings
+    return ExactInnings(fixture, 1, model, **options).run()
+
+
+def chase_probability(fixture, model, **options):
+    return ExactInnings(fixture, 2, model, **options).run()
+
+
+def match_probability(bat_first, chasing, toss, venue, model_inn_1,
+                      model_inn_2, coverage=0.999, target_step=5,
+                      **options):
+    # bat_first, chasing: [Batting, Bowling] squads. The chase is solved for
+    # every target within the central coverage of the first innings total
+    # distribution (every target_step-th target, interpolated in between),
+    # so a match costs one ExactInnings run per target ("targets") plus the
+    # first innings. With the benchmark model a chase takes 300-530k model
+    # rows and a match over 10M, against about 2.5M for 10,000 sampled
+    # matches; the exact answer only pays off for a single innings.
+    # The probabilities are conditional on the mass left after pruning; the
+    # first innings pruned mass and the chase pruned mass, weighted by the
+    # first innings totals, are returned with them.
+    first = first_innings_distribution([bat_first[0], chasing[1], toss,
+                                        venue, 0], model_inn_1, **options)
+    dist = first["runs"] / first["runs"].sum()
+    cdf = dist.cumsum()
+    tail = (1 - coverage) / 2
+    low = int(np.searchsorted(cdf, tail))
+    high = int(np.searchsorted(cdf, 1 - tail))
+    totals = list(range(low, high + 1, target_step))
+    if totals[-1] != high:
+        totals.append(high)
+    chases = {}
+    for total in totals:
+        chases[total] = chase_probability([chasing[0], bat_first[1], toss,
+                                           venue, total + 1], model_inn_2,
+                                          **options)
+    ret = {"chase_win": 0.0, "tie": 0.0, "defended": 0.0,
+           "first_innings": first, "targets": len(totals),
+           "seconds": first["seconds"]
+           + sum(x["seconds"] for x in chases.values()),
+           "model_rows": first["model_rows"]
+           + sum(x["model_rows"] for x in chases.values()),
+           "first_innings_pruned": first["pruned"],
+           "chase_pruned_max": max(x["pruned"] for x in chases.values())}
+    for key, name in [["win", "chase_win"], ["tie", "tie"],
+                      ["loss", "defended"], ["pruned", "chase_pruned"]]:
+        values = np.interp(np.arange(len(dist)), totals,
+                           [chases[t][key] for t in totals])
+        ret[name] = float((dist * values).sum())
+    ret["uncovered"] = float(dist[:low].sum() + dist[high + 1:].sum())
+    return ret
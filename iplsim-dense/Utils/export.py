@@ -0,0 +1,180 @@
+import os
+import pandas as pd
+from Utils.replay import ball_states
+from Utils.scorecard import overs_string
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+except ImportError:
+    pa = None
+
+TABLE_NAMES = ["matches", "innings", "batting", "bowling", "overs", "balls"]
+KEY_COLS = ["tournament", "match", "innings"]
+# String columns stored with dictionary encoding
+NAME_COLS = ["venue", "toss", "team_1", "team_2", "winner", "batting_team",
+             "bowling_team", "batsman", "bowler", "dismissal", "dismissed_by",
+             "striker", "non_striker", "team", "player"]
+# Integer columns that are missing for not out batsmen or the first innings
+NULLABLE_COLS = ["fall_runs", "fall_over", "target"]
+FORMATS = {"parquet": "parquet", "arrow": "ipc"}
+
+
+def innings_rows(inn, key):
+    balls = 6 * (inn.Overs - 1) + inn.Balls - 1
+    return [key + [inn.Batting_Team, inn.Bowling_Team, inn.Runs, inn.Wickets,
+                   balls, overs_string(inn), inn.Extras,
+                   inn.Target if inn.innings == 2 else None]]
+
+
+def batting_rows(inn, key):
+    rows = []
+    for position, i in enumerate(inn.Batting_lineup, 1):
+        if not i.Entered_Match:
+            continue
+        rows.append(key + [position, i.Name, inn.Batting_Team, i.Runs,
+                           i.Balls, i.Fours_Hit, i.Sixes_Hit, i.Dismissal,
+                           i.Dismissal_By, i.Fall_Runs, i.Fall_Over])
+    return rows
+
+
+def bowling_rows(inn, key):
+    return [key + [i.Name, inn.Bowling_Team, i.Runs_Conceded,
+                   len(i.Wickets_Taken), 6 * i.Overs_Bowled + i.Balls_Bowled]
+            for i in dict.fromkeys(inn.Bowling_lineup)]
+
+
+def over_rows(inn, key):
+    return [key + [over, i[-1].Name, i[0], i[1], i[2], i[3]]
+            for over, i in enumerate(inn.Overs_Summary, 1)]
+
+
+def ball_rows(inn, key):
+    # The state before every ball, regenerated from the recorded result codes
+    # so that innings from the batched engine, which keep no progress
+    # dataframe, export the same way. Innings saved before the codes were
+    # recorded export their stored progress dataframe.
+    states, codes = ball_states(inn)
+    return [key + [ball, x["overs"], x["balls"], x["striker"],
+                   x["non_striker"], x["bowler"], x["score"], x["wickets"],
+                   x["free_hit"], code]
+            for ball, (x, code) in enumerate(zip(states, codes), 1)]
+
+
+TABLE_COLS = {
+    "matches": ["tournament", "match", "venue", "toss", "team_1", "team_2",
+                "winner", "result"],
+    "innings": KEY_COLS + ["batting_team", "bowling_team", "runs", "wickets",
+                           "balls", "overs", "extras", "target"],
+    "batting": KEY_COLS + ["position", "batsman", "team", "runs", "balls",
+                           "fours", "sixes", "dismissal", "dismissed_by",
+                           "fall_runs", "fall_over"],
+    "bowling": KEY_COLS + ["bowler", "team", "runs", "wickets", "balls"],
+    "overs": KEY_COLS + ["over", "bowler", "runs", "wickets", "total_runs",
+                         "total_wickets"],
+    "balls": KEY_COLS + ["ball", "over", "ball_in_over", "striker",
+                         "non_striker", "bowler", "score", "wickets",
+                         "free_hit", "result"],
+}
+INNINGS_ROWS = {"innings": innings_rows, "batting": batting_rows,
+                "bowling": bowling_rows, "overs": over_rows,
+                "balls": ball_rows}
+
+
+def to_frame(rows, cols):
+    df = pd.DataFrame.from_records(rows, columns=cols)
+    for col in cols:
+        if col in NAME_COLS:
+            df[col] = df[col].astype("category")
+        elif col in NULLABLE_COLS:
+            df[col] = df[col].astype("Int64")
+    return df
+
+
+def match_tables(matches, tournaments=None, first_match=0, tables=None):
+    # matches: list of [first innings, second innings] such as
+    # EvaluationMetrics.innings_obj_list, tournaments the tournament id of
+    # every match
+    tables = tables or TABLE_NAMES
+    rows = {name: [] for name in tables}
+    for m, match in enumerate(matches):
+        if len(match) != 2:
+            continue
+        tournament = tournaments[m] if tournaments is not None else 0
+        match_id = first_match + m
+        inn1, inn2 = match
+        if "matches" in rows:
+            result, ret = inn2.get_result()
+            winner = {1: inn2.Batting_Team, 0: inn1.Batting_Team}.get(ret)
+            rows["matches"].append([tournament, match_id, inn1.Venue,
+                                    inn1.Toss, inn1.Batting_Team,
+                                    inn2.Batting_Team, winner, result])
+        for inn in match:
+            key = [tournament, match_id, inn.innings]
+            for name in tables:
+                if name in INNINGS_ROWS:
+                    rows[name] += INNINGS_ROWS[name](inn, key)
+    return {name: to_frame(rows[name], TABLE_COLS[name]) for name in tables}
+
+
+def evaluation_tables(evaluator, tables=None):
+    return match_tables(evaluator.innings_obj_list,
+                        evaluator.match_tournament, tables=tables)
+
+
+def stat_tables(stats, source="actual"):
+    # Player cards kept by ActualStats and EvaluationMetrics, which are
+    # nested dicts keyed by player without match ids
+    batting = [[source, name, n, x["Runs"], x["Balls Faced"], x["Fours"],
+                x["Sixes"], x["Dismissal Type"], x["Dismissed By"]]
+               for name, cards in stats.batsmen_stat.items()
+               for n, x in enumerate(cards)]
+    bowling = [[source, name, n, x["Runs Conceded"], x["Wickets Taken"],
+                x["Balls"]]
+               for name, cards in stats.bowler_stat.items()
+               for n, x in enumerate(cards)]
+    totals = [[source, n, x] for n, x in enumerate(stats.total_stat)]
+    return {
+        "player_batting": to_frame(batting, [
+            "source", "player", "card", "runs", "balls", "fours", "sixes",
+            "dismissal", "dismissed_by"]),
+        "player_bowling": to_frame(bowling, [
+            "source", "player", "card", "runs", "wickets", "balls"]),
+        "first_innings_totals": to_frame(totals, ["source", "card", "runs"]),
+    }
+
+
+def write_tables(tables, root, fmt="parquet", partition="tournament"):
+    # Each table becomes a dataset directory partitioned hive style
+    # (root/batting/tournament=3/...). Writing a tournament again replaces
+    # its partition and leaves the others in place.
+    assert pa is not None, "Exporting tables needs pyarrow"
+    assert fmt in FORMATS, "fmt should be 'parquet' or 'arrow'"
+    for name, df in tables.items():
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        ds.write_dataset(
+            table, os.path.join(root, name), format=FORMATS[fmt],
+            partitioning=[partition] if partition in df.columns else None,
+            partitioning_flavor="hive",
+            basename_template=name + "-{i}." + fmt,
+            existing_data_behavior="delete_matching")
+
+
+def read_table(root, name, columns=None, tournaments=None, fmt="parquet",
+               partition="tournament"):
+    # Only the requested columns and tournaments are read from disk
+    assert pa is not None, "Reading tables needs pyarrow"
+    dataset = ds.dataset(os.path.join(root, name), format=FORMATS[fmt],
+                         partitioning="hive")
+    expr = None
+    if tournaments is not None:
+        expr = ds.field(partition).isin(list(tournaments))
+    return dataset.to_table(columns=columns, filter=expr).to_pandas()
+
+
+def export_evaluation(evaluator, root, fmt="parquet", tables=None):
+    write_tables(evaluation_tables(evaluator, tables), root, fmt)
+
+
+def export_actual_stats(stats, root, fmt="parquet", source="actual"):
+    write_tables(stat_tables(stats, source), root, fmt, partition="source")
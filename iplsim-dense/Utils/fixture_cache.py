@@ -0,0 +1,185 @@
+import hashlib
+import json
+import pickle
+import random
+import time
+import numpy as np
+from Utils.batch_simulation import simulate_matches_batch
+from Utils.outcome_cache import model_fingerprint
+from Utils.sequential import table_ranking
+
+# Columns of a fixture's result array, one row per simulated match.
+# result is that of the chase: 1 chasing team won, 0 lost, -1 tie. toss is
+# the index in the fixture of the team that won the toss.
+RESULT_FIELDS = ["inn1_runs", "inn1_wickets", "inn1_balls", "inn2_runs",
+                 "inn2_wickets", "inn2_balls", "result", "toss"]
+TOSS_POLICIES = ["random", "bat_first", "chasing"]
+TABLE_KEYS = ["Played", "Wins", "Losses", "Points",
+              "ByRuns", "ByBalls", "AgRuns", "AgBalls"]
+
+
+def fixture_label(match):
+    # match as in EvaluationMetrics.matches: [[batting first squad, chasing
+    # squad], venue]. Names only, so that the seed stream of a fixture stays
+    # the same when its lineups change.
+    return [match[0][0][0][0], match[0][1][0][0], match[1]]
+
+
+def digest(value):
+    return hashlib.sha256(json.dumps(value).encode()).hexdigest()
+
+
+def innings_balls(inn):
+    # EvaluationMetrics.get_balls
+    if inn.Balls == 6:
+        return 6 * inn.Overs
+    return 6 * (inn.Overs - 1) + inn.Balls - 1
+
+
+class FixtureStore():
+    # Simulated results of whole fixtures, keyed by a fingerprint of both
+    # squads (batting lineups and bowling plans), the venue, the toss
+    # policy, both models, the seed and the number of simulations. Every
+    # fixture is simulated from its own seed stream, so a result is the same
+    # whichever other fixtures are simulated with it. A change to one squad
+    # only resimulates the fixtures of that team; the others are reused.
+    # form_matches shuffles which team bats first, and each order is a
+    # fixture of its own.
+    def __init__(self, model_inn_1, model_inn_2, n_sims=200, seed=0,
+                 toss_policy="random", fingerprints=None, load_path=None,
+                 engine=simulate_matches_batch):
+        assert toss_policy in TOSS_POLICIES, \
+            f"Unknown toss policy '{toss_policy}'"
+        self.models = [model_inn_1, model_inn_2]
+        self.n_sims = n_sims
+        self.seed = seed
+        self.toss_policy = toss_policy
+        # e.g. Utils.outcome_cache.checkpoint_fingerprint of the checkpoints
+        self.fingerprints = fingerprints or [model_fingerprint(model)
+                                             for model in self.models]
+        self.engine = engine
+        self.records = {}
+        self.hits = 0
+        self.simulated = 0
+        self.seconds = 0.0
+        if load_path is not None:
+            self.load_object(load_path)
+
+    def __len__(self):
+        return len(self.records)
+
+    def key(self, match):
+        return digest([match[0][0], match[0][1], match[1], self.toss_policy,
+                       self.fingerprints, self.seed, self.n_sims])
+
+    def fixture_seed(self, match):
+        return int(digest([self.seed] + fixture_label(match))[:16], 16)
+
+    def simulate(self, match):
+        # n_sims matches of the fixture through the batched engine, from the
+        # fixture's seed stream; the global random state is restored after
+        start = time.perf_counter()
+        state = random.getstate()
+        random.seed(self.fixture_seed(match))
+        squads = match[0]
+        tosses = []
+        for _ in range(self.n_sims):
+            if self.toss_policy == "random":
+                tosses.append(random.choice([0, 1]))
+            else:
+                tosses.append(TOSS_POLICIES.index(self.toss_policy) - 1)
+        fixtures = [[squads[0], squads[1], squads[toss][0][0], match[1]]
+                    for toss in tosses]
+        rows = []
+        for toss, (inn1, inn2, (_, code)) in zip(
+                tosses, self.engine(fixtures, *self.models)):
+            rows.append([inn1.Runs, inn1.Wickets, innings_balls(inn1),
+                         inn2.Runs, inn2.Wickets, innings_balls(inn2), code,
+                         toss])
+        random.setstate(state)
+        self.simulated += 1
+        self.seconds += time.perf_counter() - start
+        return {"label": fixture_label(match),
+                "results": np.array(rows, dtype=np.int16)}
+
+    def result(self, match):
+        key = self.key(match)
+        if key in self.records:
+            self.hits += 1
+        else:
+            self.records[key] = self.simulate(match)
+        return self.records[key]
+
+    def prune(self, matches):
+        # Drops the records no fixture of matches refers to any more
+        keep = {self.key(match) for match in matches}
+        stale = [key for key in self.records if key not in keep]
+        for key in stale:
+            del self.records[key]
+        return len(stale)
+
+    def stats(self):
+        lookups = self.hits + self.simulated
+        return {"records": len(self.records), "hits": self.hits,
+                "simulated": self.simulated,
+                "hit_rate": self.hits / lookups if lookups else None,
+                "simulate_seconds": self.seconds}
+
+    def load_object(self, load_path):
+        with open(load_path, "rb") as fp:
+            saved_store = pickle.load(fp)
+        self.records = saved_store["records"]
+
+    def save_object(self, save_path):
+        save_store = {"records": self.records}
+        with open(save_path, "wb") as fp:
+            pickle.dump(save_store, fp, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def fixture_summary(record):
+    # Outcome distribution of one fixture
+    results = record["results"]
+    fields = {name: results[:, i] for i, name in enumerate(RESULT_FIELDS)}
+    return {"label": record["label"], "n": len(results),
+            "chase_win": float((fields["result"] == 1).mean()),
+            "defended": float((fields["result"] == 0).mean()),
+            "tie": float((fields["result"] == -1).mean()),
+            "inn1_runs_mean": float(fields["inn1_runs"].mean()),
+            "inn1_runs_std": float(fields["inn1_runs"].std()),
+            "inn2_runs_mean": float(fields["inn2_runs"].mean()),
+            "inn2_wickets_mean": float(fields["inn2_wickets"].mean())}
+
+
+def project_season(evaluator, store, top=4):
+    # Season tables of the fixtures of EvaluationMetrics.form_matches, the
+    # i-th one built from the i-th simulation of every fixture through
+    # EvaluationMetrics.record_result. Only the fixtures missing from store
+    # are simulated; the evaluator's own stats and table are left as they
+    # are.
+    start = time.perf_counter()
+    simulated = store.simulated
+    records = [store.result(match) for match in evaluator.matches]
+    teams = [squad[0][0] for squad, _ in evaluator.teams]
+    tables = []
+    for i in range(store.n_sims):
+        table = {team: {key: 0 for key in TABLE_KEYS} for team in teams}
+        for match, record in zip(evaluator.matches, records):
+            row = record["results"][i].tolist()
+            evaluator.record_result(match, row[0], row[2], row[3], row[5],
+                                    row[6], table)
+        tables.append(table)
+    rankings = [table_ranking(table) for table in tables]
+    projection = {}
+    for team in teams:
+        positions = np.array([ranking.index(team) + 1
+                              for ranking in rankings])
+        projection[team] = {
+            "points": float(np.mean([t[team]["Points"] for t in tables])),
+            "wins": float(np.mean([t[team]["Wins"] for t in tables])),
+            "position": float(positions.mean()),
+            "top": float((positions <= top).mean()),
+            "first": float((positions == 1).mean())}
+    return {"teams": projection, "tables": tables, "seasons": len(tables),
+            "fixtures_simulated": store.simulated - simulated,
+            "fixtures_reused": len(records) - store.simulated + simulated,
+            "seconds": time.perf_counter() - start}
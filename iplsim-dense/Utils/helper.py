@@ -1,9 +1,13 @@
 import pandas as pd
-import functools
 import numpy as np
 import random
 import pickle
-from IPython.display import display
+from Utils.profiling import NULL_PROFILER
+from Utils.scorecard import innings_tables, overs_string
+try:
+    from IPython.display import display
+except ImportError:
+    display = print
 
 
 with open('GitData/BF_Cols.pkl', 'rb') as fp:
@@ -11,103 +15,49 @@ with open('GitData/BF_Cols.pkl', 'rb') as fp:
 with open('GitData/BS_Cols.pkl', 'rb') as fp:
     BS_Cols = pickle.load(fp)
 
+NUMERIC_COLS = ['Current_Score', 'Wickets', 'Overs', 'Balls', 'Free_Hit',
+                'Striker_Runs', 'Striker_Balls', 'Non_Striker_Runs',
+                'Non_Striker_Balls', 'Bowler_Runs', 'Bowler_Overs',
+                'Bowler_Balls', 'Bowler_Wickets']
+col_index_cache = {}
 
-def display_batting_table(inn1, display_level=1):
-    batting_lineup = inn1.Batting_lineup
-    bowling_lineup = inn1.Bowling_lineup
-    temp_df = pd.DataFrame(columns=["Batsman", "Runs", "Fours",
-                                    "Sixes", "Balls Faced", "Dismissal Type",
-                                    "Dismissed By"])
-    temp_stages = pd.DataFrame(columns=["Dismissed Batsman",
-                                        "Team Runs", "Overs"])
-    temp_bowling = pd.DataFrame(columns=["Bowler", "Runs Conceded",
-                                         "Wickets Taken", "Overs",
-                                         "Batsman Names"])
-    temp_over_summary = pd.DataFrame(columns=["Over", "Bowler",
-                                              "Runs Conceded",
-                                              "Wickets Taken", "Total Score",
-                                              "Total Wickets"])
-    # Creating Batting Table and Runs Scored
-    for i in batting_lineup:
-        if (i.Entered_Match):
-            row_dict = {
-                "Batsman": i.Name, "Runs": i.Runs,
-                "Fours": i.Fours_Hit,
-                "Sixes": i.Sixes_Hit,
-                "Balls Faced": i.Balls,
-                "Dismissal Type": i.Dismissal if i.Dismissal else 'Not Out',
-                "Dismissed By": i.Dismissal_By if i.Dismissal_By else "-"
-            }
-        else:
-            row_dict = {"Batsman": i.Name, "Runs": "-",
-                        "Fours": "-",
-                        "Sixes": "-",
-                        "Balls Faced": "-",
-                        "Dismissal Type": "-",
-                        "Dismissed By": "-"
-                        }
-        if (i.Fall_Runs):
-            stages_dict = {
-                "Dismissed Batsman": i.Name,
-                "Team Runs": i.Fall_Runs,
-                "Overs": i.Fall_Over
-            }
-            df_dictionary = pd.DataFrame([stages_dict])
-            temp_stages = pd.concat(
-                [temp_stages, df_dictionary], ignore_index=True)
-        df_dictionary = pd.DataFrame([row_dict])
-        temp_df = pd.concat([temp_df, df_dictionary], ignore_index=True)
-
-    # Creating Bowling Line Up
-    for i in set(bowling_lineup):
-        a = [k.Name for k in i.Wickets_Taken]
-        bowling_dict = {"Bowler": i.Name,
-                        "Runs Conceded": i.Runs_Conceded,
-                        "Wickets Taken": len(i.Wickets_Taken),
-                        "Overs": str(i.Overs_Bowled)+"."+str(i.Balls_Bowled),
-                        "Batsman Names": functools.reduce(
-                            lambda x, y: str(
-                                x)+", "+str(y), a) if len(a) else "-"
-                        }
-
-        df_dictionary = pd.DataFrame([bowling_dict])
-        temp_bowling = pd.concat([temp_bowling, df_dictionary],
-                                 ignore_index=True)
-    # Creating Over Summary
-    count = 1
-    for i in inn1.Overs_Summary:
-        row_summary = {"Over": count,
-                       "Bowler": i[-1].Name,
-                       "Runs Conceded": i[0],
-                       "Wickets Taken": i[1],
-                       "Total Score": i[2],
-                       "Total Wickets": i[3]}
-        count += 1
-        df_dictionary = pd.DataFrame([row_summary])
-        temp_over_summary = pd.concat([temp_over_summary, df_dictionary],
-                                      ignore_index=True)
-
-    o = inn1.Overs - 1
-    b = inn1.Balls
-    if (inn1.Balls == 6):
-        b = 0
-        o += 1
-    else:
-        b -= 1
-    temp_stages = temp_stages.sort_values(by=['Team Runs', 'Overs'])
 
+def get_col_index(cols):
+    key = tuple(cols)
+    if key not in col_index_cache:
+        col_index_cache[key] = {x: i for i, x in enumerate(key)}
+    return col_index_cache[key]
+
+
+def check_squad(Batting, Bowling, toss, venue, cols):
+    col_index = get_col_index(cols)
+    needed = ['Toss_'+toss, 'Venue_'+venue, 'Batting_Team_'+Batting[0],
+              'Bowling_Team_'+Bowling[0]]
+    for name in Batting[1:]:
+        needed += ['Striker_'+name, 'Non_Striker_'+name]
+    for name in Bowling[1:]:
+        needed.append('Bowler_'+name)
+    missing = []
+    for col in needed:
+        if col not in col_index and col not in missing:
+            missing.append(col)
+    return missing
+
+
+def display_batting_table(inn1, display_level=1):
+    tables = innings_tables(inn1)
     print(inn1.Batting_Team, " : ", inn1.Runs,
-          "/", inn1.Wickets, " in ", o, ".", b)
+          "/", inn1.Wickets, " in ", overs_string(inn1).replace(".", " . "))
     print("Extras:", inn1.Extras)
     print()
-    display(temp_df)
+    display(tables["batting"])
     print()
     if display_level == 1:
-        display(temp_bowling)
+        display(tables["bowling"])
         print()
-        display(temp_stages)
+        display(tables["fall_of_wickets"])
         print()
-        display(temp_over_summary)
+        display(tables["over_summary"])
 
 
 # display_batting_table(inn1)
@@ -219,7 +169,6 @@ class Bowler:
 class Innings:
     def __init__(self, Batting, Bowling, toss, venue, innings, df, target=0):
         self.df = df
-        self.set_df_cols = set(self.df.columns)
         self.innings = innings
         self.Toss = toss
         self.Venue = venue
@@ -242,6 +191,48 @@ class Innings:
         if self.innings == 1:
             self.Target = 0
         self.Overs_Summary = []
+        self.Results = []
+        self.Swap_Draws = []
+        self.Forced_Draws = None
+        # log likelihood ratio of the sampled path, see Utils.importance
+        self.Log_Weight = 0.0
+        # state before every ball played, see inn_progress_df
+        self.Progress_Rows = []
+        self.Progress_Df = None
+        # set between steps, see force_result and set_next_bowler
+        self.Forced_Results = []
+        self.Next_Bowler = None
+        self.Over_Start = 0
+        # over number: name of its bowler, for the overs set_next_bowler
+        # changed, so that Utils.replay plays them the same way
+        self.Bowler_Overrides = {}
+        self.resolve_columns(Batting, Bowling)
+
+    def resolve_columns(self, Batting, Bowling):
+        # Names are resolved into column indices once so that every ball only
+        # has to write a handful of integers into the model input
+        col_index = get_col_index(self.df.columns)
+        missing = check_squad(Batting, Bowling, self.Toss, self.Venue,
+                              self.df.columns)
+        assert not missing, "Unknown model input columns: " + \
+            ", ".join(missing)
+        self.Num_Inputs = len(col_index)
+        self.Numeric_Cols = [col_index[x] for x in NUMERIC_COLS]
+        self.Required_Runs_Col = col_index.get('Required_Runs')
+        self.Static_Row = np.zeros(self.Num_Inputs, dtype=np.float32)
+        self.Static_Cols = [col_index['Toss_'+self.Toss],
+                            col_index['Venue_'+self.Venue],
+                            col_index['Batting_Team_'+self.Batting_Team],
+                            col_index['Bowling_Team_'+self.Bowling_Team]]
+        self.Static_Row[self.Static_Cols] = 1
+        # positions in the numeric input of an EmbeddingLayout, see
+        # get_model_ids
+        self.Id_Layout = None
+        for batsman in self.Batting_lineup:
+            batsman.Striker_Col = col_index['Striker_'+batsman.Name]
+            batsman.Non_Striker_Col = col_index['Non_Striker_'+batsman.Name]
+        for bowler in set(self.Bowling_lineup):
+            bowler.Bowler_Col = col_index['Bowler_'+bowler.Name]
 
     def init_batsman(self, batting):
         return [Batsman(x) for x in batting]
@@ -261,8 +252,29 @@ class Innings:
     def get_next_bowler(self):
         if self.Overs == 20 and self.Balls == 6:
             return self.Bowler
+        if self.Next_Bowler is not None:
+            bowler, self.Next_Bowler = self.Next_Bowler, None
+            self.Bowler_Overrides[self.Overs] = bowler.Name
+            return bowler
         return self.Bowling_lineup[(self.Overs-1) % len(self.Bowling_lineup)]
 
+    def set_next_bowler(self, name):
+        # Bowler of the next over instead of the Bowling plan. An over
+        # without any delivery yet changes its bowler at once.
+        bowlers = {x.Name: x for x in self.Bowling_lineup}
+        assert name in bowlers, f"{name} is not in the bowling lineup"
+        if len(self.Results) == self.Over_Start:
+            self.Bowler = bowlers[name]
+            self.Bowler_Overrides[self.Overs] = name
+        else:
+            self.Next_Bowler = bowlers[name]
+
+    def force_result(self, *codes):
+        # Result codes played on the next balls instead of sampling the model
+        for code in codes:
+            assert 0 <= code <= 56, f"Unknown result code {code}"
+        self.Forced_Results += list(codes)
+
     def get_next_ball(self):
         if self.Balls == 6:
             self.swap_batsman()
@@ -279,121 +291,210 @@ class Innings:
                                            self.Runs, self.Wickets, self.Bowler
                                            ])
             self.Bowler = self.get_next_bowler()
+            self.Over_Start = len(self.Results)
         else:
             self.Balls += 1
 
     def swap_batsman(self):
         self.Striker, self.Non_Striker = self.Non_Striker, self.Striker
 
-    def get_new_row(self, score, wickets, overs, balls, free_hit, toss,
-                    venue, batting_team, bowling_team, striker, striker_runs,
-                    striker_balls, non_striker,
-                    non_striker_runs, non_striker_balls, bowler,
-                    bowler_runs, bowler_overs, bowler_balls, bowler_wickets):
-        n_row = {x: 0 for x in self.df.columns}
-        n_row['Current_Score'] = score
-        n_row['Wickets'] = wickets
-        n_row['Overs'] = overs
-        n_row['Balls'] = balls
-        n_row['Free_Hit'] = free_hit
-        n_row['Striker_Runs'] = striker_runs
-        n_row['Striker_Balls'] = striker_balls
-        n_row['Non_Striker_Runs'] = non_striker_runs
-        n_row['Non_Striker_Balls'] = non_striker_balls
-        n_row['Bowler_Runs'] = bowler_runs
-        n_row['Bowler_Overs'] = bowler_overs
-        n_row['Bowler_Balls'] = bowler_balls
-        n_row['Bowler_Wickets'] = bowler_wickets
-        n_row['Toss_'+toss] = 1
-        n_row['Venue_'+venue] = 1
-        n_row['Batting_Team_'+batting_team] = 1
-        n_row['Bowling_Team_'+bowling_team] = 1
-        n_row['Striker_'+striker] = 1
-        n_row['Non_Striker_'+non_striker] = 1
-        n_row['Bowler_'+bowler] = 1
-        if 'Required_Runs' in self.set_df_cols:
-            n_row['Required_Runs'] = self.Target - score
-
-        # if self.Target > 0 and 'Target' in self.set_df_cols:
-        #     n_row['Target'] = self.Target
-
-        progress_row = {}
-        progress_row["score"] = score
-        progress_row["wickets"] = wickets
-        progress_row["overs"] = overs
-        progress_row["balls"] = balls
-        progress_row["free_hit"] = free_hit
-        progress_row["striker"] = striker
-        progress_row["striker_runs"] = striker_runs
-        progress_row["striker_balls"] = striker_balls
-        progress_row["non_striker"] = non_striker
-        progress_row["non_striker_runs"] = non_striker_runs
-        progress_row["non_striker_balls"] = non_striker_balls
-        progress_row["bowler"] = bowler
-        progress_row["bowler_runs"] = bowler_runs
-        progress_row["bowler_overs"] = bowler_overs
-        progress_row["bowler_balls"] = bowler_balls
-        progress_row["bowler_wickets"] = bowler_wickets
-        return n_row, progress_row
-
-    def simulate_inning(self, model):
-        innings_progress_dic = {}
-        progress_row_count = 0
-        free_hit_not_possible = [8, 9, 10, 12]
-        while(True):
-            if self.innings == 1:
-                if (self.Overs > 20 or self.Wickets == 10):
-                    self.inn_progress_df = pd.DataFrame.from_dict(
-                        innings_progress_dic, orient='index')
-                    return self.Runs+1
-            elif self.innings == 2:
-                if (self.Overs > 20 or
-                        self.Wickets == 10 or self.Runs >= self.Target):
-                    self.inn_progress_df = pd.DataFrame.from_dict(
-                        innings_progress_dic, orient='index')
-                    if self.Runs >= self.Target:
-                        return (self.Batting_Team + " won by "
-                                + str(10-self.Wickets)+" Wickets", 1)
-                    elif self.Runs == self.Target - 1:
-                        return ((f"Both teams have hit {self.Runs} "
-                                 "and the game has ended in a tie"), -1)
+    def innings_over(self):
+        if self.Overs > 20 or self.Wickets == 10:
+            return True
+        return self.innings == 2 and self.Runs >= self.Target
+
+    def get_result(self):
+        if self.innings == 1:
+            return self.Runs+1
+        if self.Runs >= self.Target:
+            return (self.Batting_Team + " won by "
+                    + str(10-self.Wickets)+" Wickets", 1)
+        elif self.Runs == self.Target - 1:
+            return ((f"Both teams have hit {self.Runs} "
+                     "and the game has ended in a tie"), -1)
+        else:
+            return (self.Bowling_Team + " won by "
+                    + str(self.Target-self.Runs-1)+" Runs", 0)
+
+    def get_model_input(self, row=None):
+        if row is None:
+            row = self.Static_Row.copy()
+        else:
+            row[:] = self.Static_Row
+        row[self.Numeric_Cols] = self.numeric_values()
+        row[self.Striker.Striker_Col] = 1
+        row[self.Non_Striker.Non_Striker_Col] = 1
+        row[self.Bowler.Bowler_Col] = 1
+        if self.Required_Runs_Col is not None:
+            row[self.Required_Runs_Col] = self.Target - self.Runs
+        return row
+
+    def numeric_values(self):
+        # In the order of NUMERIC_COLS
+        return (self.Runs, self.Wickets, self.Overs, self.Balls,
+                self.Free_Hit, self.Striker.Runs, self.Striker.Balls,
+                self.Non_Striker.Runs, self.Non_Striker.Balls,
+                self.Bowler.Runs_Conceded, self.Bowler.Overs_Bowled,
+                self.Bowler.Balls_Bowled, len(self.Bowler.Wickets_Taken))
+
+    def get_model_ids(self, layout):
+        # The input of get_model_input as the numeric values and slot ids of
+        # an EmbeddingModel (Utils.embedding_model) over the same columns,
+        # read from the resolved column indices without a one hot row
+        if self.Id_Layout is not layout:
+            assert layout.cols == list(self.df.columns), \
+                "The embedding layout has other columns than the innings"
+            position = {i: j for j, i in enumerate(layout.numeric_index)}
+            self.Id_Numeric = [position[i] for i in self.Numeric_Cols]
+            self.Id_Required = position.get(self.Required_Runs_Col)
+            self.Static_Ids = [layout.col_id[i] for i in self.Static_Cols]
+            self.Id_Layout = layout
+        numeric = np.zeros(len(layout.numeric_index), dtype=np.float32)
+        numeric[self.Id_Numeric] = self.numeric_values()
+        if self.Id_Required is not None:
+            numeric[self.Id_Required] = self.Target - self.Runs
+        ids = np.array(self.Static_Ids + [
+            layout.col_id[self.Striker.Striker_Col],
+            layout.col_id[self.Non_Striker.Non_Striker_Col],
+            layout.col_id[self.Bowler.Bowler_Col]], dtype=np.int32)
+        return numeric, ids
+
+    def get_progress_row(self):
+        return {
+            "score": self.Runs,
+            "wickets": self.Wickets,
+            "overs": self.Overs,
+            "balls": self.Balls,
+            "free_hit": self.Free_Hit,
+            "striker": self.Striker.Name,
+            "striker_runs": self.Striker.Runs,
+            "striker_balls": self.Striker.Balls,
+            "non_striker": self.Non_Striker.Name,
+            "non_striker_runs": self.Non_Striker.Runs,
+            "non_striker_balls": self.Non_Striker.Balls,
+            "bowler": self.Bowler.Name,
+            "bowler_runs": self.Bowler.Runs_Conceded,
+            "bowler_overs": self.Bowler.Overs_Bowled,
+            "bowler_balls": self.Bowler.Balls_Bowled,
+            "bowler_wickets": len(self.Bowler.Wickets_Taken),
+        }
+
+    def snapshot(self):
+        # State after the last step, with the batsmen missing once all out
+        striker = self.Striker or Batsman(None)
+        non_striker = self.Non_Striker or Batsman(None)
+        return {"score": self.Runs, "wickets": self.Wickets,
+                "overs": self.Overs, "balls": self.Balls,
+                "free_hit": self.Free_Hit, "extras": self.Extras,
+                "target": self.Target, "striker": striker.Name,
+                "striker_runs": striker.Runs,
+                "striker_balls": striker.Balls,
+                "non_striker": non_striker.Name,
+                "non_striker_runs": non_striker.Runs,
+                "non_striker_balls": non_striker.Balls,
+                "bowler": self.Bowler.Name,
+                "bowler_runs": self.Bowler.Runs_Conceded,
+                "bowler_overs": self.Bowler.Overs_Bowled,
+                "bowler_balls": self.Bowler.Balls_Bowled,
+                "bowler_wickets": len(self.Bowler.Wickets_Taken),
+                "result": self.Results[-1] if self.Results else None,
+                "innings_over": self.innings_over()}
+
+    @property
+    def inn_progress_df(self):
+        # Built from Progress_Rows when first read after a change. Innings
+        # pickled before Progress_Rows existed keep their stored frame.
+        if "Progress_Rows" not in self.__dict__:
+            return self.__dict__["inn_progress_df"]
+        if self.Progress_Df is None or \
+                len(self.Progress_Df) != len(self.Progress_Rows):
+            self.Progress_Df = pd.DataFrame(self.Progress_Rows)
+        return self.Progress_Df
+
+    def sample_result(self, q):
+        q = [i for i in q]
+        if self.Free_Hit == 1:
+            for i in [8, 9, 10, 12]:
+                q[i] = 0
+        return random.choices(range(0, 57), weights=q, k=1)[0]
+
+    def simulate_inning(self, model, profiler=None):
+        for _ in self.steps(model, "over", profiler):
+            pass
+        return self.get_result()
+
+    def steps(self, model, per="ball", profiler=None):
+        # Plays the innings one ball (or one over) per step and yields a
+        # snapshot after each. Between steps the caller may force_result or
+        # set_next_bowler, e.g.
+        #     for state in inn.steps(model, "over"):
+        #         if state["overs"] == 17:
+        #             inn.set_next_bowler("JJ Bumrah")
+        assert per in ["ball", "over"], f"Unknown step '{per}'"
+        if profiler is None:
+            profiler = NULL_PROFILER
+        profiler.begin("innings")
+        try:
+            yield from self.play_steps(model, per, profiler)
+        finally:
+            # also when the caller stops iterating before the end
+            profiler.end("innings", innings=self.innings, runs=self.Runs,
+                         wickets=self.Wickets)
+
+    def play_steps(self, model, per, profiler):
+        # Models with predict_ids (EmbeddingModel) are fed ids directly
+        use_ids = hasattr(model, "predict_ids")
+        model_row = np.zeros(self.Num_Inputs, dtype=np.float32)
+        while not self.innings_over():
+            overs_done = len(self.Overs_Summary)
+            with profiler.stage("encode"):
+                progress_dic = self.get_progress_row()
+                if self.Forced_Results:
+                    pass
+                elif use_ids:
+                    numeric, ids = self.get_model_ids(model.layout)
+                else:
+                    model_inp = self.get_model_input(model_row)
+            if self.Forced_Results:
+                res = self.Forced_Results.pop(0)
+                assert not (self.Free_Hit == 1 and res in [8, 9, 10, 12]), \
+                    f"Result code {res} is not possible on a free hit"
+            else:
+                with profiler.stage("predict"):
+                    if use_ids:
+                        q = model.predict_ids(numeric[np.newaxis],
+                                              ids[np.newaxis])
                     else:
-                        return (self.Bowling_Team + " won by "
-                                + str(self.Target-self.Runs-1)+" Runs", 0)
-
-            curr_row, progress_dic = self.get_new_row(
-                self.Runs, self.Wickets, self.Overs,
-                self.Balls, self.Free_Hit, self.Toss,
-                self.Venue, self.Batting_Team,
-                self.Bowling_Team, self.Striker.Name,
-                self.Striker.Runs, self.Striker.Balls,
-                self.Non_Striker.Name,
-                self.Non_Striker.Runs,
-                self.Non_Striker.Balls,
-                self.Bowler.Name,
-                self.Bowler.Runs_Conceded,
-                self.Bowler.Overs_Bowled,
-                self.Bowler.Balls_Bowled,
-                len(self.Bowler.Wickets_Taken))
-
-            self.df = self.df[0:0]
-            df_dictionary = pd.DataFrame([curr_row])
-            self.df = pd.concat([self.df, df_dictionary], ignore_index=True)
-            self.df = self.df.astype(int)
-            model_inp = self.df.values
-            q = model.predict(np.array(model_inp), verbose=0)
-            q = [i for i in q[0]]
-            if self.Free_Hit == 1:
-                for i in free_hit_not_possible:
-                    q[i] = 0
-
-            res = random.choices(range(0, 57), weights=q, k=1)[0]
-            progress_dic["result"] = res
-            innings_progress_dic[progress_row_count] = progress_dic
-            progress_row_count += 1
-            self.ball_prediction(res)
+                        q = model.predict(model_inp[np.newaxis], verbose=0)
+                with profiler.stage("sample"):
+                    res = self.sample_result(q[0])
+                profiler.count("model_calls")
+                profiler.count("model_rows")
+            with profiler.stage("bookkeeping"):
+                progress_dic["result"] = res
+                self.Progress_Rows.append(progress_dic)
+            with profiler.stage("update"):
+                self.ball_prediction(res)
+            profiler.count("balls")
+            if per == "ball" or len(self.Overs_Summary) > overs_done or \
+                    self.innings_over():
+                yield self.snapshot()
+
+    def swap_draw(self, weights=None):
+        # Whether the batsmen crossed before a catch or run out. The draws
+        # are recorded, and can be forced, so that an innings can be replayed
+        # from its result codes (see Utils.replay).
+        if self.Forced_Draws is not None:
+            ran = next(self.Forced_Draws)
+        elif weights is None:
+            ran = random.choice([0, 1])
+        else:
+            ran = random.choices([0, 1], weights=weights)[0]
+        self.Swap_Draws.append(ran)
+        return ran
 
     def ball_prediction(self, res):
+        self.Results.append(res)
         # Setting FreeHit to 0
         free_hit_continue = [30, 31, 32, 33, 34, 50, 51, 52, 53, 54]
         if (res not in free_hit_continue):
@@ -449,7 +550,7 @@ class Innings:
                 self.Bowler.update(0, 1)
             self.Striker = self.get_next_batsman()
             if (res == 9 or res == 13):
-                ran = random.choices([0, 1], weights=(0.3, 0.7))[0]
+                ran = self.swap_draw((0.3, 0.7))
                 if ran:
                     self.swap_batsman()
             self.get_next_ball()
@@ -516,7 +617,7 @@ class Innings:
                 self.Bowler.update(0, 1)  # Increment 1 Ball
                 self.Non_Striker = self.get_next_batsman()
 
-                ran = random.choice([0, 1])
+                ran = self.swap_draw()
                 if (ran):
                     self.swap_batsman()
                 self.get_next_ball()
@@ -528,7 +629,7 @@ class Innings:
                 self.Bowler.update(0, 1)  # Increment 1 Ball
                 self.Striker = self.get_next_batsman()
 
-                ran = random.choice([0, 1])
+                ran = self.swap_draw()
                 if (ran):
                     self.swap_batsman()
                 self.get_next_ball()
@@ -542,7 +643,7 @@ class Innings:
                 self.Bowler.update(1, 1)  # Increment 1 Ball and 1 run
                 self.Non_Striker = self.get_next_batsman()
 
-                ran = random.choice([0, 1])
+                ran = self.swap_draw()
                 if (ran):
                     self.swap_batsman()
                 self.get_next_ball()
@@ -556,7 +657,7 @@ class Innings:
                 self.Bowler.update(1, 1)  # Increment 1 Ball 1 run
                 self.Striker = self.get_next_batsman()
 
-                ran = random.choice([0, 1])
+                ran = self.swap_draw()
                 if (ran):
                     self.swap_batsman()
                 self.get_next_ball()
@@ -571,7 +672,7 @@ class Innings:
                 self.Bowler.update(2, 1)  # Increment 1 Ball and 2 run
                 self.Non_Striker = self.get_next_batsman()
 
-                ran = random.choice([0, 1])
+                ran = self.swap_draw()
                 if (ran):
                     self.swap_batsman()
                 self.get_next_ball()
@@ -585,7 +686,7 @@ class Innings:
                 self.Bowler.update(2, 1)  # Increment 1 Ball 2 runs
                 self.Striker = self.get_next_batsman()
 
-                ran = random.choice([0, 1])
+                ran = self.swap_draw()
                 if (ran):
                     self.swap_batsman()
                 self.get_next_ball()
@@ -600,7 +701,7 @@ class Innings:
                 self.Bowler.update(3, 1)  # Increment 1 Ball and 3 run
                 self.Non_Striker = self.get_next_batsman()
 
-                ran = random.choice([0, 1])
+                ran = self.swap_draw()
                 if (ran):
                     self.swap_batsman()
                 self.get_next_ball()
@@ -614,7 +715,7 @@ class Innings:
                 self.Bowler.update(3, 1)  # Increment 1 Ball 3 runs
                 self.Striker = self.get_next_batsman()
 
-                ran = random.choice([0, 1])
+                ran = self.swap_draw()
                 if (ran):
                     self.swap_batsman()
                 self.get_next_ball()
@@ -652,7 +753,7 @@ class Innings:
                 self.Bowler.update(0, 1)  # Increment 1 Ball and 0 run
                 self.Non_Striker = self.get_next_batsman()
 
-                ran = random.choice([0, 1])
+                ran = self.swap_draw()
                 if (ran):
                     self.swap_batsman()
                 self.get_next_ball()
@@ -667,7 +768,7 @@ class Innings:
                 self.Bowler.update(0, 1)  # Increment 1 Ball 0 run
                 self.Striker = self.get_next_batsman()
 
-                ran = random.choice([0, 1])
+                ran = self.swap_draw()
                 if (ran):
                     self.swap_batsman()
                 self.get_next_ball()
@@ -683,7 +784,7 @@ class Innings:
                 self.Bowler.update(0, 1)  # Increment 1 Ball and 0 run
                 self.Non_Striker = self.get_next_batsman()
 
-                ran = random.choice([0, 1])
+                ran = self.swap_draw()
                 if (ran):
                     self.swap_batsman()
                 self.get_next_ball()
@@ -698,7 +799,7 @@ class Innings:
                 self.Bowler.update(0, 1)  # Increment 1 Ball 0 runs
                 self.Striker = self.get_next_batsman()
 
-                ran = random.choice([0, 1])
+                ran = self.swap_draw()
                 if (ran):
                     self.swap_batsman()
                 self.get_next_ball()
@@ -714,7 +815,7 @@ class Innings:
                 self.Bowler.update(0, 1)  # Increment 1 Ball and 0 run
                 self.Non_Striker = self.get_next_batsman()
 
-                ran = random.choice([0, 1])
+                ran = self.swap_draw()
                 if (ran):
                     self.swap_batsman()
                 self.get_next_ball()
@@ -729,7 +830,7 @@ class Innings:
                 self.Bowler.update(0, 1)  # Increment 1 Ball 0 runs
                 self.Striker = self.get_next_batsman()
 
-                ran = random.choice([0, 1])
+                ran = self.swap_draw()
                 if (ran):
                     self.swap_batsman()
                 self.get_next_ball()
@@ -746,7 +847,7 @@ class Innings:
                 self.Bowler.update(1, 0)  # Increment 0 Ball and 1 run
                 self.Non_Striker = self.get_next_batsman()
 
-                ran = random.choice([0, 1])
+                ran = self.swap_draw()
                 if (ran):
                     self.swap_batsman()
 
@@ -760,7 +861,7 @@ class Innings:
                 self.Bowler.update(1, 0)  # Increment 0 Ball 1 runs
                 self.Striker = self.get_next_batsman()
 
-                ran = random.choice([0, 1])
+                ran = self.swap_draw()
                 if (ran):
                     self.swap_batsman()
 
@@ -775,7 +876,7 @@ class Innings:
                 self.Bowler.update(2, 0)  # Increment 0 Ball and 2 run
                 self.Non_Striker = self.get_next_batsman()
 
-                ran = random.choice([0, 1])
+                ran = self.swap_draw()
                 if (ran):
                     self.swap_batsman()
 
@@ -789,7 +890,7 @@ class Innings:
                 self.Bowler.update(2, 0)  # Increment 0 Ball 2 runs
                 self.Striker = self.get_next_batsman()
 
-                ran = random.choice([0, 1])
+                ran = self.swap_draw()
                 if (ran):
                     self.swap_batsman()
 
@@ -806,7 +907,7 @@ class Innings:
                 self.Bowler.update(1, 0)  # Increment 0 Ball and 1 run
                 self.Non_Striker = self.get_next_batsman()
                 self.Free_Hit = 1  # Set free hit
-                ran = random.choice([0, 1])
+                ran = self.swap_draw()
                 if (ran):
                     self.swap_batsman()
 
@@ -820,7 +921,7 @@ class Innings:
                 self.Bowler.update(1, 0)  # Increment 0 Ball 1 runs
                 self.Striker = self.get_next_batsman()
                 self.Free_Hit = 1  # Set free hit
-                ran = random.choice([0, 1])
+                ran = self.swap_draw()
                 if (ran):
                     self.swap_batsman()
             # Noball, 1 run non striker out
@@ -834,7 +935,7 @@ class Innings:
                 self.Bowler.update(2, 0)  # Increment 0 Ball and 2 run
                 self.Non_Striker = self.get_next_batsman()
                 self.Free_Hit = 1  # Set free hit
-                ran = random.choice([0, 1])
+                ran = self.swap_draw()
                 if (ran):
                     self.swap_batsman()
 
@@ -848,14 +949,17 @@ class Innings:
                 self.Bowler.update(2, 0)  # Increment 0 Ball 2 runs
                 self.Striker = self.get_next_batsman()
                 self.Free_Hit = 1  # Set free hit
-                ran = random.choice([0, 1])
+                ran = self.swap_draw()
                 if (ran):
                     self.swap_batsman()
 
 
 class Match:
     def __init__(self, TeamA, TeamB, Venue, model_inn_1,
-                 model_inn_2, Display=0, Result=1):
+                 model_inn_2, Display=0, Result=1, profiler=None):
+        if profiler is None:
+            profiler = NULL_PROFILER
+        profiler.begin("match")
         self.inn1 = 0
         self.inn2 = 0
         model_inn_1.reset_states()
@@ -871,10 +975,12 @@ class Match:
             if (choice):
                 self.inn1 = Innings(
                     TeamA[0], TeamB[1], TeamA[0][0], Venue, 1, inn1_df)
-                target = int(self.inn1.simulate_inning(model_inn_1))
+                target = int(self.inn1.simulate_inning(model_inn_1,
+                                                       profiler))
                 self.inn2 = Innings(
                     TeamB[0], TeamA[1], TeamA[0][0], Venue, 2, inn2_df, target)
-                result, num = self.inn2.simulate_inning(model_inn_2)
+                result, num = self.inn2.simulate_inning(model_inn_2,
+                                                        profiler)
                 if Display:
                     print(TeamA[0][0]+" won the toss and chose to ", end='')
                     print("Bat first")
@@ -890,10 +996,12 @@ class Match:
             else:
                 self.inn1 = Innings(
                     TeamB[0], TeamA[1], TeamA[0][0], Venue, 1, inn1_df)
-                target = int(self.inn1.simulate_inning(model_inn_1))
+                target = int(self.inn1.simulate_inning(model_inn_1,
+                                                       profiler))
                 self.inn2 = Innings(
                     TeamA[0], TeamB[1], TeamA[0][0], Venue, 2, inn2_df, target)
-                result, num = self.inn2.simulate_inning(model_inn_2)
+                result, num = self.inn2.simulate_inning(model_inn_2,
+                                                        profiler)
                 if Display:
                     print(TeamA[0][0]+" won the toss and chose to ", end='')
                     print("Bowl first")
@@ -911,10 +1019,12 @@ class Match:
             if(choice):
                 self.inn1 = Innings(
                     TeamB[0], TeamA[1], TeamB[0][0], Venue, 1, inn1_df)
-                target = int(self.inn1.simulate_inning(model_inn_1))
+                target = int(self.inn1.simulate_inning(model_inn_1,
+                                                       profiler))
                 self.inn2 = Innings(
                     TeamA[0], TeamB[1], TeamB[0][0], Venue, 2, inn2_df, target)
-                result, num = self.inn2.simulate_inning(model_inn_2)
+                result, num = self.inn2.simulate_inning(model_inn_2,
+                                                        profiler)
                 if Display:
                     print(TeamB[0][0]+" won the toss and chose to ", end='')
                     print("Bat first")
@@ -931,10 +1041,12 @@ class Match:
             else:
                 self.inn1 = Innings(
                     TeamA[0], TeamB[1], TeamB[0][0], Venue, 1, inn1_df)
-                target = int(self.inn1.simulate_inning(model_inn_1))
+                target = int(self.inn1.simulate_inning(model_inn_1,
+                                                       profiler))
                 self.inn2 = Innings(
                     TeamB[0], TeamA[1], TeamB[0][0], Venue, 2, inn2_df, target)
-                result, num = self.inn2.simulate_inning(model_inn_2)
+                result, num = self.inn2.simulate_inning(model_inn_2,
+                                                        profiler)
                 if Display:
                     print(TeamB[0][0]+" won the toss and chose to ", end='')
                     print("Bowl first")
@@ -947,3 +1059,4 @@ class Match:
                     self.Winner = TeamB[0][0]
                 else:
                     self.Winner = TeamA[0][0]
+        profiler.end("match", winner=self.Winner)
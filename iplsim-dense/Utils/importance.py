@@ -0,0 +1,144 @@
+import numpy as np
+from Utils.aggregates import code_effects
+from Utils.batch_simulation import simulate_innings_batch
+from Utils.equivalence import new_innings
+from Utils.replay import ball_states
+
+# Codes that Innings.sample_result rules out on a free hit
+FREE_HIT_CODES = [8, 9, 10, 12]
+
+
+def code_groups():
+    effects = code_effects()
+    return {"four": np.nonzero(effects["batsman_runs"] == 4)[0],
+            "six": np.nonzero(effects["batsman_runs"] == 6)[0],
+            "boundary": np.nonzero(np.isin(effects["batsman_runs"],
+                                           [4, 6]))[0],
+            "wicket": np.nonzero(effects["wickets"] > 0)[0],
+            "bowler_wicket": np.nonzero(effects["bowler_wickets"] > 0)[0],
+            "legal": np.nonzero(effects["bowler_balls"] > 0)[0]}
+
+
+def tilt_vector(**factors):
+    # Multiplicative tilt of the 57 outcome probabilities per code group,
+    # e.g. tilt_vector(boundary=2.5) makes every four and six 2.5 times as
+    # likely before renormalising
+    groups = code_groups()
+    tilt = np.ones(57)
+    for name, factor in factors.items():
+        assert name in groups, f"Unknown code group '{name}'"
+        tilt[groups[name]] *= factor
+    return tilt
+
+
+class TiltedSampler():
+    # Sampler for simulate_innings_batch that draws from the tilted
+    # distribution q * tilt instead of q and adds log(p / p_tilted) of every
+    # draw to Innings.Log_Weight. tilt is an array of 57 factors or a
+    # function of the innings returning one, e.g. to tilt the death overs
+    # only.
+    def __init__(self, tilt, seed=None):
+        self.tilt = tilt
+        self.rng = np.random.default_rng(seed)
+
+    def tilts(self, live):
+        if callable(self.tilt):
+            return np.array([self.tilt(inn) for inn in live])
+        return np.broadcast_to(self.tilt, (len(live), 57))
+
+    def __call__(self, live, q):
+        p = np.array(q, dtype=np.float64)
+        free_hit = np.array([inn.Free_Hit == 1 for inn in live])
+        p[np.ix_(free_hit, FREE_HIT_CODES)] = 0
+        p /= p.sum(axis=1, keepdims=True)
+        t = p * self.tilts(live)
+        t /= t.sum(axis=1, keepdims=True)
+        u = self.rng.random(len(live))[:, np.newaxis]
+        results = (t.cumsum(axis=1) < u).sum(axis=1)
+        results = np.minimum(results, 56)
+        rows = np.arange(len(live))
+        log_ratio = np.log(p[rows, results]) - np.log(t[rows, results])
+        for inn, ratio in zip(live, log_ratio):
+            inn.Log_Weight += ratio
+        return results.tolist()
+
+
+def importance_estimate(values, log_weights):
+    # Unbiased estimate of E[values] under the model from paths sampled
+    # under the tilt, with its standard error and the effective sample size
+    values = np.asarray(values, dtype=np.float64)
+    w = np.exp(np.asarray(log_weights, dtype=np.float64))
+    x = w * values
+    n = len(x)
+    return {"estimate": x.mean(),
+            "std_error": x.std(ddof=1) / np.sqrt(n) if n > 1 else np.inf,
+            "ess": w.sum() ** 2 / (w ** 2).sum(),
+            "mean_weight": w.mean(),
+            "hits": int((values != 0).sum()),
+            "n": n}
+
+
+def hat_trick(inn):
+    # Three wickets credited to the same bowler on consecutive deliveries
+    # of that bowler. Wides and no balls that take no wicket leave the
+    # streak as it is.
+    groups = code_groups()
+    wickets = set(groups["bowler_wicket"])
+    legal = set(groups["legal"])
+    states, codes = ball_states(inn)
+    streak = {}
+    for state, code in zip(states, codes):
+        bowler = state["bowler"]
+        if code in wickets:
+            streak[bowler] = streak.get(bowler, 0) + 1
+        elif code in legal:
+            streak[bowler] = 0
+        if streak.get(bowler) == 3:
+            return True
+    return False
+
+
+EVENTS = {
+    "total_240": lambda inn: inn.Runs >= 240,
+    "chase_won": lambda inn: inn.Runs >= inn.Target,
+    "hat_trick": hat_trick,
+}
+
+
+def rare_event_probability(fixture, model, innings=1, event="total_240",
+                           tilt=None, n_sims=2000, seed=0, profiler=None):
+    # fixture: (Batting, Bowling, toss team, venue, target) as in
+    # Utils.equivalence, e.g. a target of 221 for a successful 220 chase.
+    # tilt=None samples from the model itself, which gives the plain Monte
+    # Carlo estimate for comparison.
+    if not callable(event):
+        event = EVENTS[event]
+    innings_list = [new_innings(fixture, innings) for _ in range(n_sims)]
+    if tilt is None:
+        tilt = np.ones(57)
+    simulate_innings_batch(innings_list, model, profiler,
+                           TiltedSampler(tilt, seed))
+    return importance_estimate([float(event(inn)) for inn in innings_list],
+                               [inn.Log_Weight for inn in innings_list])
+
+
+def choose_tilt(fixture, model, innings=1, event="total_240", candidates=None,
+                n_pilot=500, seed=0):
+    # Short pilot runs over candidate tilts; keeps the one with the lowest
+    # relative standard error. Too strong a tilt makes a few paths carry all
+    # of the weight, which shows up as a small effective sample size.
+    if candidates is None:
+        candidates = [tilt_vector(boundary=b, wicket=w)
+                      for b, w in [(1.3, 0.8), (1.6, 0.7), (2.0, 0.6),
+                                   (2.5, 0.5)]]
+    best = None
+    for tilt in candidates:
+        report = rare_event_probability(fixture, model, innings, event, tilt,
+                                        n_pilot, seed)
+        if not report["hits"]:
+            continue
+        error = report["std_error"] / report["estimate"]
+        if best is None or error < best[0]:
+            best = [error, tilt, report]
+    assert best is not None, "No candidate tilt reached the event"
+    return best[1], best[2]
@@ -0,0 +1,171 @@
+import numpy as np
+
+# Precision the kernels of a mode are saved in
+STORED_DTYPES = {"float32": np.float32, "float16": np.float16,
+                 "int8": np.int8}
+
+
+def activate(x, activation):
+    if activation == "linear":
+        return x
+    if activation == "relu":
+        return np.maximum(x, 0)
+    if activation == "tanh":
+        return np.tanh(x)
+    if activation == "sigmoid":
+        return 1 / (1 + np.exp(-x))
+    if activation == "softmax":
+        x = np.exp(x - x.max(axis=-1, keepdims=True))
+        return x / x.sum(axis=-1, keepdims=True)
+    assert False, f"Unsupported activation '{activation}'"
+
+
+class NumpyModel():
+    # Dense-only inference without TensorFlow. It mirrors the part of the
+    # keras API used by the simulator (predict and reset_states) so it can be
+    # passed wherever Innings, Match or EvaluationMetrics expect a model.
+    #
+    # Each layer is a dict with the kernel "W", bias "b" and "activation".
+    # Quantized layers additionally carry "w_scale" (one scale per output
+    # unit, W holding the int8 values) and, when their inputs are quantized
+    # as well, "a_scale".
+    def __init__(self, layers, mode="float32"):
+        # Kernels are held in float32 only, whatever the mode: NumPy has no
+        # int8 or float16 BLAS path, so a reduced precision model computes
+        # (and takes memory) like a float32 one and only its saved file is
+        # smaller, see file_bytes. int8 and float16 values convert to
+        # float32 exactly, and save writes them back in their own precision.
+        # With |x|, |w| <= 127 the float32 sums of an int8 layer are exact
+        # while they stay below 2^24, i.e. for up to 1040 inputs, which
+        # covers every hidden layer of the simulator. float32 kernels are
+        # used as they are, so that weights mapped from
+        # Utils.shared_weights are not copied into every process.
+        self.layers = []
+        for layer in layers:
+            layer = dict(layer)
+            layer["W"] = layer["W"].astype(np.float32, copy=False)
+            self.layers.append(layer)
+        self.mode = mode
+        self.kernels = [layer["W"] for layer in self.layers]
+
+    @classmethod
+    def from_keras(cls, model):
+        layers = []
+        for layer in model.layers:
+            name = layer.__class__.__name__
+            if name in ("Dropout", "InputLayer"):
+                continue
+            assert name == "Dense", f"Unsupported layer '{name}'"
+            W, b = layer.get_weights()
+            layers.append({"W": W.astype(np.float32),
+                           "b": b.astype(np.float32),
+                           "activation": layer.get_config()["activation"]})
+        return cls(layers)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            mode = str(data["mode"])
+            layers = []
+            for i in range(int(data["n_layers"])):
+                layer = {"W": data[f"W_{i}"], "b": data[f"b_{i}"],
+                         "activation": str(data[f"activation_{i}"])}
+                for key in ("w_scale", "a_scale"):
+                    if f"{key}_{i}" in data:
+                        layer[key] = data[f"{key}_{i}"]
+                layers.append(layer)
+        return cls(layers, mode)
+
+    def save(self, path):
+        arrays = {"mode": np.array(self.mode),
+                  "n_layers": np.array(len(self.layers))}
+        for i, layer in enumerate(self.layers):
+            arrays[f"W_{i}"] = self.stored_kernel(layer)
+            for key in ("b", "activation", "w_scale", "a_scale"):
+                if key in layer:
+                    arrays[f"{key}_{i}"] = np.asarray(layer[key])
+        np.savez(path, **arrays)
+
+    def reset_states(self):
+        pass
+
+    def forward(self, x, capture=None):
+        x = np.asarray(x, dtype=np.float32)
+        for layer, W in zip(self.layers, self.kernels):
+            if capture is not None:
+                capture.append(x)
+            if "a_scale" in layer:
+                x = np.clip(np.rint(x / layer["a_scale"]), -127, 127)
+                x = (x @ W) * (layer["a_scale"] * layer["w_scale"])
+            elif "w_scale" in layer:
+                x = (x @ W) * layer["w_scale"]
+            else:
+                x = x @ W
+            x = activate(x + layer["b"], layer["activation"])
+        return x
+
+    def predict(self, x, verbose=0, batch_size=None):
+        return self.forward(x)
+
+    def num_params(self):
+        return sum(layer["W"].size + layer["b"].size for layer in self.layers)
+
+    def stored_kernel(self, layer):
+        # Kernels of int8 models are int8 only in the layers with a w_scale
+        if self.mode == "int8" and "w_scale" not in layer:
+            return layer["W"]
+        return layer["W"].astype(STORED_DTYPES[self.mode])
+
+    def nbytes(self):
+        # Weights held in memory while predicting
+        return sum(layer[key].nbytes for layer in self.layers
+                   for key in ("W", "b", "w_scale", "a_scale")
+                   if key in layer)
+
+    def file_bytes(self):
+        # Weights as saved, with the kernels in the precision of the mode
+        return self.nbytes() + sum(
+            self.stored_kernel(layer).nbytes - layer["W"].nbytes
+            for layer in self.layers)
+
+
+def to_float16(model):
+    # float16 weights, float32 accumulation
+    layers = []
+    for layer in model.layers:
+        layers.append({"W": layer["W"].astype(np.float16),
+                       "b": layer["b"].astype(np.float32),
+                       "activation": layer["activation"]})
+    return NumpyModel(layers, "float16")
+
+
+def calibrate_activations(model, rows, percentile=99.99):
+    captured = []
+    model.forward(rows, capture=captured)
+    scales = []
+    for x in captured:
+        bound = np.percentile(np.abs(x), percentile)
+        scales.append(np.float32(max(bound, 1e-8) / 127))
+    return scales
+
+
+def to_int8(model, calibration_rows, percentile=99.99):
+    # Symmetric per output unit int8 weights. The inputs of the first layer
+    # mix one-hot columns with raw counts such as Current_Score, so a single
+    # int8 scale cannot represent both and that layer is quantized on the
+    # weights only. Inputs of every later layer are quantized with a static
+    # scale calibrated on held-out rows.
+    a_scales = calibrate_activations(model, calibration_rows, percentile)
+    layers = []
+    for i, layer in enumerate(model.layers):
+        W = layer["W"]
+        w_scale = np.abs(W).max(axis=0) / 127
+        w_scale = np.where(w_scale == 0, 1, w_scale).astype(np.float32)
+        quant = {"W": np.clip(np.rint(W / w_scale), -127, 127).astype(np.int8),
+                 "b": layer["b"].astype(np.float32),
+                 "activation": layer["activation"],
+                 "w_scale": w_scale}
+        if i > 0:
+            quant["a_scale"] = a_scales[i]
+        layers.append(quant)
+    return NumpyModel(layers, "int8")
@@ -0,0 +1,291 @@
+import json
+import os
+import pickle
+import time
+import numpy as np
+import pandas as pd
+from Utils.aggregates import AggregateIndex
+from Utils.helper import NUMERIC_COLS
+
+ONEHOT_COLS = [["Toss", "teams"], ["Venue", "venue"],
+               ["Batting_Team", "teams"], ["Bowling_Team", "teams"],
+               ["Striker", "players"], ["Non_Striker", "players"],
+               ["Bowler", "players"]]
+VOCABULARIES = {"players": ["Striker", "Non_Striker", "Bowler"],
+                "teams": ["Batting_Team", "Bowling_Team", "Toss"],
+                "venue": ["Venue"]}
+VOCAB_FILES = {"players": "Players.pkl", "teams": "Teams.pkl",
+               "venue": "Venue.pkl"}
+INNINGS_FILES = {1: ["Batting_First.csv", "BF_Cols.pkl"],
+                 2: ["Chasing.csv", "BS_Cols.pkl"]}
+
+
+def extend_vocabulary(vocab, values):
+    # New names go after the existing ones so that no index moves
+    known = set(vocab)
+    return list(vocab) + sorted(set(values) - known)
+
+
+def extend_columns(cols, vocabularies):
+    # One hot columns for new names are appended at the end of the layout,
+    # so the columns the models were trained on keep their positions
+    known = set(cols)
+    new = [col + "_" + name for col, vocab in ONEHOT_COLS
+           for name in vocabularies[vocab] if col + "_" + name not in known]
+    return list(cols) + new
+
+
+def numeric_cols(innings):
+    return NUMERIC_COLS + (["Required_Runs"] if innings == 2 else [])
+
+
+def encode_rows(df, cols, innings):
+    # Sparse form of get_onehot(df, cols): the numeric values and the index
+    # of the seven active one hot columns of every row
+    col_index = {col: i for i, col in enumerate(cols)}
+    df = df.reset_index(drop=True)
+    if innings == 2 and "Required_Runs" not in df.columns:
+        df = df.assign(Required_Runs=df["Target"] - df["Current_Score"])
+    numeric = df[numeric_cols(innings)].values.astype(np.float32)
+    onehot = np.empty((df.shape[0], len(ONEHOT_COLS)), dtype=np.int32)
+    for j, (col, _) in enumerate(ONEHOT_COLS):
+        ids = (col + "_" + df[col].astype(str)).map(col_index)
+        assert not ids.isna().any(), \
+            f"Unknown {col} values: {sorted(set(df[col][ids.isna()]))}"
+        onehot[:, j] = ids.values
+    return {"numeric": numeric,
+            "numeric_ids": np.array([col_index[col] for col in
+                                     numeric_cols(innings)], dtype=np.int32),
+            "onehot": onehot,
+            "y": df["Result"].values.astype(np.int8)}
+
+
+def dense_rows(chunk, width):
+    # Chunks encoded before the vocabulary grew are padded with zeros for
+    # the columns appended since
+    n = chunk["onehot"].shape[0]
+    x = np.zeros((n, width), dtype=np.float32)
+    x[:, chunk["numeric_ids"]] = chunk["numeric"]
+    x[np.arange(n)[:, np.newaxis], chunk["onehot"]] = 1
+    return x
+
+
+class SeasonIngestor():
+    # Appends new seasons to the ball by ball data and brings everything
+    # derived from it up to date by processing the new rows only: the
+    # vocabularies, BF_Cols/BS_Cols, a cache of encoded rows, the aggregate
+    # index and the ActualStats of the evaluation. build_cache() makes the
+    # one full pass over the existing data. Extended layouts take effect in
+    # Utils.helper (BF_Cols, BS_Cols) from the next import.
+    def __init__(self, data_dir="Data", cache_dir=None,
+                 git_data_dir="GitData"):
+        self.data_dir = data_dir
+        # BF_Cols/BS_Cols are also written here, where Innings reads them
+        self.git_data_dir = git_data_dir
+        self.cache_dir = cache_dir or os.path.join(data_dir, "Encoded")
+        self.manifest_path = os.path.join(self.cache_dir, "manifest.json")
+        self.index_path = os.path.join(self.cache_dir, "aggregates.pkl")
+        self.stats_path = os.path.join(self.cache_dir, "actual.pkl")
+        self.manifest = {"seasons": [], "chunks": []}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as fp:
+                self.manifest = json.load(fp)
+
+    def path(self, name):
+        return os.path.join(self.data_dir, name)
+
+    def load_pickle(self, name):
+        with open(self.path(name), "rb") as fp:
+            return pickle.load(fp)
+
+    def dump_pickle(self, name, value):
+        with open(self.path(name), "wb") as fp:
+            pickle.dump(value, fp)
+
+    def vocabularies(self):
+        return {vocab: self.load_pickle(name)
+                for vocab, name in VOCAB_FILES.items()}
+
+    def columns(self, innings):
+        return self.load_pickle(INNINGS_FILES[innings][1])
+
+    def save_manifest(self):
+        with open(self.manifest_path, "w") as fp:
+            json.dump(self.manifest, fp, indent=1)
+
+    def add_chunk(self, season, innings, df, cols, tmp=False):
+        chunk = encode_rows(df, cols, innings)
+        name = f"{season}-inn{innings}.npz"
+        path = os.path.join(self.cache_dir, name)
+        with open(path + ".tmp" if tmp else path, "wb") as fp:
+            np.savez(fp, **chunk)
+        self.manifest["chunks"].append({"season": season, "innings": innings,
+                                        "file": name, "rows": df.shape[0],
+                                        "width": len(cols)})
+        return path
+
+    def build_cache(self, season="base"):
+        from Utils.evaluation import ActualStats
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.manifest = {"seasons": [], "chunks": []}
+        dfs = {innings: pd.read_csv(self.path(files[0]))
+               for innings, files in INNINGS_FILES.items()}
+        for innings, df in dfs.items():
+            self.add_chunk(season, innings, df, self.columns(innings))
+        index = AggregateIndex()
+        index.update(dfs[1], 1, season)
+        index.update(dfs[2], 2)
+        index.save_object(self.index_path)
+        stats = ActualStats(BF_df=dfs[1], BS_df=dfs[2])
+        self.run_stats(stats)
+        stats.save_object(self.stats_path)
+        self.manifest["seasons"].append(season)
+        self.save_manifest()
+
+    def run_stats(self, stats):
+        # run_df only stores a match when the next one starts, so the last
+        # first innings total and the last chase are flushed here to make
+        # the stats of consecutive seasons add up
+        stats.run_df(1)
+        if stats.curr_score is not None:
+            stats.total_stat.append(stats.curr_score)
+        stats.run_df(2)
+        stats.new_match(2)
+
+    def ingest(self, bf_new, bs_new, season, update_stats=True):
+        # bf_new, bs_new: the ball by ball rows of the new season in the
+        # layout of Batting_First.csv and Chasing.csv. Every file is first
+        # written under a temporary name; the rows are then appended to the
+        # csvs, the files renamed into place and the season recorded in the
+        # manifest last. A failure before the manifest truncates the csvs
+        # back, so the season can be ingested again without duplicate rows.
+        from Utils.evaluation import ActualStats
+        assert os.path.exists(self.manifest_path), \
+            "Run build_cache() once before ingesting seasons"
+        assert season not in self.manifest["seasons"], \
+            f"{season} has already been ingested"
+        start = time.perf_counter()
+        dfs = {1: bf_new.reset_index(drop=True),
+               2: bs_new.reset_index(drop=True)}
+        for innings, df in dfs.items():
+            header = pd.read_csv(self.path(INNINGS_FILES[innings][0]),
+                                 nrows=0).columns
+            assert list(df.columns) == list(header), \
+                f"Columns of innings {innings} do not match the csv"
+
+        vocabularies = self.vocabularies()
+        report = {"season": season, "rows": {}, "new_names": {},
+                  "width_before": {}, "width_after": {}, "new_columns": {},
+                  "layout_files": []}
+        # [final path, temporary path] of every file to put in place
+        staged = []
+        manifest = {"seasons": list(self.manifest["seasons"]),
+                    "chunks": list(self.manifest["chunks"])}
+        try:
+            for vocab, cols in VOCABULARIES.items():
+                values = set()
+                for df in dfs.values():
+                    for col in cols:
+                        values.update(df[col].astype(str))
+                extended = extend_vocabulary(vocabularies[vocab], values)
+                report["new_names"][vocab] = \
+                    extended[len(vocabularies[vocab]):]
+                if report["new_names"][vocab]:
+                    vocabularies[vocab] = extended
+                    staged.append(self.stage_pickle(
+                        self.path(VOCAB_FILES[vocab]), extended))
+
+            for innings, (csv_name, cols_name) in INNINGS_FILES.items():
+                cols = self.columns(innings)
+                extended = extend_columns(cols, vocabularies)
+                # Innings reads its layout from git_data_dir; both copies
+                # are written whenever they differ from the extended one
+                for directory in [self.data_dir, self.git_data_dir]:
+                    path = os.path.join(directory, cols_name)
+                    if not os.path.isdir(directory):
+                        continue
+                    current = None
+                    if os.path.exists(path):
+                        with open(path, "rb") as fp:
+                            current = pickle.load(fp)
+                    if current != extended:
+                        staged.append(self.stage_pickle(path, extended))
+                        report["layout_files"].append(path)
+                report["rows"][innings] = dfs[innings].shape[0]
+                report["width_before"][innings] = len(cols)
+                report["width_after"][innings] = len(extended)
+                report["new_columns"][innings] = extended[len(cols):]
+                path = self.add_chunk(season, innings, dfs[innings], extended,
+                                      tmp=True)
+                staged.append([path, path + ".tmp"])
+
+            index = AggregateIndex(self.index_path)
+            index.update(dfs[1], 1, season)
+            index.update(dfs[2], 2)
+            index.save_object(self.index_path + ".tmp")
+            staged.append([self.index_path, self.index_path + ".tmp"])
+            if update_stats:
+                stats = ActualStats(self.stats_path, BF_df=dfs[1],
+                                    BS_df=dfs[2])
+                delta = ActualStats(BF_df=dfs[1], BS_df=dfs[2])
+                self.run_stats(delta)
+                stats.merge(delta)
+                stats.save_object(self.stats_path + ".tmp")
+                staged.append([self.stats_path, self.stats_path + ".tmp"])
+        except BaseException:
+            self.manifest = manifest
+            for _, tmp in staged:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+            raise
+
+        sizes = {name: os.path.getsize(self.path(name))
+                 for name, _ in INNINGS_FILES.values()}
+        try:
+            for innings, (csv_name, _) in INNINGS_FILES.items():
+                dfs[innings].to_csv(self.path(csv_name), mode="a",
+                                    header=False, index=False)
+            for path, tmp in staged:
+                os.replace(tmp, path)
+            self.manifest["seasons"].append(season)
+            self.save_manifest()
+        except BaseException:
+            for name, size in sizes.items():
+                with open(self.path(name), "r+b") as fp:
+                    fp.truncate(size)
+            self.manifest = manifest
+            for _, tmp in staged:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+            raise
+        report["seconds"] = time.perf_counter() - start
+        return report
+
+    def stage_pickle(self, path, value):
+        with open(path + ".tmp", "wb") as fp:
+            pickle.dump(value, fp)
+        return [path, path + ".tmp"]
+
+    def training_arrays(self, innings, seasons=None):
+        # Model inputs and labels of the cached rows in the current layout,
+        # the same as get_onehot over the whole csv reindexed to the columns
+        width = len(self.columns(innings))
+        xs = []
+        ys = []
+        for chunk in self.manifest["chunks"]:
+            if chunk["innings"] != innings:
+                continue
+            if seasons is not None and chunk["season"] not in seasons:
+                continue
+            data = np.load(os.path.join(self.cache_dir, chunk["file"]))
+            xs.append(dense_rows(data, width))
+            ys.append(data["y"])
+        return np.concatenate(xs), np.concatenate(ys)
+
+    def width_report(self):
+        rows = []
+        for chunk in self.manifest["chunks"]:
+            rows.append([chunk["season"], chunk["innings"], chunk["rows"],
+                         chunk["width"]])
+        return pd.DataFrame(rows, columns=["Season", "Innings", "Rows",
+                                           "Model Input Width"])
@@ -0,0 +1,383 @@
+import numpy as np
+from Utils.equivalence import new_innings
+from Utils.profiling import NULL_PROFILER
+from Utils.replay import SWAP_CODES
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+DISMISSALS = [None, "Retired Hurt", "Bowled", "Caught", "LBW", "Stumped",
+              "Hit Wicket", "Obstructing the Field", "Run Out"]
+# Effect of every result code in Innings.ball_prediction, one row per code.
+# out: 1 striker, 2 non-striker. credit: dismissal by and wicket to the
+# bowler. cross: batsmen swap on odd runs. draw: 1 even swap draw, 2 the
+# (0.3, 0.7) draw after a catch. free_hit: 0 clear, 1 set, 2 keep.
+# legal: moves on to the next ball (get_next_ball).
+CODE_FIELDS = ["runs", "extras", "out", "dismissal", "credit",
+               "striker_runs", "striker_balls", "fours", "sixes",
+               "bowler_runs", "bowler_balls", "cross", "draw", "free_hit",
+               "legal"]
+(C_RUNS, C_EXTRAS, C_OUT, C_DISMISSAL, C_CREDIT, C_STRIKER_RUNS,
+ C_STRIKER_BALLS, C_FOURS, C_SIXES, C_BOWLER_RUNS, C_BOWLER_BALLS, C_CROSS,
+ C_DRAW, C_FREE_HIT, C_LEGAL) = range(len(CODE_FIELDS))
+# Columns of the innings, batsman and bowler state arrays
+(I_RUNS, I_WICKETS, I_OVERS, I_BALLS, I_FREE_HIT, I_EXTRAS, I_STRIKER,
+ I_NON_STRIKER, I_BOWLER, I_OVERS_DONE) = range(10)
+(B_RUNS, B_BALLS, B_FOURS, B_SIXES, B_ENTERED, B_DISMISSAL, B_BY,
+ B_FALL_OVER, B_FALL_RUNS) = range(9)
+(W_RUNS, W_BALLS, W_OVERS, W_WICKETS) = range(4)
+
+
+def code_row(runs=0, extras=0, out=0, dismissal=None, credit=0,
+             striker_runs=0, striker_balls=1, fours=0, sixes=0,
+             bowler_runs=0, bowler_balls=1, cross=0, draw=0, free_hit=0,
+             legal=1):
+    return [runs, extras, out, DISMISSALS.index(dismissal), credit,
+            striker_runs, striker_balls, fours, sixes, bowler_runs,
+            bowler_balls, cross, draw, free_hit, legal]
+
+
+def code_table():
+    rows = [code_row(out=1, dismissal="Retired Hurt", striker_balls=0)]
+    for res in range(1, 8):
+        rows.append(code_row(res-1, striker_runs=res-1, bowler_runs=res-1,
+                             fours=int(res == 5), sixes=int(res == 7),
+                             cross=int(res % 2 == 0)))
+    for res, name in zip(range(8, 14), DISMISSALS[2:8]):
+        rows.append(code_row(out=1, dismissal=name, credit=int(res != 13),
+                             draw=2 if res in (9, 13) else 0))
+    for res in range(14, 22):
+        r = (res-14) // 2
+        rows.append(code_row(r, out=2 - res % 2, dismissal="Run Out",
+                             striker_runs=r, bowler_runs=r, draw=1))
+    for res in range(22, 24):
+        rows.append(code_row(2, 1, 2 - res % 2, "Run Out", striker_runs=1,
+                             bowler_runs=2, bowler_balls=0, draw=1,
+                             free_hit=1, legal=0))
+    for res in range(24, 30):
+        r = (res-22) // 2
+        rows.append(code_row(r, r, 2 - res % 2, "Run Out", draw=1))
+    for res in range(30, 34):
+        r = 1 if res < 32 else 2
+        rows.append(code_row(r, r, 2 - res % 2, "Run Out", striker_balls=0,
+                             bowler_runs=r, bowler_balls=0, draw=1,
+                             free_hit=2, legal=0))
+    rows.append(code_row(1, out=1, dismissal="Stumped", credit=1,
+                         striker_balls=0, bowler_runs=1, bowler_balls=0,
+                         free_hit=2, legal=0))
+    rows.append(code_row(1, out=1, dismissal="Stumped", credit=1,
+                         bowler_runs=1, bowler_balls=0, free_hit=1,
+                         legal=0))
+    for res in range(36, 40):
+        rows.append(code_row(res-35, res-35, cross=(res-35) % 2))
+    for res in range(40, 46):
+        rows.append(code_row(res-39, 1, striker_runs=res-40,
+                             fours=int(res == 44), sixes=int(res == 45),
+                             bowler_runs=res-39, bowler_balls=0,
+                             cross=(res-40) % 2, free_hit=1, legal=0))
+    for res in range(46, 50):
+        rows.append(code_row(res-44, res-44, bowler_runs=1, bowler_balls=0,
+                             cross=(res-45) % 2, free_hit=1, legal=0))
+    for res in range(50, 55):
+        rows.append(code_row(res-49, res-49, striker_balls=0,
+                             bowler_runs=res-49, bowler_balls=0,
+                             cross=(res-50) % 2, free_hit=2, legal=0))
+    # 55 is the non-striker and 56 the striker, unlike the codes above
+    for res in range(55, 57):
+        rows.append(code_row(1, 1, 1 + res % 2, "Run Out", bowler_runs=1,
+                             bowler_balls=0, draw=1, free_hit=1, legal=0))
+    return np.array(rows, dtype=np.int64)
+
+
+CODE_TABLE = code_table()
+
+
+def apply_codes(rows, codes, draws, table, inn, bat, bowl, bowl_wickets,
+                plan, summary):
+    # ball_prediction on arrays for the innings in rows, with the swap draws
+    # already taken. Loops only over scalars so that numba can compile it.
+    for k in range(len(rows)):
+        i = rows[k]
+        t = table[codes[k]]
+        if t[C_FREE_HIT] != 2:
+            inn[i, I_FREE_HIT] = t[C_FREE_HIT]
+        inn[i, I_RUNS] += t[C_RUNS]
+        inn[i, I_EXTRAS] += t[C_EXTRAS]
+        s = inn[i, I_STRIKER]
+        b = inn[i, I_BOWLER]
+        bat[i, s, B_RUNS] += t[C_STRIKER_RUNS]
+        bat[i, s, B_BALLS] += t[C_STRIKER_BALLS]
+        bat[i, s, B_FOURS] += t[C_FOURS]
+        bat[i, s, B_SIXES] += t[C_SIXES]
+        bowl[i, b, W_RUNS] += t[C_BOWLER_RUNS]
+        if t[C_BOWLER_BALLS] == 1 and bowl[i, b, W_BALLS] == 5:
+            bowl[i, b, W_BALLS] = 0
+            bowl[i, b, W_OVERS] += 1
+        else:
+            bowl[i, b, W_BALLS] += t[C_BOWLER_BALLS]
+        if t[C_OUT] > 0:
+            inn[i, I_WICKETS] += 1
+            col = I_STRIKER if t[C_OUT] == 1 else I_NON_STRIKER
+            out = inn[i, col]
+            bat[i, out, B_DISMISSAL] = t[C_DISMISSAL]
+            bat[i, out, B_BY] = b if t[C_CREDIT] == 1 else -1
+            bat[i, out, B_FALL_OVER] = inn[i, I_OVERS]
+            bat[i, out, B_FALL_RUNS] = inn[i, I_RUNS]
+            if t[C_CREDIT] == 1:
+                bowl_wickets[i, b, bowl[i, b, W_WICKETS]] = out
+                bowl[i, b, W_WICKETS] += 1
+            if inn[i, I_WICKETS] < 10:
+                inn[i, col] = inn[i, I_WICKETS] + 1
+                bat[i, inn[i, col], B_ENTERED] = 1
+            else:
+                inn[i, col] = -1
+        if t[C_CROSS] == 1 or (t[C_DRAW] > 0 and draws[k] == 1):
+            s = inn[i, I_STRIKER]
+            inn[i, I_STRIKER] = inn[i, I_NON_STRIKER]
+            inn[i, I_NON_STRIKER] = s
+        if t[C_LEGAL] == 1:
+            if inn[i, I_BALLS] == 6:
+                s = inn[i, I_STRIKER]
+                inn[i, I_STRIKER] = inn[i, I_NON_STRIKER]
+                inn[i, I_NON_STRIKER] = s
+                inn[i, I_OVERS] += 1
+                inn[i, I_BALLS] = 1
+                o = inn[i, I_OVERS_DONE]
+                summary[i, o, 0] = inn[i, I_RUNS]
+                summary[i, o, 1] = inn[i, I_WICKETS]
+                if o > 0:
+                    summary[i, o, 0] -= summary[i, o - 1, 2]
+                    summary[i, o, 1] -= summary[i, o - 1, 3]
+                summary[i, o, 2] = inn[i, I_RUNS]
+                summary[i, o, 3] = inn[i, I_WICKETS]
+                summary[i, o, 4] = b
+                inn[i, I_OVERS_DONE] = o + 1
+                inn[i, I_BOWLER] = plan[i, inn[i, I_OVERS] - 1]
+            else:
+                inn[i, I_BALLS] += 1
+
+
+apply_codes_jit = njit(cache=True)(apply_codes) if njit else apply_codes
+
+
+class KernelBatch():
+    # Array-backed copy of the state of a list of Innings of the same
+    # innings number, advanced by apply_codes. The Innings objects are only
+    # read at the start and written back by sync().
+    def __init__(self, innings_list, jit=True):
+        assert len({inn.innings for inn in innings_list}) <= 1, \
+            "A kernel batch holds innings of one kind only"
+        self.innings_list = innings_list
+        self.apply_codes = apply_codes_jit if jit else apply_codes
+        n = len(innings_list)
+        n_bat = max([len(inn.Batting_lineup) for inn in innings_list] + [2])
+        self.bowlers = [list(dict.fromkeys(inn.Bowling_lineup))
+                        for inn in innings_list]
+        n_bowl = max([len(x) for x in self.bowlers] + [1])
+        self.inn = np.zeros((n, 10), dtype=np.int64)
+        self.bat = np.zeros((n, n_bat, 9), dtype=np.int64)
+        self.bowl = np.zeros((n, n_bowl, 4), dtype=np.int64)
+        self.bowl_wickets = np.zeros((n, n_bowl, n_bat), dtype=np.int64)
+        self.plan = np.zeros((n, 21), dtype=np.int64)
+        self.summary = np.zeros((n, 21, 5), dtype=np.int64)
+        self.target = np.array([inn.Target for inn in innings_list],
+                               dtype=np.int64)
+        self.chase = bool(n) and innings_list[0].innings == 2
+        for i, inn in enumerate(innings_list):
+            self.load(i, inn)
+        if n:
+            first = innings_list[0]
+            self.numeric_cols = first.Numeric_Cols
+            self.required_runs_col = first.Required_Runs_Col
+            self.static = np.array([inn.Static_Row for inn in innings_list])
+            self.striker_cols = np.array([[x.Striker_Col for x in
+                                           inn.Batting_lineup]
+                                          for inn in innings_list])
+            self.non_striker_cols = np.array([[x.Non_Striker_Col for x in
+                                               inn.Batting_lineup]
+                                              for inn in innings_list])
+            self.bowler_cols = np.zeros((n, n_bowl), dtype=np.int64)
+            for i, bowlers in enumerate(self.bowlers):
+                self.bowler_cols[i, :len(bowlers)] = [x.Bowler_Col
+                                                      for x in bowlers]
+
+    def load(self, i, inn):
+        assert getattr(inn, "Next_Bowler", None) is None, \
+            "The kernel follows the Bowling plan only"
+        slot = {id(x): k for k, x in enumerate(inn.Batting_lineup)}
+        bowler_id = {id(x): k for k, x in enumerate(self.bowlers[i])}
+        self.inn[i] = [inn.Runs, inn.Wickets, inn.Overs, inn.Balls,
+                       inn.Free_Hit, inn.Extras,
+                       slot.get(id(inn.Striker), -1),
+                       slot.get(id(inn.Non_Striker), -1),
+                       bowler_id[id(inn.Bowler)], len(inn.Overs_Summary)]
+        for k, x in enumerate(inn.Batting_lineup):
+            by = [b.Name for b in self.bowlers[i]].index(x.Dismissal_By) \
+                if x.Dismissal_By is not None else -1
+            self.bat[i, k] = [x.Runs, x.Balls, x.Fours_Hit, x.Sixes_Hit,
+                              x.Entered_Match, DISMISSALS.index(x.Dismissal),
+                              by, -1 if x.Fall_Over is None else x.Fall_Over,
+                              -1 if x.Fall_Runs is None else x.Fall_Runs]
+        for k, x in enumerate(self.bowlers[i]):
+            self.bowl[i, k] = [x.Runs_Conceded, x.Balls_Bowled,
+                               x.Overs_Bowled, len(x.Wickets_Taken)]
+            self.bowl_wickets[i, k, :len(x.Wickets_Taken)] = [
+                slot[id(w)] for w in x.Wickets_Taken]
+        lineup = inn.Bowling_lineup
+        self.plan[i] = [bowler_id[id(lineup[o % len(lineup)])]
+                        for o in range(21)]
+        for o, row in enumerate(inn.Overs_Summary):
+            self.summary[i, o] = row[:4] + [bowler_id[id(row[4])]]
+
+    def innings_over(self):
+        over = (self.inn[:, I_OVERS] > 20) | (self.inn[:, I_WICKETS] == 10)
+        if self.chase:
+            over |= self.inn[:, I_RUNS] >= self.target
+        return over
+
+    def model_inputs(self, rows):
+        # Innings.get_model_input for the innings in rows
+        state = self.inn[rows]
+        k = np.arange(len(rows))
+        bat = self.bat[rows]
+        bowl = self.bowl[rows, state[:, I_BOWLER]]
+        s, n = state[:, I_STRIKER], state[:, I_NON_STRIKER]
+        x = self.static[rows]
+        x[:, self.numeric_cols] = np.column_stack([
+            state[:, I_RUNS], state[:, I_WICKETS], state[:, I_OVERS],
+            state[:, I_BALLS], state[:, I_FREE_HIT], bat[k, s, B_RUNS],
+            bat[k, s, B_BALLS], bat[k, n, B_RUNS], bat[k, n, B_BALLS],
+            bowl[:, W_RUNS], bowl[:, W_OVERS], bowl[:, W_BALLS],
+            bowl[:, W_WICKETS]])
+        x[k, self.striker_cols[rows, s]] = 1
+        x[k, self.non_striker_cols[rows, n]] = 1
+        x[k, self.bowler_cols[rows, state[:, I_BOWLER]]] = 1
+        if self.required_runs_col is not None:
+            x[:, self.required_runs_col] = (self.target[rows]
+                                            - state[:, I_RUNS])
+        return x
+
+    def draw_swaps(self, rows, codes):
+        # The swap draws of ball_prediction, taken through Innings.swap_draw
+        # in the same order so that they are recorded, can be forced and use
+        # the random state exactly like the reference
+        draws = np.zeros(len(rows), dtype=np.int64)
+        for k, (i, code) in enumerate(zip(rows, codes)):
+            if code in SWAP_CODES:
+                weights = (0.3, 0.7) if code in (9, 13) else None
+                draws[k] = self.innings_list[i].swap_draw(weights)
+        return draws
+
+    def apply(self, rows, codes):
+        rows = np.asarray(rows, dtype=np.int64)
+        codes = np.asarray(codes, dtype=np.int64)
+        for i, code in zip(rows.tolist(), codes.tolist()):
+            self.innings_list[i].Results.append(code)
+        draws = self.draw_swaps(rows.tolist(), codes.tolist())
+        self.apply_codes(rows, codes, draws, CODE_TABLE, self.inn, self.bat,
+                         self.bowl, self.bowl_wickets, self.plan,
+                         self.summary)
+
+    def state(self, i):
+        # The layout of Utils.equivalence.innings_state
+        inn = self.innings_list[i]
+        runs, wickets, overs, balls, free_hit, extras, s, n, b, done = \
+            self.inn[i].tolist()
+        bowler = self.bowl[i, b].tolist()
+
+        def batsman(slot):
+            if slot < 0:
+                return [None, None, None]
+            return [inn.Batting_lineup[slot].Name,
+                    int(self.bat[i, slot, B_RUNS]),
+                    int(self.bat[i, slot, B_BALLS])]
+        striker, non_striker = batsman(s), batsman(n)
+        return {
+            "score": runs, "wickets": wickets, "overs": overs,
+            "balls": balls, "free_hit": free_hit, "extras": extras,
+            "striker": striker[0], "striker_runs": striker[1],
+            "striker_balls": striker[2], "non_striker": non_striker[0],
+            "non_striker_runs": non_striker[1],
+            "non_striker_balls": non_striker[2],
+            "bowler": self.bowlers[i][b].Name,
+            "bowler_runs": bowler[W_RUNS], "bowler_overs": bowler[W_OVERS],
+            "bowler_balls": bowler[W_BALLS],
+            "bowler_wickets": bowler[W_WICKETS],
+            "overs_completed": done,
+            "innings_over": bool(self.innings_over()[i]),
+        }
+
+    def sync(self, i=None):
+        # Writes the arrays back into the Innings objects
+        for i in range(len(self.innings_list)) if i is None else [i]:
+            inn = self.innings_list[i]
+            lineup = inn.Batting_lineup
+            bowlers = self.bowlers[i]
+            (inn.Runs, inn.Wickets, inn.Overs, inn.Balls, inn.Free_Hit,
+             inn.Extras, s, n, b, done) = self.inn[i].tolist()
+            inn.Striker = lineup[s] if s >= 0 else None
+            inn.Non_Striker = lineup[n] if n >= 0 else None
+            inn.Bowler = bowlers[b]
+            for x, row in zip(lineup, self.bat[i].tolist()):
+                (x.Runs, x.Balls, x.Fours_Hit, x.Sixes_Hit, x.Entered_Match,
+                 dismissal, by, fall_over, fall_runs) = row
+                x.Dismissal = DISMISSALS[dismissal]
+                x.Dismissal_By = bowlers[by].Name if by >= 0 else None
+                x.Fall_Over = fall_over if fall_over >= 0 else None
+                x.Fall_Runs = fall_runs if fall_over >= 0 else None
+            for k, x in enumerate(bowlers):
+                (x.Runs_Conceded, x.Balls_Bowled, x.Overs_Bowled,
+                 wickets) = self.bowl[i, k].tolist()
+                x.Wickets_Taken = [lineup[w] for w in
+                                   self.bowl_wickets[i, k, :wickets].tolist()]
+            inn.Overs_Summary = [row[:4] + [bowlers[row[4]]] for row in
+                                 self.summary[i, :done].tolist()]
+
+
+def simulate_innings_kernel(innings_list, model, profiler=None, jit=True):
+    # simulate_innings_batch with the innings state held in a KernelBatch.
+    # Outcomes are still sampled by Innings.sample_result and the swaps by
+    # Innings.swap_draw in the same order, so a run from the same random
+    # state gives exactly the innings of simulate_innings_batch.
+    if profiler is None:
+        profiler = NULL_PROFILER
+    profiler.begin("batch")
+    batch = KernelBatch(innings_list, jit)
+    live = np.nonzero(~batch.innings_over())[0]
+    while len(live):
+        with profiler.stage("encode"):
+            model_inp = batch.model_inputs(live)
+        with profiler.stage("predict"):
+            q = model.predict(model_inp, verbose=0)
+        with profiler.stage("sample"):
+            results = []
+            for i, free_hit, probs in zip(
+                    live.tolist(), batch.inn[live, I_FREE_HIT].tolist(), q):
+                inn = innings_list[i]
+                inn.Free_Hit = free_hit
+                results.append(inn.sample_result(probs))
+        with profiler.stage("update"):
+            batch.apply(live, results)
+        with profiler.stage("bookkeeping"):
+            profiler.count("balls", len(live))
+            profiler.count("model_calls")
+            profiler.count("model_rows", len(live))
+            live = live[~batch.innings_over()[live]]
+    with profiler.stage("bookkeeping"):
+        batch.sync()
+    profiler.end("batch", innings=len(innings_list))
+    return [inn.get_result() for inn in innings_list]
+
+
+def kernel_replayer(jit=True):
+    # Replay engine for Utils.equivalence.replay_suite
+    def replay(fixture, innings, codes):
+        batch = KernelBatch([new_innings(fixture, innings)], jit)
+        states = []
+        for code in codes:
+            batch.apply([0], [code])
+            states.append(batch.state(0))
+        return states
+    return replay
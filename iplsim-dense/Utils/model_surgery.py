@@ -0,0 +1,106 @@
+import numpy as np
+from Utils import helper
+from Utils.inference import NumpyModel
+
+# Longest prefixes first so that Non_Striker_ is not read as Striker_
+ONEHOT_PREFIXES = ["Batting_Team_", "Bowling_Team_", "Non_Striker_",
+                   "Striker_", "Bowler_", "Toss_", "Venue_"]
+# the numeric inputs of both innings models
+NUMERIC_COLS = helper.NUMERIC_COLS + ["Required_Runs"]
+
+
+def column_family(col):
+    if col in NUMERIC_COLS:
+        return None
+    for prefix in ONEHOT_PREFIXES:
+        if col.startswith(prefix):
+            return prefix
+    return None
+
+
+def column_mapping(old_cols, new_cols):
+    # Position of every new column in the old layout, -1 for new columns
+    old_index = {col: i for i, col in enumerate(old_cols)}
+    return np.array([old_index.get(col, -1) for col in new_cols])
+
+
+def remap_rows(W, old_cols, new_cols, init="mean", similar=None):
+    # W: first Dense kernel of shape (len(old_cols), units). Rows of existing
+    # columns move to their new positions. Rows of new columns are set from
+    # the mean row of the same role (e.g. every Striker_ column), from a
+    # similar existing name given in similar ({"Striker_New": "Striker_Old"})
+    # or to zeros.
+    assert W.shape[0] == len(old_cols), \
+        f"Kernel has {W.shape[0]} rows for {len(old_cols)} columns"
+    assert init in ("mean", "zeros"), "init should be 'mean' or 'zeros'"
+    similar = similar or {}
+    mapping = column_mapping(old_cols, new_cols)
+    family_mean = {}
+    for prefix in ONEHOT_PREFIXES:
+        rows = [i for i, col in enumerate(old_cols)
+                if column_family(col) == prefix]
+        if rows:
+            family_mean[prefix] = W[rows].mean(axis=0)
+    new_W = np.zeros((len(new_cols), W.shape[1]), dtype=W.dtype)
+    added = []
+    for i, col in enumerate(new_cols):
+        if mapping[i] >= 0:
+            new_W[i] = W[mapping[i]]
+            continue
+        added.append(col)
+        if col in similar:
+            new_W[i] = W[old_cols.index(similar[col])]
+        elif init == "mean" and column_family(col) in family_mean:
+            new_W[i] = family_mean[column_family(col)]
+    kept = set(new_cols)
+    moved = (mapping >= 0) & (mapping != np.arange(len(new_cols)))
+    return new_W, {"added": added,
+                   "dropped": [col for col in old_cols if col not in kept],
+                   "moved": int(moved.sum())}
+
+
+def expand_numpy_model(model, old_cols, new_cols, init="mean", similar=None):
+    assert model.mode == "float32", \
+        "Expand the float32 model and quantize it again afterwards"
+    layers = [dict(layer) for layer in model.layers]
+    layers[0]["W"], report = remap_rows(layers[0]["W"], old_cols, new_cols,
+                                        init, similar)
+    return NumpyModel(layers), report
+
+
+def expand_keras_model(model, old_cols, new_cols, init="mean", similar=None):
+    # Same architecture with an input of len(new_cols), every weight copied
+    # and the rows of the first Dense kernel remapped to the new layout
+    import tensorflow as tf
+    new_model = tf.keras.models.clone_model(
+        model, input_tensors=tf.keras.Input(shape=(len(new_cols),)))
+    weights = model.get_weights()
+    weights[0], report = remap_rows(weights[0], old_cols, new_cols, init,
+                                    similar)
+    new_model.set_weights(weights)
+    return new_model, report
+
+
+def expand_checkpoint(load_path, old_cols, new_cols, save_path, init="mean",
+                      similar=None):
+    # e.g. expand_checkpoint("Models/Inn1-HeavyDense-ep20to50/cp-0029.h5",
+    # old BF_Cols, new BF_Cols, "Models/Inn1-Expanded/cp-0000.h5")
+    import tensorflow as tf
+    model = tf.keras.models.load_model(load_path)
+    new_model, report = expand_keras_model(model, old_cols, new_cols, init,
+                                           similar)
+    new_model.save(save_path)
+    return new_model, report
+
+
+def fine_tune(model, x, y, epochs=5, learning_rate=0.00015,
+              validation_split=0.2, callbacks=None):
+    # Same loss and optimizer as Train.ipynb, for a few epochs from the
+    # expanded weights instead of a full retrain
+    import tensorflow as tf
+    model.compile(loss=tf.keras.losses.SparseCategoricalCrossentropy(),
+                  metrics=['accuracy'],
+                  optimizer=tf.keras.optimizers.Adam(
+                      learning_rate=learning_rate))
+    return model.fit(x, y, epochs=epochs, validation_split=validation_split,
+                     callbacks=callbacks)
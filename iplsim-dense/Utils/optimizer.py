@@ -0,0 +1,183 @@
+import pandas as pd
+import math
+import random
+from Utils.batch_simulation import (simulate_innings_batch,
+                                    simulate_matches_batch)
+from Utils.helper import Innings, BF_Cols
+
+
+def is_legal_bowling_plan(plan, max_overs=4):
+    # plan: the 20 bowler names of a *_Bowling list without the team name
+    for i in range(1, len(plan)):
+        if plan[i] == plan[i-1]:
+            return False
+    return all(plan.count(x) <= max_overs for x in set(plan))
+
+
+def random_bowling_plan(bowlers, overs=20, max_overs=4, tries=100):
+    bowlers = sorted(set(bowlers))
+    assert len(bowlers) * max_overs >= overs, \
+        "Not enough bowlers to cover all the overs"
+    for _ in range(tries):
+        quota = {x: max_overs for x in bowlers}
+        plan = []
+        for _ in range(overs):
+            options = [x for x in bowlers
+                       if quota[x] and (not plan or plan[-1] != x)]
+            if not options:
+                break
+            # Favouring bowlers with more overs left avoids dead ends
+            # towards the end of the innings
+            choice = random.choices(options,
+                                    weights=[quota[x] for x in options])[0]
+            quota[choice] -= 1
+            plan.append(choice)
+        if len(plan) == overs:
+            return plan
+    assert False, "Could not form a legal bowling plan"
+
+
+def random_batting_order(batsmen, fixed_openers=False):
+    batsmen = list(batsmen)
+    if fixed_openers:
+        rest = batsmen[2:]
+        random.shuffle(rest)
+        return batsmen[:2] + rest
+    random.shuffle(batsmen)
+    return batsmen
+
+
+class LineupOptimizer():
+    def __init__(self, model_inn1, model_inn2, squad, opponent, venue,
+                 toss_team=None, objective="runs", batting_first=True):
+        assert objective in ("runs", "win"), \
+            "objective should be 'runs' or 'win'"
+        self.models = [model_inn1, model_inn2]
+        self.squad = squad
+        self.opponent = opponent
+        self.venue = venue
+        self.toss_team = toss_team if toss_team is not None else squad[0][0]
+        self.objective = objective
+        self.batting_first = batting_first
+        self.history = []
+
+    def form_squad(self, batting_order=None, bowling_plan=None):
+        batting = self.squad[0]
+        bowling = self.squad[1]
+        if batting_order is not None:
+            batting = [batting[0]] + list(batting_order)
+        if bowling_plan is not None:
+            bowling = [bowling[0]] + list(bowling_plan)
+        return [batting, bowling]
+
+    def simulate_candidates(self, candidates, n_sims, search):
+        # All the simulations of all the candidates go through the same
+        # batch so every model call predicts one ball for every lineup
+        n = len(candidates)
+        if self.objective == "runs" and search == "batting":
+            inn1_df = pd.DataFrame(columns=BF_Cols)
+            innings = [Innings(squad[0], self.opponent[1], self.toss_team,
+                               self.venue, 1, inn1_df)
+                       for squad in candidates for _ in range(n_sims)]
+            simulate_innings_batch(innings, self.models[0])
+            values = [inn.Runs for inn in innings]
+        elif self.objective == "runs":
+            inn1_df = pd.DataFrame(columns=BF_Cols)
+            innings = [Innings(self.opponent[0], squad[1], self.toss_team,
+                               self.venue, 1, inn1_df)
+                       for squad in candidates for _ in range(n_sims)]
+            simulate_innings_batch(innings, self.models[0])
+            values = [-inn.Runs for inn in innings]
+        else:
+            if self.batting_first:
+                fixtures = [[squad, self.opponent, self.toss_team, self.venue]
+                            for squad in candidates for _ in range(n_sims)]
+            else:
+                fixtures = [[self.opponent, squad, self.toss_team, self.venue]
+                            for squad in candidates for _ in range(n_sims)]
+            values = []
+            for _, _, (_, num) in simulate_matches_batch(
+                    fixtures, self.models[0], self.models[1]):
+                if num == -1:
+                    values.append(0.5)
+                elif (num == 1) != self.batting_first:
+                    values.append(1)
+                else:
+                    values.append(0)
+        return [values[i*n_sims:(i+1)*n_sims] for i in range(n)]
+
+    def successive_halving(self, candidates, search, min_sims=8, eta=2,
+                           max_sims=None, verbose=False):
+        # Every round spends the same budget on the surviving candidates and
+        # keeps the best 1/eta of them, so promising lineups get most of the
+        # simulations
+        assert min_sims > 0, "min_sims should be positive"
+        assert max_sims is None or max_sims > 0, \
+            "max_sims should be positive"
+        totals = [0 for _ in candidates]
+        counts = [0 for _ in candidates]
+        alive = list(range(len(candidates)))
+        n_sims = min_sims
+        self.history = []
+        while True:
+            if max_sims is not None:
+                n_sims = min(n_sims, max_sims - max(counts[i] for i in alive))
+            # the budget is spent; the survivors were ranked last round
+            if n_sims <= 0:
+                break
+            values = self.simulate_candidates(
+                [candidates[i] for i in alive], n_sims, search)
+            for i, vals in zip(alive, values):
+                totals[i] += sum(vals)
+                counts[i] += len(vals)
+            alive.sort(key=lambda i: totals[i]/counts[i], reverse=True)
+            self.history.append([(i, totals[i]/counts[i], counts[i])
+                                 for i in alive])
+            if verbose:
+                best = alive[0]
+                print(f"{len(alive)} candidates, {counts[best]} simulations"
+                      f" each, best: {totals[best]/counts[best]:.3f}")
+            if len(alive) == 1:
+                break
+            alive = alive[:max(1, math.ceil(len(alive)/eta))]
+            n_sims *= eta
+        return [(candidates[i], totals[i]/counts[i], counts[i])
+                for i in alive]
+
+    def optimize_batting(self, n_candidates=64, min_sims=8, eta=2,
+                         fixed_openers=False, max_sims=None, verbose=False):
+        current = self.squad[0][1:]
+        orders = [list(current)]
+        seen = {tuple(current)}
+        for _ in range(20 * n_candidates):
+            if len(orders) >= n_candidates:
+                break
+            order = random_batting_order(current, fixed_openers)
+            if tuple(order) not in seen:
+                seen.add(tuple(order))
+                orders.append(order)
+        candidates = [self.form_squad(batting_order=x) for x in orders]
+        ranked = self.successive_halving(candidates, "batting", min_sims,
+                                         eta, max_sims, verbose)
+        return ranked[0]
+
+    def optimize_bowling(self, n_candidates=64, min_sims=8, eta=2,
+                         bowlers=None, max_sims=None, verbose=False):
+        current = self.squad[1][1:]
+        if bowlers is None:
+            bowlers = set(current)
+        plans = []
+        if is_legal_bowling_plan(current):
+            plans.append(list(current))
+        seen = {tuple(x) for x in plans}
+        for _ in range(20 * n_candidates):
+            if len(plans) >= n_candidates:
+                break
+            plan = random_bowling_plan(bowlers, len(current))
+            if tuple(plan) not in seen:
+                seen.add(tuple(plan))
+                plans.append(plan)
+        candidates = [self.form_squad(bowling_plan=x) for x in plans]
+        ranked = self.successive_halving(candidates, "bowling", min_sims,
+                                         eta, max_sims, verbose)
+        return ranked[0]
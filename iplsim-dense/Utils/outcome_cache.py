@@ -0,0 +1,316 @@
+import atexit
+import hashlib
+import os
+import sqlite3
+import time
+import numpy as np
+from Utils.profiling import NULL_PROFILER
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS models (
+    id INTEGER PRIMARY KEY, fingerprint TEXT UNIQUE, dtype TEXT,
+    hits INTEGER DEFAULT 0, misses INTEGER DEFAULT 0);
+CREATE TABLE IF NOT EXISTS outcomes (
+    key BLOB PRIMARY KEY, model INTEGER, probs BLOB, used REAL)
+    WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS outcomes_used ON outcomes (used);
+"""
+# Rows per IN (...) query, below the sqlite variable limit
+CHUNK = 500
+# Hits refresh their recency at most this often (seconds), and pending
+# recency and counts are written at least this often while in use
+TOUCH_INTERVAL = 60.0
+
+
+def model_fingerprint(model):
+    # sha256 of the weights: keras models through get_weights, NumpyModel
+    # and EmbeddingModel through their layers and tables
+    digest = hashlib.sha256(type(model).__name__.encode())
+    if hasattr(model, "get_weights"):
+        arrays = model.get_weights()
+    else:
+        layers = list(getattr(model, "layers", None) or [])
+        if getattr(model, "head", None) is not None:
+            layers += model.head.layers
+        arrays = list(getattr(model, "tables", None) or [])
+        for layer in layers:
+            digest.update(layer["activation"].encode())
+            arrays += [layer[k] for k in sorted(layer) if k != "activation"
+                       and layer[k] is not None]
+        for name in ["mode", "combine"]:
+            digest.update(str(getattr(model, name, "")).encode())
+        for name in ["numeric_W", "first_bias"]:
+            if getattr(model, name, None) is not None:
+                arrays.append(getattr(model, name))
+    assert arrays, "No weights to fingerprint, pass the fingerprint instead"
+    for value in arrays:
+        value = np.ascontiguousarray(value)
+        digest.update(str(value.dtype).encode() + str(value.shape).encode())
+        digest.update(value.tobytes())
+    return digest.hexdigest()
+
+
+def checkpoint_fingerprint(load_path):
+    # sha256 of a checkpoint file, or of every file under a SavedModel
+    # directory, without loading it
+    digest = hashlib.sha256()
+    paths = [load_path]
+    if os.path.isdir(load_path):
+        paths = sorted(os.path.join(root, name)
+                       for root, _, names in os.walk(load_path)
+                       for name in names)
+    for path in paths:
+        digest.update(os.path.relpath(path, load_path).encode())
+        with open(path, "rb") as fp:
+            for block in iter(lambda: fp.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+class OutcomeCache():
+    # Model outputs on disk in sqlite, keyed by a hash of the model
+    # fingerprint and the encoded model input. The database runs in WAL mode,
+    # so any number of processes can read while one writes; every process
+    # opens its own connection on first use (also after a fork). Once more
+    # than max_entries outputs are stored the least recently used are
+    # evicted down to 90% of the cap, about 300 bytes each. Recency and
+    # counts are written with the next put or at least every TOUCH_INTERVAL
+    # while in use, and the rest on exit. Fork pool workers leave through
+    # os._exit without exit hooks, so a worker should call close() before
+    # it returns to keep its last counts.
+    def __init__(self, path, max_entries=1000000, timeout=60.0):
+        self.path = path
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.conn = None
+        self.pid = None
+        self.pending_touch = {}
+        self.pending_counts = {}
+        self.flushed = time.time()
+        self.entries = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def connect(self):
+        if self.conn is None or self.pid != os.getpid():
+            self.conn = sqlite3.connect(self.path, timeout=self.timeout,
+                                        isolation_level=None)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.executescript(SCHEMA)
+            if self.pid != os.getpid():
+                # pending recency and counts are written on exit
+                atexit.register(self.close)
+            self.pid = os.getpid()
+            self.pending_touch = {}
+            self.pending_counts = {}
+            self.flushed = time.time()
+            self.entries = None
+        return self.conn
+
+    def model_id(self, fingerprint):
+        # id and output dtype of a model, dtype None before its first output
+        conn = self.connect()
+        conn.execute("INSERT OR IGNORE INTO models (fingerprint) VALUES (?)",
+                     (fingerprint,))
+        return conn.execute("SELECT id, dtype FROM models WHERE "
+                            "fingerprint = ?", (fingerprint,)).fetchone()
+
+    def get(self, keys, dtype):
+        # {key: probs} for the keys found
+        conn = self.connect()
+        found = {}
+        for i in range(0, len(keys), CHUNK):
+            chunk = keys[i:i + CHUNK]
+            query = ("SELECT key, probs, used FROM outcomes WHERE key IN (" +
+                     ",".join("?" * len(chunk)) + ")")
+            now = time.time()
+            for key, probs, used in conn.execute(query, chunk):
+                found[key] = np.frombuffer(probs, dtype=dtype)
+                if now - used > TOUCH_INTERVAL:
+                    self.pending_touch[key] = now
+        if len(self.pending_touch) >= 4096:
+            self.flush()
+        return found
+
+    def count(self, model, hits, misses):
+        self.hits += hits
+        self.misses += misses
+        counts = self.pending_counts.setdefault(model, [0, 0])
+        counts[0] += hits
+        counts[1] += misses
+        # warm runs rarely put, so their counts are flushed on a timer
+        if time.time() - self.flushed > TOUCH_INTERVAL:
+            self.flush()
+
+    def put(self, items):
+        # Stores (model, key, probs) triples
+        conn = self.connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany("INSERT OR IGNORE INTO outcomes VALUES "
+                             "(?, ?, ?, ?)",
+                             [(key, model, probs.tobytes(), now)
+                              for model, key, probs in items])
+            self.touch()
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        if self.entries is not None:
+            self.entries += len(items)
+        if self.entries is None or self.entries > self.max_entries:
+            self.evict()
+
+    def set_dtype(self, model, dtype):
+        self.connect().execute("UPDATE models SET dtype = ? WHERE id = ? "
+                               "AND dtype IS NULL", (dtype, model))
+
+    def touch(self):
+        # Recency of the hits and the lifetime counts since the last write,
+        # batched so that reads stay read-only most of the time
+        self.flushed = time.time()
+        if self.pending_touch:
+            self.conn.executemany("UPDATE outcomes SET used = ? WHERE key = ?",
+                                  [(used, key) for key, used
+                                   in self.pending_touch.items()])
+            self.pending_touch = {}
+        if self.pending_counts:
+            self.conn.executemany("UPDATE models SET hits = hits + ?, "
+                                  "misses = misses + ? WHERE id = ?",
+                                  [(hits, misses, model) for model,
+                                   (hits, misses)
+                                   in self.pending_counts.items()])
+            self.pending_counts = {}
+
+    def flush(self):
+        conn = self.connect()
+        conn.execute("BEGIN IMMEDIATE")
+        self.touch()
+        conn.execute("COMMIT")
+
+    def evict(self):
+        conn = self.connect()
+        conn.execute("BEGIN IMMEDIATE")
+        count = conn.execute("SELECT COUNT(*) FROM outcomes").fetchone()[0]
+        if count > self.max_entries:
+            n = count - int(self.max_entries * 0.9)
+            conn.execute("DELETE FROM outcomes WHERE key IN (SELECT key FROM "
+                         "outcomes ORDER BY used LIMIT ?)", (n,))
+            self.evictions += n
+            count -= n
+        conn.execute("COMMIT")
+        self.entries = count
+
+    def stats(self):
+        # This process's hits and misses, and the lifetime ones of every
+        # model in the file
+        self.flush()
+        conn = self.connect()
+        lookups = self.hits + self.misses
+        ret = {"entries": conn.execute("SELECT COUNT(*) FROM outcomes")
+               .fetchone()[0],
+               "max_entries": self.max_entries,
+               "bytes": os.path.getsize(self.path),
+               "hits": self.hits, "misses": self.misses,
+               "hit_rate": self.hits / lookups if lookups else None,
+               "evictions": self.evictions, "models": {}}
+        for fingerprint, hits, misses in conn.execute(
+                "SELECT fingerprint, hits, misses FROM models"):
+            total = hits + misses
+            ret["models"][fingerprint] = {
+                "hits": hits, "misses": misses,
+                "hit_rate": hits / total if total else None}
+        return ret
+
+    def clear(self):
+        conn = self.connect()
+        conn.execute("DELETE FROM outcomes")
+        conn.execute("UPDATE models SET hits = 0, misses = 0")
+        self.pending_touch = {}
+        self.pending_counts = {}
+        self.entries = 0
+
+    def close(self):
+        if self.conn is not None and self.pid == os.getpid():
+            self.flush()
+            self.conn.close()
+        self.conn = None
+
+
+class CachedModel():
+    # Puts an OutcomeCache in front of model.predict with the predict and
+    # reset_states of a keras model, so that Innings.simulate_inning, Match,
+    # the batched engine and EvaluationMetrics use it unchanged. Outputs are
+    # returned in the model's own dtype, so a cached run samples exactly
+    # like an uncached one. Hits only come from states seen before with the
+    # same figures, which in practice means a rerun of the same fixtures
+    # with the same seeds: a rerun with a new seed finds almost nothing.
+    # A lookup also costs about as much as a small model's predict, so for
+    # small models a fully cached rerun can be slower than no cache.
+    def __init__(self, model, cache, fingerprint=None, profiler=None):
+        if isinstance(cache, str):
+            cache = OutcomeCache(cache)
+        self.model = model
+        self.cache = cache
+        self.fingerprint = fingerprint or model_fingerprint(model)
+        self.prefix = bytes.fromhex(self.fingerprint)
+        self.profiler = profiler if profiler is not None else NULL_PROFILER
+        self.model_id = None
+        self.dtype = None
+
+    def reset_states(self):
+        self.model.reset_states()
+
+    def keys(self, x):
+        # Model inputs are mostly zero, so a key hashes the positions and
+        # values of the nonzero inputs of its row only
+        rows, cols = np.nonzero(x)
+        ends = np.searchsorted(rows, np.arange(len(x) + 1)).tolist()
+        positions = cols.astype(np.int32).tobytes()
+        values = x[rows, cols].tobytes()
+        return [hashlib.blake2b(self.prefix + positions[4 * a:4 * b]
+                                + values[4 * a:4 * b],
+                                digest_size=16).digest()
+                for a, b in zip(ends, ends[1:])]
+
+    def predict(self, x, verbose=0, batch_size=None):
+        x = np.ascontiguousarray(x, dtype=np.float32)
+        if self.model_id is None or self.cache.pid != os.getpid():
+            self.model_id, self.dtype = self.cache.model_id(self.fingerprint)
+        keys = self.keys(x)
+        found = self.cache.get(keys, self.dtype) if self.dtype else {}
+        missing = {}
+        for i, key in enumerate(keys):
+            if key not in found:
+                missing.setdefault(key, i)
+        if missing:
+            rows = list(missing.values())
+            q = np.asarray(self.model.predict(x[rows], verbose=0))
+            if self.dtype is None:
+                self.dtype = str(q.dtype)
+                self.cache.set_dtype(self.model_id, self.dtype)
+            q = q.astype(self.dtype, copy=False)
+            for key, probs in zip(missing, q):
+                found[key] = probs
+        hits = len(keys) - len(missing)
+        self.cache.count(self.model_id, hits, len(missing))
+        self.profiler.count("cache_hits", hits)
+        self.profiler.count("cache_misses", len(missing))
+        if missing:
+            self.cache.put([[self.model_id, key, found[key]]
+                            for key in missing])
+        return np.array([found[key] for key in keys])
+
+
+def cached_models(model_inn_1, model_inn_2, path, max_entries=1000000,
+                  profiler=None):
+    # Both innings models behind one cache file, e.g.
+    #     m1, m2 = cached_models(model_inn_1, model_inn_2, "outcomes.db")
+    #     evaluator = EvaluationMetrics(m1, m2)
+    # or Match(TeamA, TeamB, Venue, m1, m2) for single matches
+    cache = OutcomeCache(path, max_entries)
+    return (CachedModel(model_inn_1, cache, profiler=profiler),
+            CachedModel(model_inn_2, cache, profiler=profiler))
@@ -0,0 +1,100 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from Utils.profiling import NULL_PROFILER
+
+
+class PipelinedExecutor():
+    # Lockstep simulation like simulate_innings_batch with the live innings
+    # split into two cohorts. While the worker thread runs the forward pass
+    # of one cohort (NumPy and TF release the GIL inside the matmuls), the
+    # main thread samples and applies the outcomes of the other cohort and
+    # encodes its next inputs.
+    def __init__(self, model, profiler=None):
+        self.model = model
+        self.profiler = profiler if profiler is not None else NULL_PROFILER
+        self.pool = ThreadPoolExecutor(max_workers=1)
+        self.reset_metrics()
+
+    def reset_metrics(self):
+        self.metrics = {"wall": 0.0, "worker_busy": 0.0, "main_busy": 0.0,
+                        "main_wait": 0.0, "model_calls": 0, "model_rows": 0,
+                        "balls": 0}
+
+    def close(self):
+        self.pool.shutdown()
+
+    def predict(self, rows):
+        start = time.perf_counter()
+        q = self.model.predict(rows, verbose=0)
+        return q, time.perf_counter() - start
+
+    def submit(self, cohort):
+        with self.profiler.stage("encode"):
+            rows = np.array([inn.get_model_input() for inn in cohort])
+        self.metrics["model_calls"] += 1
+        self.metrics["model_rows"] += len(cohort)
+        return self.pool.submit(self.predict, rows)
+
+    def apply(self, cohort, q):
+        with self.profiler.stage("sample"):
+            results = [inn.sample_result(probs) for inn, probs
+                       in zip(cohort, q)]
+        with self.profiler.stage("update"):
+            for inn, res in zip(cohort, results):
+                inn.ball_prediction(res)
+        self.metrics["balls"] += len(cohort)
+        self.profiler.count("balls", len(cohort))
+        return [inn for inn in cohort if not inn.innings_over()]
+
+    def run(self, innings_list):
+        self.profiler.begin("batch")
+        start = time.perf_counter()
+        wait = 0.0
+        live = [inn for inn in innings_list if not inn.innings_over()]
+        half = (len(live) + 1) // 2
+        cohorts = [live[:half], live[half:]]
+        futures = [self.submit(cohort) if cohort else None
+                   for cohort in cohorts]
+        while any(futures):
+            for i in range(2):
+                if futures[i] is None:
+                    continue
+                waited = time.perf_counter()
+                with self.profiler.stage("predict"):
+                    q, busy = futures[i].result()
+                wait += time.perf_counter() - waited
+                self.metrics["worker_busy"] += busy
+                self.profiler.count("model_calls")
+                self.profiler.count("model_rows", len(cohorts[i]))
+                cohorts[i] = self.apply(cohorts[i], q)
+                futures[i] = self.submit(cohorts[i]) if cohorts[i] else None
+        wall = time.perf_counter() - start
+        self.metrics["wall"] += wall
+        self.metrics["main_wait"] += wait
+        self.metrics["main_busy"] += wall - wait
+        self.profiler.end("batch", innings=len(innings_list))
+        return [inn.get_result() for inn in innings_list]
+
+    def utilization(self):
+        # overlap is the share of the wall time in which the model and the
+        # innings updates ran at the same time
+        m = self.metrics
+        wall = m["wall"] or 1
+        return {"wall": m["wall"],
+                "worker_utilization": m["worker_busy"] / wall,
+                "main_utilization": m["main_busy"] / wall,
+                "overlap": max(m["worker_busy"] + m["main_busy"] - m["wall"],
+                               0) / wall,
+                "rows_per_call": (m["model_rows"] / m["model_calls"]
+                                  if m["model_calls"] else 0),
+                "balls_per_sec": m["balls"] / wall}
+
+
+def simulate_innings_pipelined(innings_list, model, profiler=None):
+    executor = PipelinedExecutor(model, profiler)
+    try:
+        results = executor.run(innings_list)
+    finally:
+        executor.close()
+    return results, executor.utilization()
@@ -0,0 +1,203 @@
+import cProfile
+import csv
+import json
+import os
+import time
+
+
+class StageTimer():
+    __slots__ = ["profiler", "name", "start"]
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        elapsed = time.perf_counter() - self.start
+        stage = self.profiler.stages.get(self.name)
+        if stage is None:
+            self.profiler.stages[self.name] = [1, elapsed]
+        else:
+            stage[0] += 1
+            stage[1] += elapsed
+        return False
+
+
+class NullTimer():
+    __slots__ = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+class NullProfiler():
+    # Stand-in used when profiling is off so the simulation loop does not
+    # need to branch on every stage
+    timer = NullTimer()
+
+    def stage(self, name):
+        return self.timer
+
+    def count(self, name, n=1):
+        pass
+
+    def begin(self, level):
+        pass
+
+    def end(self, level, **info):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
+
+
+class SimulationProfiler():
+    # Per stage timers and counters for Innings.simulate_inning and the
+    # batched engine. begin/end mark innings, match and tournament scopes;
+    # every closed scope adds a record holding the stage times and counters
+    # spent inside it, which makes up the exported timeline. Open scopes are
+    # kept on a stack, and end closes the innermost open scope of its level,
+    # so scopes of the same level may nest.
+    def __init__(self, cprofile=False):
+        self.stages = {}
+        self.counters = {}
+        self.records = []
+        # [level, start, snapshot] of every open scope, innermost last
+        self.open_scopes = []
+        self.origin = time.perf_counter()
+        self.wall_origin = time.time()
+        self.profile = cProfile.Profile() if cprofile else None
+        self.profile_depth = 0
+
+    def stage(self, name):
+        return StageTimer(self, name)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def snapshot(self):
+        return ({name: list(value) for name, value in self.stages.items()},
+                dict(self.counters))
+
+    def begin(self, level):
+        if self.profile is not None:
+            if self.profile_depth == 0:
+                self.profile.enable()
+            self.profile_depth += 1
+        self.open_scopes.append([level, time.perf_counter(),
+                                 self.snapshot()])
+
+    def end(self, level, **info):
+        levels = [x[0] for x in self.open_scopes]
+        assert level in levels, f"No open '{level}' scope to end"
+        i = len(levels) - 1 - levels[::-1].index(level)
+        _, start, (stages, counters) = self.open_scopes.pop(i)
+        now = time.perf_counter()
+        record = {"level": level, "start": start - self.origin,
+                  "duration": now - start, "depth": len(self.open_scopes)}
+        for name, (calls, seconds) in self.stages.items():
+            prev_calls, prev_seconds = stages.get(name, (0, 0))
+            record["stage_"+name+"_calls"] = calls - prev_calls
+            record["stage_"+name+"_s"] = seconds - prev_seconds
+        for name, value in self.counters.items():
+            record[name] = value - counters.get(name, 0)
+        record.update(info)
+        self.records.append(record)
+        if self.profile is not None:
+            self.profile_depth -= 1
+            if self.profile_depth == 0:
+                self.profile.disable()
+        return record
+
+    def level_records(self, level):
+        return [x for x in self.records if x["level"] == level]
+
+    def summary(self):
+        ret = {"stages": {name: {"calls": calls, "seconds": seconds}
+                          for name, (calls, seconds) in self.stages.items()},
+               "counters": dict(self.counters)}
+        for level in ["innings", "match", "tournament"]:
+            records = self.level_records(level)
+            if records:
+                ret[level+"_count"] = len(records)
+                ret[level+"_seconds"] = sum(x["duration"] for x in records)
+        # Throughput is measured over the outermost scopes so that nested
+        # innings are not counted twice
+        outer = [x for x in self.records if x["depth"] == 0]
+        if outer:
+            seconds = sum(x["duration"] for x in outer)
+        else:
+            seconds = sum(calls[1] for calls in self.stages.values())
+        balls = self.counters.get("balls", 0)
+        ret["seconds"] = seconds
+        ret["balls_per_sec"] = balls / seconds if seconds else 0
+        matches = len(self.level_records("match"))
+        ret["matches_per_sec"] = matches / seconds if seconds else 0
+        calls = self.counters.get("model_calls", 0)
+        ret["rows_per_call"] = (self.counters.get("model_rows", 0) / calls
+                                if calls else 0)
+        lookups = (self.counters.get("cache_hits", 0)
+                   + self.counters.get("cache_misses", 0))
+        ret["cache_hit_rate"] = (self.counters.get("cache_hits", 0) / lookups
+                                 if lookups else None)
+        return ret
+
+    def print_summary(self):
+        summary = self.summary()
+        print(f"Balls simulated: {summary['counters'].get('balls', 0)}")
+        print(f"Balls/sec: {summary['balls_per_sec']:.1f}")
+        print(f"Matches/sec: {summary['matches_per_sec']:.3f}")
+        print(f"Model calls: {summary['counters'].get('model_calls', 0)}, "
+              f"rows per call: {summary['rows_per_call']:.1f}")
+        if summary["cache_hit_rate"] is not None:
+            print(f"Cache hit rate: {summary['cache_hit_rate']:.3f}")
+        total = sum(x["seconds"] for x in summary["stages"].values())
+        for name, stage in sorted(summary["stages"].items(),
+                                  key=lambda x: -x[1]["seconds"]):
+            share = stage["seconds"] / total * 100 if total else 0
+            print(f"  {name:<12} {stage['seconds']:9.3f}s {share:5.1f}% "
+                  f"({stage['calls']} calls)")
+
+    def export_json(self, path):
+        with open(path, "w") as fp:
+            json.dump({"wall_origin": self.wall_origin,
+                       "summary": self.summary(),
+                       "timeline": self.records}, fp, indent=1)
+
+    def export_csv(self, path):
+        cols = []
+        for record in self.records:
+            for key in record:
+                if key not in cols:
+                    cols.append(key)
+        with open(path, "w", newline="") as fp:
+            writer = csv.DictWriter(fp, fieldnames=cols)
+            writer.writeheader()
+            writer.writerows(self.records)
+
+    def export_trace(self, path):
+        # Chrome trace event format, loadable in speedscope or perfetto next
+        # to a py-spy recording of the same run
+        events = []
+        for record in self.records:
+            events.append({"name": record["level"], "ph": "X",
+                           "ts": record["start"] * 1e6,
+                           "dur": record["duration"] * 1e6,
+                           "pid": os.getpid(), "tid": 0,
+                           "args": {k: v for k, v in record.items()
+                                    if k not in ("level", "start",
+                                                 "duration", "depth")}})
+        with open(path, "w") as fp:
+            json.dump({"traceEvents": events}, fp)
+
+    def dump_stats(self, path):
+        assert self.profile is not None, \
+            "Profiler was created without cprofile=True"
+        self.profile.dump_stats(path)
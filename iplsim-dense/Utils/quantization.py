@@ -0,0 +1,103 @@
+import numpy as np
+import pandas as pd
+import random
+from Utils.batch_simulation import simulate_innings_batch
+from Utils.helper import Innings, BF_Cols, BS_Cols
+from Utils.embedding_model import model_cost
+from Utils.inference import NumpyModel, to_float16, to_int8
+from Utils.stats import ks_2samp, kl_divergence
+
+
+def held_out_rows(innings, n_rows=20000, seed=0, validation_split=0.2):
+    # Rows from the part of the data keras held out for validation during
+    # training (the last validation_split fraction of the csv)
+    from Utils.data_generator import get_onehot
+    if innings == 1:
+        df = pd.read_csv("Data/Batting_First.csv")
+        cols = BF_Cols
+    else:
+        df = pd.read_csv("Data/Chasing.csv")
+        df["Required_Runs"] = df["Target"] - df["Current_Score"]
+        df.drop('Target', axis=1, inplace=True)
+        cols = BS_Cols
+    df = df[int(df.shape[0] * (1 - validation_split)):]
+    if df.shape[0] > n_rows:
+        df = df.sample(n=n_rows, random_state=seed)
+    x_df, _ = get_onehot(df)
+    return x_df.reindex(columns=cols, fill_value=0).values.astype(np.float32)
+
+
+def compare_outputs(reference, candidate, rows, batch_size=4096):
+    ref = []
+    cand = []
+    for start in range(0, rows.shape[0], batch_size):
+        ref.append(reference.predict(rows[start:start+batch_size], verbose=0))
+        cand.append(candidate.predict(rows[start:start+batch_size], verbose=0))
+    ref = np.concatenate(ref)
+    cand = np.concatenate(cand)
+    kl = kl_divergence(ref, cand)
+    return {
+        "kl_mean": float(kl.mean()),
+        "kl_p99": float(np.percentile(kl, 99)),
+        "kl_max": float(kl.max()),
+        "top1_agreement": float(np.mean(ref.argmax(1) == cand.argmax(1))),
+        "max_abs_diff": float(np.abs(ref - cand).max()),
+    }
+
+
+def simulated_totals(model, fixtures, n_sims, innings=1, seed=0):
+    # fixtures: list of (Batting, Bowling, toss team, venue, target)
+    random.seed(seed)
+    df = pd.DataFrame(columns=BF_Cols if innings == 1 else BS_Cols)
+    inns = [Innings(batting, bowling, toss, venue, innings, df, target)
+            for batting, bowling, toss, venue, target in fixtures
+            for _ in range(n_sims)]
+    simulate_innings_batch(inns, model)
+    return [inn.Runs for inn in inns]
+
+
+def quantization_report(reference, candidate, rows, fixtures, innings=1,
+                        n_sims=500, seed=0, max_kl=0.01, min_top1=0.99,
+                        min_ks_p=0.05):
+    report = compare_outputs(reference, candidate, rows)
+    ref_totals = simulated_totals(reference, fixtures, n_sims, innings, seed)
+    cand_totals = simulated_totals(candidate, fixtures, n_sims, innings, seed)
+    d, p = ks_2samp(ref_totals, cand_totals)
+    report.update({
+        "reference_total_mean": float(np.mean(ref_totals)),
+        "candidate_total_mean": float(np.mean(cand_totals)),
+        "reference_total_std": float(np.std(ref_totals)),
+        "candidate_total_std": float(np.std(cand_totals)),
+        "total_ks_statistic": d,
+        "total_ks_p": p,
+    })
+    # NumpyModel computes in float32 whatever the mode, so a reduced
+    # precision model is no smaller or faster while predicting; only its
+    # file is smaller
+    for name, model in [["reference", reference], ["candidate", candidate]]:
+        numpy_model = isinstance(model, NumpyModel)
+        report[name+"_bytes"] = model.nbytes() if numpy_model else None
+        report[name+"_file_bytes"] = model.file_bytes() if numpy_model \
+            else None
+        report[name+"_seconds_per_call"] = \
+            model_cost(model, rows[:512])["seconds_per_call"]
+    report["accepted"] = (report["kl_mean"] <= max_kl
+                          and report["top1_agreement"] >= min_top1
+                          and p >= min_ks_p)
+    return report
+
+
+def export_quantized(model, save_path, mode="int8", calibration_rows=None):
+    # model: a loaded keras model or a NumpyModel
+    if not isinstance(model, NumpyModel):
+        model = NumpyModel.from_keras(model)
+    if mode == "float16":
+        quantized = to_float16(model)
+    elif mode == "int8":
+        assert calibration_rows is not None, \
+            "int8 export needs calibration rows"
+        quantized = to_int8(model, calibration_rows)
+    else:
+        assert False, "mode should be 'float16' or 'int8'"
+    quantized.save(save_path)
+    return quantized
@@ -0,0 +1,171 @@
+import pickle
+from Utils.equivalence import new_innings, innings_state
+from Utils.scorecard import render_innings
+
+# Codes after which ball_prediction draws whether the batsmen crossed
+SWAP_CODES = set([9, 13] + list(range(14, 34)) + [55, 56])
+
+
+def encode_balls(results, draws):
+    # One byte per ball: the result code in the low 6 bits and, for the codes
+    # in SWAP_CODES, the batsmen swap draw in bit 6
+    draws = iter(draws)
+    data = bytearray()
+    for code in results:
+        data.append(code | (next(draws) << 6 if code in SWAP_CODES else 0))
+    assert next(draws, None) is None, "More swap draws than swap codes"
+    return bytes(data)
+
+
+def decode_balls(data):
+    results = [x & 63 for x in data]
+    draws = [x >> 6 for x, code in zip(data, results) if code in SWAP_CODES]
+    return results, draws
+
+
+def has_results(inn):
+    # Innings pickled before the result codes were recorded cannot be
+    # replayed, only read from their stored inn_progress_df
+    return getattr(inn, "Results", None) is not None
+
+
+def innings_record(inn):
+    assert has_results(inn), "Innings has no recorded result codes"
+    return {"batting": [inn.Batting_Team] + [x.Name
+                                             for x in inn.Batting_lineup],
+            "bowling": [inn.Bowling_Team] + [x.Name
+                                             for x in inn.Bowling_lineup],
+            "toss": inn.Toss, "venue": inn.Venue, "innings": inn.innings,
+            "target": inn.Target,
+            "balls": encode_balls(inn.Results, inn.Swap_Draws),
+            "bowler_overrides": dict(getattr(inn, "Bowler_Overrides", {}))}
+
+
+def replay_innings(record, states=None):
+    # states, when given, collects the state before every ball in the layout
+    # of Utils.equivalence.innings_state
+    results, draws = decode_balls(record["balls"])
+    overrides = record.get("bowler_overrides", {})
+    inn = new_innings([record["batting"], record["bowling"], record["toss"],
+                       record["venue"], record["target"]], record["innings"])
+    inn.Forced_Draws = iter(draws)
+    for code in results:
+        if inn.Overs in overrides and len(inn.Results) == inn.Over_Start:
+            inn.set_next_bowler(overrides[inn.Overs])
+        if states is not None:
+            states.append(innings_state(inn))
+        inn.ball_prediction(code)
+    inn.Forced_Draws = None
+    return inn
+
+
+def ball_states(inn):
+    # The state before every ball, in the layout of
+    # Utils.equivalence.innings_state, and the result code of the ball
+    if not has_results(inn):
+        df = inn.inn_progress_df
+        if df.empty:
+            return [], []
+        return df.to_dict("records"), df["result"].tolist()
+    states = []
+    replay_innings(innings_record(inn), states)
+    return states, inn.Results
+
+
+class MatchArchive():
+    # Stores innings as their lineups plus one byte per ball. Every name and
+    # lineup is kept once, and the balls of all the innings share a single
+    # buffer, so a season takes a few kilobytes instead of the pickled
+    # Innings objects.
+    def __init__(self, load_path=None):
+        self.names = []
+        self.name_index = {}
+        self.lineups = []
+        self.lineup_index = {}
+        # [batting lineup, bowling lineup, toss, venue, innings, target,
+        #  offset, length]
+        self.innings = []
+        self.matches = []
+        # innings: {over: bowler name id} for the innings with overrides
+        self.overrides = {}
+        self.balls = bytearray()
+        if load_path is not None:
+            self.load_object(load_path)
+
+    def __len__(self):
+        return len(self.innings)
+
+    def name_id(self, name):
+        if name not in self.name_index:
+            self.name_index[name] = len(self.names)
+            self.names.append(name)
+        return self.name_index[name]
+
+    def lineup_id(self, lineup):
+        lineup = tuple(self.name_id(x) for x in lineup)
+        if lineup not in self.lineup_index:
+            self.lineup_index[lineup] = len(self.lineups)
+            self.lineups.append(lineup)
+        return self.lineup_index[lineup]
+
+    def add_innings(self, inn):
+        record = innings_record(inn)
+        self.innings.append([self.lineup_id(record["batting"]),
+                             self.lineup_id(record["bowling"]),
+                             self.name_id(record["toss"]),
+                             self.name_id(record["venue"]),
+                             record["innings"], record["target"],
+                             len(self.balls), len(record["balls"])])
+        self.balls += record["balls"]
+        if record["bowler_overrides"]:
+            self.overrides[len(self.innings) - 1] = {
+                over: self.name_id(name)
+                for over, name in record["bowler_overrides"].items()}
+        return len(self.innings) - 1
+
+    def add_match(self, inn1, inn2):
+        self.matches.append([self.add_innings(inn1), self.add_innings(inn2)])
+        return len(self.matches) - 1
+
+    def record(self, i):
+        batting, bowling, toss, venue, innings, target, offset, length = \
+            self.innings[i]
+        return {"batting": [self.names[x] for x in self.lineups[batting]],
+                "bowling": [self.names[x] for x in self.lineups[bowling]],
+                "toss": self.names[toss], "venue": self.names[venue],
+                "innings": innings, "target": target,
+                "balls": bytes(self.balls[offset:offset+length]),
+                "bowler_overrides": {over: self.names[x] for over, x
+                                     in self.overrides.get(i, {}).items()}}
+
+    def replay(self, i):
+        return replay_innings(self.record(i))
+
+    def replay_match(self, m):
+        return [self.replay(i) for i in self.matches[m]]
+
+    def results(self, i):
+        return decode_balls(self.record(i)["balls"])[0]
+
+    def scorecard(self, i, fmt="text", display_level=1):
+        return render_innings(self.replay(i), fmt, display_level)
+
+    def load_object(self, load_path):
+        with open(load_path, "rb") as fp:
+            saved_archive = pickle.load(fp)
+        self.names = saved_archive["names"]
+        self.lineups = [tuple(x) for x in saved_archive["lineups"]]
+        self.innings = saved_archive["innings"]
+        self.matches = saved_archive["matches"]
+        self.balls = bytearray(saved_archive["balls"])
+        self.overrides = saved_archive.get("overrides", {})
+        self.name_index = {x: i for i, x in enumerate(self.names)}
+        self.lineup_index = {x: i for i, x in enumerate(self.lineups)}
+
+    def save_object(self, save_path):
+        save_archive = {"names": self.names, "lineups": self.lineups,
+                        "innings": self.innings, "matches": self.matches,
+                        "overrides": self.overrides,
+                        "balls": bytes(self.balls)}
+        with open(save_path, "wb") as fp:
+            pickle.dump(save_archive, fp, protocol=pickle.HIGHEST_PROTOCOL)
@@ -0,0 +1,164 @@
+import random
+from collections import deque
+import numpy as np
+import pandas as pd
+from Utils.helper import Innings, BF_Cols, BS_Cols
+from Utils.profiling import NULL_PROFILER
+
+
+class ContinuousScheduler():
+    # Continuous batching over both models. Every step predicts one ball for
+    # all live first innings with model_inn_1 and all live chases with
+    # model_inn_2. A first innings that finishes starts its chase in the
+    # same step, and waiting matches are admitted whenever first innings
+    # slots free up, so neither batch waits for the slowest innings of a
+    # wave.
+    def __init__(self, model_inn_1, model_inn_2, batch_size=512,
+                 profiler=None, on_match=None):
+        self.models = [model_inn_1, model_inn_2]
+        self.batch_size = batch_size
+        self.profiler = profiler if profiler is not None else NULL_PROFILER
+        # on_match(tag, inn1, inn2) is called as every match finishes
+        self.on_match = on_match
+        self.pending = deque()
+        self.live = [[], []]
+        self.inn_dfs = [pd.DataFrame(columns=BF_Cols),
+                        pd.DataFrame(columns=BS_Cols)]
+        self.finished = []
+        self.metrics = {"steps": 0, "rows": [0, 0], "calls": [0, 0],
+                        "matches": 0}
+
+    def submit(self, fixture, tag=None):
+        # fixture: (batting first squad, chasing squad, toss team, venue) as
+        # in simulate_matches_batch
+        self.pending.append([fixture, tag])
+
+    def admit(self):
+        while self.pending and len(self.live[0]) < self.batch_size:
+            (bat_first, chasing, toss, venue), tag = self.pending.popleft()
+            inn = Innings(bat_first[0], chasing[1], toss, venue, 1,
+                          self.inn_dfs[0])
+            inn.match = [bat_first, chasing, toss, venue, tag]
+            if inn.innings_over():
+                self.start_chase(inn)
+            else:
+                self.live[0].append(inn)
+
+    def start_chase(self, inn1):
+        bat_first, chasing, toss, venue, tag = inn1.match
+        inn2 = Innings(chasing[0], bat_first[1], toss, venue, 2,
+                       self.inn_dfs[1], int(inn1.get_result()))
+        inn2.match = inn1.match
+        inn2.first_innings = inn1
+        self.live[1].append(inn2)
+
+    def finish_match(self, inn2):
+        tag = inn2.match[4]
+        self.metrics["matches"] += 1
+        if self.on_match is not None:
+            self.on_match(tag, inn2.first_innings, inn2)
+        else:
+            self.finished.append([tag, inn2.first_innings, inn2])
+
+    def step(self):
+        self.admit()
+        batches = [list(live) for live in self.live]
+        probs = [None, None]
+        for i, batch in enumerate(batches):
+            if not batch:
+                continue
+            with self.profiler.stage("encode"):
+                model_inp = np.array([inn.get_model_input() for inn in batch])
+            with self.profiler.stage("predict"):
+                probs[i] = self.models[i].predict(model_inp, verbose=0)
+            self.metrics["calls"][i] += 1
+            self.metrics["rows"][i] += len(batch)
+            self.profiler.count("model_calls")
+            self.profiler.count("model_rows", len(batch))
+            self.profiler.count("balls", len(batch))
+        for i, batch in enumerate(batches):
+            if not batch:
+                continue
+            with self.profiler.stage("sample"):
+                results = [inn.sample_result(q) for inn, q
+                           in zip(batch, probs[i])]
+            with self.profiler.stage("update"):
+                for inn, res in zip(batch, results):
+                    inn.ball_prediction(res)
+        with self.profiler.stage("bookkeeping"):
+            for inn in self.live[0]:
+                if inn.innings_over():
+                    self.start_chase(inn)
+            self.live[0] = [inn for inn in self.live[0]
+                            if not inn.innings_over()]
+            for inn in batches[1]:
+                if inn.innings_over():
+                    self.finish_match(inn)
+            self.live[1] = [inn for inn in self.live[1]
+                            if not inn.innings_over()]
+        self.metrics["steps"] += 1
+
+    def run(self):
+        self.profiler.begin("batch")
+        while self.pending or self.live[0] or self.live[1]:
+            self.step()
+        self.profiler.end("batch", matches=self.metrics["matches"])
+        finished = self.finished
+        self.finished = []
+        return finished
+
+    def occupancy(self):
+        # Mean rows per call of each model as a share of batch_size
+        return [rows / calls / self.batch_size if calls else 0
+                for rows, calls in zip(self.metrics["rows"],
+                                       self.metrics["calls"])]
+
+
+def simulate_matches_continuous(fixtures, model_inn_1, model_inn_2,
+                                batch_size=512, profiler=None):
+    # Same return value as simulate_matches_batch, in the order of fixtures
+    scheduler = ContinuousScheduler(model_inn_1, model_inn_2, batch_size,
+                                    profiler)
+    for i, fixture in enumerate(fixtures):
+        scheduler.submit(fixture, i)
+    matches = sorted(scheduler.run(), key=lambda x: x[0])
+    return [[inn1, inn2, inn2.get_result()] for _, inn1, inn2 in matches]
+
+
+def simulate_tournaments(evaluator, n_tournaments=1, batch_size=512,
+                         verbose=0):
+    # Plays n_tournaments of an EvaluationMetrics through one scheduler.
+    # Matches of the next tournament are admitted while the previous one is
+    # still finishing; each match is recorded into the season table of its
+    # own tournament as it finishes.
+    assert evaluator.match_count == 0, \
+        "simulate_tournaments starts from a fresh tournament"
+    scheduler = ContinuousScheduler(*evaluator.models, batch_size,
+                                    evaluator.profiler)
+
+    def record(tag, inn1, inn2):
+        match, season_table, tournament = tag
+        inn1_score, inn1_balls, _ = evaluator.record_innings(
+            inn1, verbose, tournament)
+        inn2_score, inn2_balls, (ret_str, inn2_ret) = \
+            evaluator.record_innings(inn2, verbose, tournament)
+        evaluator.record_result(match, inn1_score, inn1_balls, inn2_score,
+                                inn2_balls, inn2_ret, season_table)
+        if verbose:
+            print(ret_str)
+
+    scheduler.on_match = record
+    for t in range(n_tournaments):
+        if t > 0:
+            evaluator.reinitialize_tournament()
+        for match in evaluator.matches:
+            toss = random.choice([0, 1])
+            fixture = [match[0][0], match[0][1], match[0][toss][0][0],
+                       match[1]]
+            scheduler.submit(fixture, [match, evaluator.season_table,
+                                       len(evaluator.old_season_tables)])
+        evaluator.match_count = len(evaluator.matches)
+    evaluator.profiler.begin("tournament")
+    scheduler.run()
+    evaluator.profiler.end("tournament", tournaments=n_tournaments)
+    return scheduler
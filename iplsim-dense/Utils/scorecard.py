@@ -0,0 +1,134 @@
+import html
+import json
+import pandas as pd
+
+BATTING_COLS = ["Batsman", "Runs", "Fours", "Sixes", "Balls Faced",
+                "Dismissal Type", "Dismissed By"]
+FALL_COLS = ["Dismissed Batsman", "Team Runs", "Overs"]
+BOWLING_COLS = ["Bowler", "Runs Conceded", "Wickets Taken", "Overs",
+                "Batsman Names"]
+OVER_COLS = ["Over", "Bowler", "Runs Conceded", "Wickets Taken",
+             "Total Score", "Total Wickets"]
+TABLES = [["batting", BATTING_COLS], ["bowling", BOWLING_COLS],
+          ["fall_of_wickets", FALL_COLS], ["over_summary", OVER_COLS]]
+
+
+def overs_string(inn):
+    o = inn.Overs - 1
+    b = inn.Balls
+    if (inn.Balls == 6):
+        b = 0
+        o += 1
+    else:
+        b -= 1
+    return str(o) + "." + str(b)
+
+
+def batting_records(inn):
+    rows = []
+    for i in inn.Batting_lineup:
+        if i.Entered_Match:
+            rows.append([i.Name, i.Runs, i.Fours_Hit, i.Sixes_Hit, i.Balls,
+                         i.Dismissal if i.Dismissal else 'Not Out',
+                         i.Dismissal_By if i.Dismissal_By else "-"])
+        else:
+            rows.append([i.Name, "-", "-", "-", "-", "-", "-"])
+    return rows
+
+
+def fall_of_wickets_records(inn):
+    rows = [[i.Name, i.Fall_Runs, i.Fall_Over] for i in inn.Batting_lineup
+            if i.Fall_Runs]
+    return sorted(rows, key=lambda x: (x[1], x[2]))
+
+
+def bowling_records(inn):
+    rows = []
+    # dict.fromkeys keeps the order in which the bowlers first came on
+    for i in dict.fromkeys(inn.Bowling_lineup):
+        names = [k.Name for k in i.Wickets_Taken]
+        rows.append([i.Name, i.Runs_Conceded, len(i.Wickets_Taken),
+                     str(i.Overs_Bowled)+"."+str(i.Balls_Bowled),
+                     ", ".join(names) if names else "-"])
+    return rows
+
+
+def over_summary_records(inn):
+    return [[count, i[-1].Name, i[0], i[1], i[2], i[3]]
+            for count, i in enumerate(inn.Overs_Summary, 1)]
+
+
+def innings_records(inn):
+    return {"batting": batting_records(inn),
+            "bowling": bowling_records(inn),
+            "fall_of_wickets": fall_of_wickets_records(inn),
+            "over_summary": over_summary_records(inn)}
+
+
+def innings_header(inn):
+    return {"Batting Team": inn.Batting_Team, "Runs": inn.Runs,
+            "Wickets": inn.Wickets, "Overs": overs_string(inn),
+            "Extras": inn.Extras}
+
+
+def innings_tables(inn):
+    records = innings_records(inn)
+    return {name: pd.DataFrame.from_records(records[name], columns=cols)
+            for name, cols in TABLES}
+
+
+def text_table(cols, rows):
+    cells = [[str(x) for x in row] for row in rows]
+    widths = [max([len(col)] + [len(row[i]) for row in cells])
+              for i, col in enumerate(cols)]
+    lines = ["  ".join(col.ljust(w) for col, w in zip(cols, widths))]
+    lines.append("  ".join("-" * w for w in widths))
+    for row in cells:
+        lines.append("  ".join(x.ljust(w) for x, w in zip(row, widths)))
+    return "\n".join(line.rstrip() for line in lines)
+
+
+def html_table(cols, rows):
+    head = "".join(f"<th>{html.escape(col)}</th>" for col in cols)
+    body = "".join("<tr>" + "".join(f"<td>{html.escape(str(x))}</td>"
+                                    for x in row) + "</tr>" for row in rows)
+    return (f"<table><thead><tr>{head}</tr></thead>"
+            f"<tbody>{body}</tbody></table>")
+
+
+def render_innings(inn, fmt="text", display_level=1):
+    header = innings_header(inn)
+    records = innings_records(inn)
+    names = [name for name, _ in TABLES]
+    if display_level != 1:
+        names = ["batting"]
+    if fmt == "json":
+        ret = dict(header)
+        for name, cols in TABLES:
+            if name in names:
+                ret[name] = [dict(zip(cols, row)) for row in records[name]]
+        return json.dumps(ret)
+    title = (f"{header['Batting Team']} : {header['Runs']} / "
+             f"{header['Wickets']} in {header['Overs']}")
+    if fmt == "text":
+        parts = [title, "Extras: " + str(header["Extras"])]
+        parts += [text_table(cols, records[name]) for name, cols in TABLES
+                  if name in names]
+        return "\n\n".join(parts)
+    if fmt == "html":
+        parts = [f"<h3>{html.escape(title)}</h3>",
+                 f"<p>Extras: {header['Extras']}</p>"]
+        parts += [html_table(cols, records[name]) for name, cols in TABLES
+                  if name in names]
+        return "\n".join(parts)
+    assert False, "fmt should be 'text', 'html' or 'json'"
+
+
+def render_innings_batch(innings_list, fmt="text", display_level=1):
+    rendered = [render_innings(inn, fmt, display_level)
+                for inn in innings_list]
+    if fmt == "json":
+        return "[" + ",".join(rendered) + "]"
+    if fmt == "html":
+        return "\n<hr>\n".join(rendered)
+    return ("\n\n" + "=" * 80 + "\n\n").join(rendered)
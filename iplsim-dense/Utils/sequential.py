@@ -0,0 +1,164 @@
+import random
+from statistics import NormalDist
+import numpy as np
+from Utils.batch_simulation import simulate_matches_batch
+
+# Fields of the rows returned by match_sampler
+MATCH_FIELDS = ["first_innings_runs", "first_innings_wickets",
+                "chase_runs", "chase_wickets", "team_a_won", "tie"]
+
+
+def z_value(confidence):
+    return NormalDist().inv_cdf(0.5 + confidence / 2)
+
+
+def wilson_interval(successes, n, confidence=0.95):
+    if n == 0:
+        return 0.0, 1.0
+    z = z_value(confidence)
+    p = successes / n
+    centre = (p + z * z / (2 * n)) / (1 + z * z / n)
+    half = (z * np.sqrt(p * (1 - p) / n + z * z / (4 * n * n))
+            / (1 + z * z / n))
+    return max(centre - half, 0.0), min(centre + half, 1.0)
+
+
+def bootstrap_interval(values, statistic=np.mean, confidence=0.95,
+                       n_boot=1000, seed=0):
+    values = np.asarray(values)
+    rng = np.random.default_rng(seed)
+    samples = rng.integers(0, len(values), (n_boot, len(values)))
+    stats = np.array([statistic(values[x]) for x in samples])
+    return tuple(np.quantile(stats, [(1 - confidence) / 2,
+                                     (1 + confidence) / 2]))
+
+
+def sequential_run(sample, done, initial=200, growth=2.0, max_samples=10000):
+    # Draws sample(n) in growing rounds until done(values) holds or the
+    # budget of max_samples is spent
+    values = []
+    size = initial
+    rounds = 0
+    while len(values) < max_samples:
+        values += sample(min(size, max_samples - len(values)))
+        rounds += 1
+        if done(values):
+            return values, {"samples": len(values), "rounds": rounds,
+                            "stopped": "precision"}
+        size = int(size * growth)
+    return values, {"samples": len(values), "rounds": rounds,
+                    "stopped": "budget"}
+
+
+def match_sampler(TeamA, TeamB, Venue, model_inn_1, model_inn_2,
+                  engine=simulate_matches_batch):
+    # The toss and the choice to bat or bowl are drawn for every match as in
+    # Match; a tie counts as half a win
+    def sample(n):
+        fixtures = []
+        for _ in range(n):
+            toss = random.choice([0, 1])
+            choice = random.choice([0, 1])
+            winner = TeamA if toss else TeamB
+            loser = TeamB if toss else TeamA
+            if choice:
+                fixtures.append([winner, loser, winner[0][0], Venue])
+            else:
+                fixtures.append([loser, winner, winner[0][0], Venue])
+        rows = []
+        for fixture, (inn1, inn2, (_, code)) in zip(
+                fixtures, engine(fixtures, model_inn_1, model_inn_2)):
+            a_chased = fixture[1] is TeamA
+            won = 0.5 if code == -1 else float((code == 1) == a_chased)
+            rows.append([inn1.Runs, inn1.Wickets, inn2.Runs, inn2.Wickets,
+                         won, code == -1])
+        return rows
+    return sample
+
+
+def win_probability(TeamA, TeamB, Venue, model_inn_1, model_inn_2,
+                    half_width=0.01, confidence=0.95, initial=200,
+                    growth=2.0, max_matches=10000,
+                    engine=simulate_matches_batch):
+    # e.g. win_probability(CSK_Squad, RCB_Squad, CSK_Pitch, model_inn1,
+    # model_inn2) for the chance of CSK beating RCB at Chepauk within +-1%
+    def done(rows):
+        low, high = wilson_interval(sum(x[4] for x in rows), len(rows),
+                                    confidence)
+        return (high - low) / 2 <= half_width
+
+    rows, report = sequential_run(
+        match_sampler(TeamA, TeamB, Venue, model_inn_1, model_inn_2, engine),
+        done, initial, growth, max_matches)
+    wins = sum(x[4] for x in rows)
+    report.update({"win_probability": wins / len(rows),
+                   "interval": wilson_interval(wins, len(rows), confidence),
+                   "tie_rate": sum(x[5] for x in rows) / len(rows),
+                   "matches": len(rows)})
+    return report
+
+
+def statistic_estimate(TeamA, TeamB, Venue, model_inn_1, model_inn_2,
+                       field="first_innings_runs", statistic=np.mean,
+                       half_width=1.0, confidence=0.95, n_boot=1000,
+                       initial=200, growth=2.0, max_matches=10000,
+                       engine=simulate_matches_batch):
+    # Bootstrap interval of any statistic of one of MATCH_FIELDS, e.g. the
+    # 90th percentile of first innings totals with
+    # statistic=lambda x: np.quantile(x, 0.9)
+    column = MATCH_FIELDS.index(field)
+
+    def done(rows):
+        low, high = bootstrap_interval([x[column] for x in rows], statistic,
+                                       confidence, n_boot)
+        return (high - low) / 2 <= half_width
+
+    rows, report = sequential_run(
+        match_sampler(TeamA, TeamB, Venue, model_inn_1, model_inn_2, engine),
+        done, initial, growth, max_matches)
+    values = [x[column] for x in rows]
+    report.update({"estimate": float(statistic(np.asarray(values))),
+                   "interval": bootstrap_interval(values, statistic,
+                                                  confidence, n_boot),
+                   "matches": len(rows)})
+    return report
+
+
+def table_ranking(season_table):
+    # Teams ordered as in EvaluationMetrics.display_table
+    def nrr(team):
+        byrr = (team["ByRuns"] / team["ByBalls"] * 6
+                if team["ByBalls"] != 0 else 0)
+        agrr = (team["AgRuns"] / team["AgBalls"] * 6
+                if team["AgBalls"] != 0 else 0)
+        return byrr - agrr
+    return sorted(season_table, key=lambda x: (-season_table[x]["Points"],
+                                               -nrr(season_table[x])))
+
+
+def finish_probability(model_inn_1, model_inn_2, team, top=4,
+                       half_width=0.02, confidence=0.95, initial=20,
+                       growth=2.0, max_tournaments=1000, batch_size=512):
+    # Chance that team finishes in the top places of an EvaluationMetrics
+    # tournament, with tournaments played through Utils.scheduler
+    from Utils.evaluation import EvaluationMetrics
+    from Utils.scheduler import simulate_tournaments
+
+    def sample(n):
+        evaluator = EvaluationMetrics(model_inn_1, model_inn_2)
+        simulate_tournaments(evaluator, n, batch_size)
+        tables = evaluator.old_season_tables + [evaluator.season_table]
+        return [float(team in table_ranking(table)[:top]) for table in tables]
+
+    def done(values):
+        low, high = wilson_interval(sum(values), len(values), confidence)
+        return (high - low) / 2 <= half_width
+
+    values, report = sequential_run(sample, done, initial, growth,
+                                    max_tournaments)
+    report.update({"probability": sum(values) / len(values),
+                   "interval": wilson_interval(sum(values), len(values),
+                                               confidence),
+                   "tournaments": len(values),
+                   "matches": 56 * len(values)})
+    return report
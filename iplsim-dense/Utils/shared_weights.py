@@ -0,0 +1,189 @@
+import json
+import multiprocessing
+import os
+import random
+import numpy as np
+from multiprocessing import shared_memory
+from Utils.inference import NumpyModel
+
+MAGIC = b"IPLW"
+ALIGN = 64
+# Models already mapped by this process, keyed by path or block name, and
+# the two models of a simulate_parallel worker
+mapped_models = {}
+worker_models = []
+
+
+def weights_layout(model):
+    # Every array is stored in the form NumpyModel.forward uses (float32
+    # kernels, also for int8 and float16 models), so that nothing has to be
+    # converted after mapping
+    arrays = []
+    layers = []
+    offset = 0
+    for layer, W in zip(model.layers, model.kernels):
+        entry = {"activation": layer["activation"], "arrays": {}}
+        for key, value in [["W", W], ["b", layer["b"]],
+                           ["w_scale", layer.get("w_scale")],
+                           ["a_scale", layer.get("a_scale")]]:
+            if value is None:
+                continue
+            value = np.ascontiguousarray(value, dtype=np.float32)
+            entry["arrays"][key] = {"offset": offset,
+                                    "shape": list(value.shape)}
+            arrays.append(value)
+            offset += -(-value.nbytes // ALIGN) * ALIGN
+        layers.append(entry)
+    return {"mode": model.mode, "layers": layers, "size": offset}, arrays
+
+
+def header_bytes(layout):
+    header = json.dumps(layout).encode()
+    length = -(-(len(header) + 12) // ALIGN) * ALIGN
+    header = MAGIC + np.uint64(length).tobytes() + header
+    return header.ljust(length, b" ")
+
+
+def export_weights(model, save_path):
+    # model: NumpyModel, e.g. NumpyModel.from_keras on the HeavyDense
+    # checkpoints. The file holds a small json header followed by the raw
+    # arrays, each aligned to 64 bytes.
+    layout, arrays = weights_layout(model)
+    with open(save_path, "wb") as fp:
+        fp.write(header_bytes(layout))
+        for value in arrays:
+            data = value.tobytes()
+            fp.write(data.ljust(-(-len(data) // ALIGN) * ALIGN, b"\0"))
+    return save_path
+
+
+def export_checkpoint(load_path, save_path):
+    # e.g. export_checkpoint("Models/Inn1-HeavyDense-ep20to50/cp-0029.h5",
+    # "Models/inn1.weights")
+    import tensorflow as tf
+    model = NumpyModel.from_keras(tf.keras.models.load_model(load_path))
+    return export_weights(model, save_path)
+
+
+def model_from_buffer(buffer):
+    # Builds a NumpyModel whose arrays are read-only views into buffer (a
+    # memmap or a shared memory block), without copying any weights
+    buffer = np.frombuffer(buffer, dtype=np.uint8)
+    assert bytes(buffer[:4]) == MAGIC, "Not a weights file"
+    length = int(buffer[4:12].view(np.uint64)[0])
+    layout = json.loads(bytes(buffer[12:length]).decode())
+    layers = []
+    for entry in layout["layers"]:
+        layer = {"activation": entry["activation"]}
+        for key, array in entry["arrays"].items():
+            start = length + array["offset"]
+            count = int(np.prod(array["shape"], dtype=np.int64))
+            value = buffer[start:start + 4 * count].view(np.float32)
+            value = value.reshape(array["shape"])
+            value.flags.writeable = False
+            layer[key] = value
+        layers.append(layer)
+    return NumpyModel(layers, layout["mode"])
+
+
+def map_weights(path):
+    # Every process mapping the same file shares one physical copy through
+    # the page cache
+    if path not in mapped_models:
+        mapped_models[path] = model_from_buffer(np.memmap(path, mode="r"))
+    return mapped_models[path]
+
+
+class SharedWeights():
+    # The same layout as export_weights in a multiprocessing shared memory
+    # block, for when the weights should not go through a file. The creating
+    # process owns the block and has to unlink() it when the workers are done.
+    def __init__(self, model=None, name=None):
+        if model is not None:
+            layout, arrays = weights_layout(model)
+            header = header_bytes(layout)
+            self.shm = shared_memory.SharedMemory(
+                name=name, create=True, size=len(header) + layout["size"])
+            self.shm.buf[:len(header)] = header
+            for entry, value in zip(
+                    [array for layer in layout["layers"]
+                     for array in layer["arrays"].values()], arrays):
+                start = len(header) + entry["offset"]
+                self.shm.buf[start:start + value.nbytes] = value.tobytes()
+        else:
+            assert name is not None, "Give a model to share or a block name"
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+
+    def model(self):
+        return model_from_buffer(self.shm.buf)
+
+    def close(self):
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
+
+
+def attach_weights(name):
+    if name not in mapped_models:
+        shared = SharedWeights(name=name)
+        mapped_models[name] = shared.model()
+        # keeps the block open for as long as the model is in use
+        mapped_models[name].shared = shared
+    return mapped_models[name]
+
+
+def load_weights(source):
+    # source: path of an exported weights file or name of a SharedWeights
+    # block
+    if os.path.exists(source):
+        return map_weights(source)
+    return attach_weights(source)
+
+
+def init_worker(source_inn_1, source_inn_2):
+    # Pool initializer, so that each worker maps the weights once
+    worker_models.extend([load_weights(source_inn_1),
+                          load_weights(source_inn_2)])
+
+
+def simulate_chunk(task):
+    from Utils.batch_simulation import simulate_matches_batch
+    fixtures, seed = task
+    random.seed(seed)
+    matches = simulate_matches_batch(fixtures, *worker_models)
+    return [[inn1.Runs, inn1.Wickets, inn2.Runs, inn2.Wickets, result[1]]
+            for inn1, inn2, result in matches]
+
+
+def simulate_parallel(fixtures, source_inn_1, source_inn_2, n_workers=4,
+                      chunk_size=256, seed=0):
+    # fixtures as in simulate_matches_batch. Returns [first innings runs,
+    # wickets, chase runs, wickets, result] per fixture, where result is 1
+    # for a successful chase, 0 for a defended total and -1 for a tie.
+    tasks = [[fixtures[i:i + chunk_size], seed + i]
+             for i in range(0, len(fixtures), chunk_size)]
+    context = multiprocessing.get_context("fork")
+    with context.Pool(n_workers, init_worker,
+                      (source_inn_1, source_inn_2)) as pool:
+        chunks = pool.map(simulate_chunk, tasks)
+    return [row for chunk in chunks for row in chunk]
+
+
+def mapping_report(path, pid="self"):
+    # Resident and proportional set size of a mapped weights file in one
+    # process, from /proc/<pid>/smaps (Linux only). With n workers sharing
+    # the file, Pss is close to Rss / n.
+    report = {"Rss": 0, "Pss": 0, "Shared_Clean": 0, "Private_Clean": 0,
+              "Private_Dirty": 0}
+    path = os.path.abspath(path)
+    inside = False
+    with open(f"/proc/{pid}/smaps") as fp:
+        for line in fp:
+            fields = line.split()
+            if "-" in fields[0] and len(fields) >= 5:
+                inside = len(fields) >= 6 and fields[5] == path
+            elif inside and fields[0][:-1] in report:
+                report[fields[0][:-1]] += int(fields[1]) * 1024
+    return report
@@ -0,0 +1,28 @@
+import numpy as np
+
+
+def ks_2samp(a, b):
+    # Two sample Kolmogorov-Smirnov test with the asymptotic p-value, so that
+    # the reports do not need scipy
+    a = np.sort(np.asarray(a, dtype=np.float64))
+    b = np.sort(np.asarray(b, dtype=np.float64))
+    values = np.concatenate([a, b])
+    cdf_a = np.searchsorted(a, values, side="right") / a.size
+    cdf_b = np.searchsorted(b, values, side="right") / b.size
+    d = float(np.max(np.abs(cdf_a - cdf_b)))
+    n = a.size * b.size / (a.size + b.size)
+    lam = (np.sqrt(n) + 0.12 + 0.11 / np.sqrt(n)) * d
+    if lam < 1e-3:
+        return d, 1.0
+    k = np.arange(1, 101)
+    p = 2 * np.sum((-1) ** (k - 1) * np.exp(-2 * (k * lam) ** 2))
+    return d, float(min(max(p, 0.0), 1.0))
+
+
+def kl_divergence(p, q, eps=1e-12):
+    # Row-wise KL(p || q) for batches of categorical distributions
+    p = np.clip(np.asarray(p, dtype=np.float64), eps, None)
+    q = np.clip(np.asarray(q, dtype=np.float64), eps, None)
+    p = p / p.sum(axis=-1, keepdims=True)
+    q = q / q.sum(axis=-1, keepdims=True)
+    return np.sum(p * np.log(p / q), axis=-1)
@@ -0,0 +1,188 @@
+import time
+import numpy as np
+from Utils.equivalence import new_innings, innings_summary, innings_engine
+from Utils.importance import FREE_HIT_CODES
+
+# Bucket resolution; innings 1 uses score bands and innings 2 required rate
+# bands in the same slot
+RESOLUTION = {"over_step": 1, "wicket_step": 1, "score_band": 20,
+              "max_score": 260, "rate_band": 1.5, "max_rate": 18.0}
+
+
+class StateTable():
+    # 57-way outcome distributions of one fixture on a grid of (over,
+    # wickets, score or required rate band, striker batting position). The
+    # bowler follows from the over through the Bowling plan, as in
+    # Innings.get_next_bowler. fill() evaluates the model once on a
+    # representative state of every reachable cell; simulate() then plays
+    # innings by table lookup and vectorised sampling.
+    def __init__(self, fixture, innings, **resolution):
+        self.fixture = fixture
+        self.innings = innings
+        self.resolution = dict(RESOLUTION, **resolution)
+        r = self.resolution
+        self.n_over = -(-20 // r["over_step"])
+        self.n_wicket = -(-10 // r["wicket_step"])
+        if innings == 1:
+            self.n_band = r["max_score"] // r["score_band"] + 1
+        else:
+            self.n_band = int(np.ceil(r["max_rate"] / r["rate_band"])) + 1
+        self.shape = (self.n_over, self.n_wicket, self.n_band, 11)
+        self.cell_row = np.full(self.shape, -1, dtype=np.int64)
+        self.probs = None
+        self.fill_seconds = None
+
+    def band(self, runs, target, overs, balls):
+        r = self.resolution
+        if self.innings == 1:
+            return np.minimum(runs // r["score_band"], self.n_band - 1)
+        balls_left = np.maximum(120 - 6 * (overs - 1) - (balls - 1), 1)
+        rate = np.maximum(target - runs, 0) * 6 / balls_left
+        return np.minimum((rate / r["rate_band"]).astype(np.int64),
+                          self.n_band - 1)
+
+    def cells(self, overs, wickets, runs, target, balls, striker):
+        r = self.resolution
+        over = np.minimum(overs - 1, 19) // r["over_step"]
+        wicket = np.minimum(wickets, 9) // r["wicket_step"]
+        return self.cell_row[over, wicket,
+                             self.band(runs, target, overs, balls), striker]
+
+    def representative(self, inn, over, wicket, band, slot):
+        # Model input for the middle of the cell, written through a scratch
+        # innings of the fixture: the run rate and partnership figures are
+        # spread evenly over the balls bowled so far
+        r = self.resolution
+        overs = min(over * r["over_step"] + (r["over_step"] + 1) // 2, 20)
+        wickets = min(wicket * r["wicket_step"] + r["wicket_step"] // 2, 9)
+        if slot > wickets + 1:
+            return None
+        inn.Overs, inn.Balls, inn.Wickets = overs, 3, wickets
+        balls = 6 * (overs - 1) + 2
+        if self.innings == 1:
+            inn.Runs = int((band + 0.5) * r["score_band"])
+        else:
+            rate = (band + 0.5) * r["rate_band"]
+            required = int(round(rate * (120 - balls) / 6))
+            if required > inn.Target:
+                return None
+            inn.Runs = inn.Target - required
+        if inn.Runs > 6 * balls + 12:
+            return None
+        partner = wickets + 1 if slot != wickets + 1 else wickets
+        inn.Striker = inn.Batting_lineup[slot]
+        inn.Non_Striker = inn.Batting_lineup[partner]
+        per_batsman = balls / (wickets + 1) / 2
+        strike_rate = inn.Runs / max(balls, 1)
+        for batsman in [inn.Striker, inn.Non_Striker]:
+            batsman.Balls = int(per_batsman)
+            batsman.Runs = int(per_batsman * strike_rate)
+        inn.Bowler = inn.Bowling_lineup[(overs - 1) % len(inn.Bowling_lineup)]
+        spells = inn.Bowling_lineup[:overs - 1].count(inn.Bowler)
+        inn.Bowler.Overs_Bowled = spells
+        inn.Bowler.Balls_Bowled = 2
+        inn.Bowler.Runs_Conceded = int((6 * spells + 2) * strike_rate)
+        inn.Bowler.Wickets_Taken = [None] * int(
+            wickets * spells / max(overs - 1, 1))
+        return inn.get_model_input()
+
+    def fill(self, model, batch_size=8192):
+        start = time.perf_counter()
+        rows = []
+        inn = new_innings(self.fixture, self.innings)
+        for index in np.ndindex(self.shape):
+            row = self.representative(inn, *index)
+            if row is not None:
+                self.cell_row[index] = len(rows)
+                rows.append(row)
+        rows = np.array(rows)
+        self.probs = np.concatenate(
+            [model.predict(rows[i:i + batch_size], verbose=0)
+             for i in range(0, len(rows), batch_size)]).astype(np.float64)
+        # states outside the reachable cells use the nearest filled cell of
+        # the same over and striker, closest in wickets first
+        filled = self.cell_row.copy()
+        for over in range(self.n_over):
+            for slot in range(11):
+                grid = filled[over, :, :, slot]
+                known = np.argwhere(grid >= 0)
+                if not len(known):
+                    continue
+                for wicket, band in np.argwhere(grid < 0):
+                    distance = (1000 * np.abs(known[:, 0] - wicket)
+                                + np.abs(known[:, 1] - band))
+                    w, b = known[distance.argmin()]
+                    self.cell_row[over, wicket, band, slot] = grid[w, b]
+        self.fill_seconds = time.perf_counter() - start
+        return self
+
+    def __len__(self):
+        return 0 if self.probs is None else len(self.probs)
+
+    def simulate(self, innings_list, rng=None):
+        rng = rng if rng is not None else np.random.default_rng()
+        slots = [{id(b): i for i, b in enumerate(inn.Batting_lineup)}
+                 for inn in innings_list]
+        live = [i for i, inn in enumerate(innings_list)
+                if not inn.innings_over()]
+        while live:
+            inns = [innings_list[i] for i in live]
+            state = np.array([[inn.Overs, inn.Wickets, inn.Runs, inn.Target,
+                               inn.Balls, slots[i][id(inn.Striker)],
+                               inn.Free_Hit] for i, inn in zip(live, inns)])
+            q = self.probs[self.cells(*state[:, :6].T)]
+            free_hit = state[:, 6] == 1
+            if free_hit.any():
+                q = q.copy()
+                q[np.ix_(free_hit, FREE_HIT_CODES)] = 0
+            cdf = q.cumsum(axis=1)
+            u = rng.random(len(live)) * cdf[:, -1]
+            results = np.minimum((cdf < u[:, np.newaxis]).sum(axis=1), 56)
+            for inn, res in zip(inns, results):
+                inn.ball_prediction(int(res))
+            live = [i for i, inn in zip(live, inns) if not inn.innings_over()]
+        return [inn.get_result() for inn in innings_list]
+
+
+def table_engine(tables=None, seed=0, **resolution):
+    # Engine in the form of Utils.equivalence.innings_engine. Tables are
+    # built and filled on first use of a fixture and kept in tables.
+    tables = tables if tables is not None else {}
+    rng = np.random.default_rng(seed)
+
+    def engine(model, fixtures, innings, n_sims):
+        summaries = []
+        for fixture in fixtures:
+            key = (repr(fixture), innings)
+            if key not in tables:
+                tables[key] = StateTable(fixture, innings,
+                                         **resolution).fill(model)
+            inns = [new_innings(fixture, innings) for _ in range(n_sims)]
+            tables[key].simulate(inns, rng)
+            summaries += [innings_summary(inn) for inn in inns]
+        return summaries
+    return engine
+
+
+def error_report(model, fixtures, innings, n_sims=1000, seed=0, alpha=0.01,
+                 **resolution):
+    # The table engine against the exact batched engine: the KS tests of
+    # Utils.equivalence on totals, wickets, extras and phase runs, the
+    # error of the mean total, and the time of both
+    from Utils.equivalence import distribution_test
+    tables = {}
+    start = time.perf_counter()
+    report = distribution_test(model, fixtures, innings,
+                               table_engine(tables, seed, **resolution),
+                               innings_engine(), n_sims, seed, alpha)
+    total = time.perf_counter() - start
+    fill = sum(table.fill_seconds for table in tables.values())
+    start = time.perf_counter()
+    table_engine(tables, seed)(model, fixtures, innings, n_sims)
+    report["table_seconds"] = time.perf_counter() - start
+    report["fill_seconds"] = fill
+    report["exact_seconds"] = total - fill - report["table_seconds"]
+    report["cells"] = sum(len(table) for table in tables.values())
+    report["mean_runs_error"] = (report["runs"]["candidate_mean"]
+                                 - report["runs"]["reference_mean"])
+    return report
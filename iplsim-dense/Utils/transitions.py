@@ -0,0 +1,88 @@
+from Utils.helper import Innings
+from Utils.equivalence import new_innings
+
+# Where the batsmen on strike and at the other end come from after a ball,
+# relative to the striker (S) and non-striker (N) who faced it
+POSITIONS = ["S", "N", "new"]
+transition_cache = {}
+
+
+class ProbeInnings(Innings):
+    # Innings that also records the weights of every swap draw, so that the
+    # probability of each branch of ball_prediction is known
+    def swap_draw(self, weights=None):
+        self.Draw_Weights.append(weights)
+        return super().swap_draw(weights)
+
+
+def probe(code, free_hit, draw, fixture):
+    inn = new_innings(fixture, 1, ProbeInnings)
+    inn.Draw_Weights = []
+    # mid over, so that get_next_ball only moves on to the next ball
+    inn.Balls = 3
+    inn.Free_Hit = free_hit
+    inn.Forced_Draws = iter([draw] * 4)
+    striker, non_striker, bowler = inn.Striker, inn.Non_Striker, inn.Bowler
+    inn.ball_prediction(code)
+    after = {id(striker): "S", id(non_striker): "N"}
+    out = None
+    if striker.Dismissal is not None:
+        out = "S"
+    elif non_striker.Dismissal is not None:
+        out = "N"
+    assert len(inn.Draw_Weights) <= 1, f"Code {code} draws more than once"
+    if not inn.Draw_Weights:
+        probability = 1.0
+    elif inn.Draw_Weights[0] is None:
+        probability = 0.5
+    else:
+        weights = inn.Draw_Weights[0]
+        probability = weights[draw] / sum(weights)
+    return {"probability": probability,
+            "drawn": bool(inn.Draw_Weights),
+            "runs": inn.Runs,
+            "wickets": inn.Wickets,
+            "legal": inn.Balls == 4,
+            "extras": inn.Extras,
+            "free_hit": inn.Free_Hit,
+            "out": out,
+            "striker": after.get(id(inn.Striker), "new"),
+            "non_striker": after.get(id(inn.Non_Striker), "new"),
+            "striker_runs": striker.Runs,
+            "striker_balls": striker.Balls,
+            "non_striker_runs": non_striker.Runs,
+            "non_striker_balls": non_striker.Balls,
+            "bowler_runs": bowler.Runs_Conceded,
+            "bowler_wickets": len(bowler.Wickets_Taken)}
+
+
+def code_transitions():
+    # transitions[free_hit][code]: the outcomes of a ball with that result
+    # code, each with its probability over the swap draw, measured by
+    # playing the code through ball_prediction. Outcomes with the same
+    # effect are merged.
+    if transition_cache:
+        return transition_cache
+    from Utils.sample_squads import RCB_Squad, CSK_Squad, CSK_Pitch
+    fixture = [RCB_Squad[0], CSK_Squad[1], CSK_Squad[0][0], CSK_Pitch, 0]
+    for free_hit in [0, 1]:
+        table = []
+        for code in range(57):
+            outcomes = []
+            first = probe(code, free_hit, 0, fixture)
+            branches = [first]
+            if first["drawn"]:
+                branches.append(probe(code, free_hit, 1, fixture))
+            for branch in branches:
+                effect = {k: v for k, v in branch.items()
+                          if k not in ("probability", "drawn")}
+                for outcome in outcomes:
+                    if outcome["effect"] == effect:
+                        outcome["probability"] += branch["probability"]
+                        break
+                else:
+                    outcomes.append({"probability": branch["probability"],
+                                     "effect": effect})
+            table.append(outcomes)
+        transition_cache[free_hit] = table
+    return transition_cache